@@ -0,0 +1,130 @@
+#!/usr/bin/env python3.6
+# -*- coding: UTF-8 -*-
+
+# Compares the CPU cost of sending one poll to ClickHouse as a list of row dictionaries (InsertMode.ROWS)
+# and as numpy columns (InsertMode.COLUMNAR). Without --host the block is serialized to the ClickHouse native
+# format in memory by the same driver code which is used before writing to the socket. With --host the data
+# is inserted into a Memory table on the server.
+#
+# python -m OPCDataTransfer.Benchmarks.ColumnarInsertBenchmark --tags_number 50000
+
+from clickhouse_driver import Client as ClickHouse_client
+from clickhouse_driver.block import ColumnOrientedBlock
+from clickhouse_driver.block import RowOrientedBlock
+from OPCDataTransfer.Benchmarks.FakeClickHouseClient import get_context
+from OPCDataTransfer.Benchmarks.FakeClickHouseClient import serialize_block
+from OPCDataTransfer.Loader import ClickHouseQueries
+from OPCDataTransfer.OPC.TagTable import TagTable
+import numpy as np
+import argparse
+import datetime
+import statistics
+import time
+
+COLUMNS_WITH_TYPES = [('facility', 'UInt64'), ('component', 'UInt64'), ('parameter', 'UInt64'),
+                      ('value', 'Float32'), ('time', 'DateTime')]
+PARAMETERS_NAME_STRING = 'facility,component,parameter,value,time'
+TABLE_NAME = 'columnar_insert_benchmark'
+
+
+def _make_opc_data(tags_number):
+    # the same structure as in tags_settings_sample.json: 3 parameters for each component, 5 components for facility
+    opc_names_codes_dict = dict()
+    for index in range(tags_number):
+        opc_names_codes_dict['Tag_' + str(index)] = {'facility': 1000 + index // 15,
+                                                     'component': 10000 + index // 3,
+                                                     'parameter': index % 3 + 1}
+    names_list = list(opc_names_codes_dict.keys())
+    values_list = list(np.random.random(tags_number) * 100)
+    return opc_names_codes_dict, names_list, values_list
+
+
+def _make_rows(tag_table, names_list, values_list, current_date):
+    # the same transformation as ConnectionOPC.get_list_of_current_values
+    indexes = tag_table.get_indexes(list(names_list))
+    return tag_table.get_rows(indexes, values_list, current_date)
+
+
+def _make_columns(tag_table, names_list, values_list, current_date):
+    # the same transformation as ConnectionOPC.get_columns_of_current_values
+    columns = tag_table.get_code_columns(tag_table.get_indexes(list(names_list)))
+    columns['value'] = np.array(values_list, dtype=np.float64)
+    columns['time'] = np.full(len(names_list), np.datetime64(current_date, 's'))
+    return columns
+
+
+def _measure(function, repeat_number):
+    # the first call is not measured: imports and timezone lookups are made in the driver on the first insert
+    function()
+    cpu_times = list()
+    for _ in range(repeat_number):
+        start_time = time.process_time()
+        function()
+        cpu_times.append(time.process_time() - start_time)
+    return statistics.median(cpu_times)
+
+
+def run_benchmark(tags_number, repeat_number, host=None):
+    opc_names_codes_dict, names_list, values_list = _make_opc_data(tags_number)
+    tag_table = TagTable(opc_names_codes_dict)
+    current_date = datetime.datetime.now()
+
+    if host is None:
+        rows_context = get_context(use_numpy=False)
+        columns_context = get_context(use_numpy=True)
+
+        def send_rows():
+            rows = _make_rows(tag_table, names_list, values_list, current_date)
+            serialize_block(rows_context, COLUMNS_WITH_TYPES, RowOrientedBlock(COLUMNS_WITH_TYPES, rows),
+                            use_numpy=False)
+
+        def send_columns():
+            columns = _make_columns(tag_table, names_list, values_list, current_date)
+            columns_list = [columns[name] for name, _ in COLUMNS_WITH_TYPES]
+            serialize_block(columns_context, COLUMNS_WITH_TYPES, ColumnOrientedBlock(COLUMNS_WITH_TYPES, columns_list),
+                            use_numpy=True)
+    else:
+        rows_client = ClickHouse_client(host=host)
+        columns_client = ClickHouse_client(host=host, settings={'use_numpy': True})
+        rows_client.execute('CREATE TABLE IF NOT EXISTS ' + TABLE_NAME + ' (facility UInt64, component UInt64, '
+                            'parameter UInt64, value Float32, time DateTime) ENGINE = Memory')
+
+        def send_rows():
+            rows = _make_rows(tag_table, names_list, values_list, current_date)
+            ClickHouseQueries.insert_values_into_table(rows_client, 'default', TABLE_NAME, rows,
+                                                       PARAMETERS_NAME_STRING)
+
+        def send_columns():
+            columns = _make_columns(tag_table, names_list, values_list, current_date)
+            ClickHouseQueries.insert_columns_into_table(columns_client, 'default', TABLE_NAME, columns,
+                                                        PARAMETERS_NAME_STRING)
+
+    results = dict()
+    for mode, function in (('rows', send_rows), ('columnar', send_columns)):
+        cpu_time = _measure(function, repeat_number)
+        results[mode] = {'cpu_time_per_poll': cpu_time, 'cpu_time_per_row': cpu_time / tags_number}
+
+    if host is not None:
+        rows_client.execute('DROP TABLE IF EXISTS ' + TABLE_NAME)
+        rows_client.disconnect()
+        columns_client.disconnect()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tags_number', '-n', type=int, default=50000, help='number of tags in one poll')
+    parser.add_argument('--repeat_number', '-r', type=int, default=10, help='number of measured polls')
+    parser.add_argument('--host', help='ClickHouse host. If not set, the data is serialized in memory')
+    args_namespace = parser.parse_args()
+
+    results = run_benchmark(args_namespace.tags_number, args_namespace.repeat_number, args_namespace.host)
+    for mode, result in results.items():
+        print('{:<10} {:>10.2f} ms per poll {:>8.3f} us per row'.format(
+            mode, result['cpu_time_per_poll'] * 1000, result['cpu_time_per_row'] * 1e6))
+    print('speedup {:.1f}x'.format(results['rows']['cpu_time_per_poll'] / results['columnar']['cpu_time_per_poll']))
+
+
+if __name__ == '__main__':
+    main()
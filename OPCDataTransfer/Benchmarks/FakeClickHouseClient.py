@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+
+# In-process stand-in for the ClickHouse client. The inserted data is serialized to the ClickHouse native format
+# in memory by the same driver code which is used before writing to the socket, so the CPU cost of the insert
+# on the client side is the same as with the real server. The other queries are ignored.
+#
+# loader.set_clickhouse_client_factory(FakeClickHouseClient)
+
+from clickhouse_driver.block import ColumnOrientedBlock
+from clickhouse_driver.block import RowOrientedBlock
+from clickhouse_driver.bufferedwriter import BufferedSocketWriter
+from clickhouse_driver.columns.service import get_column_by_spec
+from clickhouse_driver.context import Context
+import threading
+import re
+
+# types of the columns of the facility_sensor_logs table, the tag codes are UInt64
+_COLUMN_TYPES = {'value': 'Float32', 'time': 'DateTime'}
+_INSERT_COLUMNS_PATTERN = re.compile(r'^\s*INSERT INTO\s+\S+\s*\(([^)]*)\)', re.IGNORECASE)
+
+
+class _NullSocket:
+    def __init__(self):
+        self.bytes_number = 0
+
+    def sendall(self, data):
+        self.bytes_number += len(data)
+
+
+class _ServerInfo:
+    used_revision = 54460
+
+    @staticmethod
+    def get_timezone():
+        return 'UTC'
+
+
+def get_context(use_numpy):
+    context = Context()
+    context.server_info = _ServerInfo()
+    context.settings = dict()
+    context.client_settings = {'use_numpy': use_numpy, 'strings_as_bytes': False, 'strings_encoding': 'utf-8',
+                               'input_format_null_as_default': False}
+    return context
+
+
+def serialize_block(context, columns_with_types, block, use_numpy):
+    # returns the size of the serialized block in bytes
+    null_socket = _NullSocket()
+    writer = BufferedSocketWriter(null_socket, 1048576)
+    column_options = {'context': context, 'types_check': False}
+    for index, (column_name, column_type) in enumerate(columns_with_types):
+        column = get_column_by_spec(column_type, column_options, use_numpy=use_numpy)
+        items = block.get_column_by_index(index)
+        column.write_state_prefix(writer, items)
+        column.write_data(items, writer)
+    writer.flush()
+    return null_socket.bytes_number
+
+
+class FakeClickHouseClient:
+
+    def __init__(self, host=None, user=None, password=None, database=None, settings=None):
+        self._use_numpy = bool(settings and settings.get('use_numpy'))
+        self._context = get_context(self._use_numpy)
+        self._statistics_lock = threading.Lock()
+        self._statistics = {'inserts': 0, 'rows': 0, 'bytes': 0}
+
+    def execute(self, query, params=None, columnar=False):
+        match = _INSERT_COLUMNS_PATTERN.match(query)
+        if match is None or not params:
+            return list()
+
+        columns_with_types = [(name, _COLUMN_TYPES.get(name, 'UInt64'))
+                              for name in match.group(1).replace(' ', '').split(',')]
+        if columnar:
+            block = ColumnOrientedBlock(columns_with_types, params)
+        else:
+            block = RowOrientedBlock(columns_with_types, params)
+        bytes_number = serialize_block(self._context, columns_with_types, block, self._use_numpy)
+
+        with self._statistics_lock:
+            self._statistics['inserts'] += 1
+            self._statistics['rows'] += block.num_rows
+            self._statistics['bytes'] += bytes_number
+        return list()
+
+    def disconnect(self):
+        pass
+
+    def get_statistics(self):
+        with self._statistics_lock:
+            return dict(self._statistics)
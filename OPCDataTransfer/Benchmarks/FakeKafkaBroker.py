@@ -0,0 +1,214 @@
+# -*- coding: UTF-8 -*-
+
+# In-process stand-in for the Kafka cluster. FakeKafkaBroker.create_producer has the same signature
+# as KafkaProducer and returns a producer with the same behavior which matters for the loader: the messages
+# are partitioned by the key with the default partitioner, accumulated in batches by partition (batch_size,
+# linger_ms), compressed and appended to the partition log in the background thread, where the delivery
+# callbacks are called. A part of the batches can be rejected to check the delivery failures.
+#
+# loader.set_kafka_producer_factory(FakeKafkaBroker().create_producer)
+
+from kafka.errors import KafkaTimeoutError
+from kafka.errors import RequestTimedOutError
+from kafka.partitioner.default import DefaultPartitioner
+from collections import namedtuple
+import threading
+import random
+import time
+import zlib
+
+FakeRecordMetadata = namedtuple('FakeRecordMetadata', ['topic', 'partition', 'offset'])
+
+
+class FakeKafkaBroker:
+
+    def __init__(self, partitions_number=8, latency=0.0, failure_rate=0.0):
+        self.partitions_number = partitions_number
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._lock = threading.Lock()
+        self._logs = dict()
+        self._statistics = {'batches': 0, 'failed_batches': 0, 'messages': 0, 'bytes': 0, 'compressed_bytes': 0}
+
+    def create_producer(self, **configs):
+        return FakeKafkaProducer(self, **configs)
+
+    def append_batch(self, topic, partition, records_list, compression_type):
+        # returns the offset of the first record of the batch
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            with self._lock:
+                self._statistics['failed_batches'] += 1
+            raise RequestTimedOutError()
+
+        batch_bytes = b''.join(value for _, value in records_list)
+        compressed_bytes_number = len(zlib.compress(batch_bytes, 1)) if compression_type else len(batch_bytes)
+        with self._lock:
+            log = self._logs.setdefault((topic, partition), list())
+            base_offset = len(log)
+            log.extend(records_list)
+            self._statistics['batches'] += 1
+            self._statistics['messages'] += len(records_list)
+            self._statistics['bytes'] += len(batch_bytes)
+            self._statistics['compressed_bytes'] += compressed_bytes_number
+        return base_offset
+
+    def get_messages(self, topic, partition=None):
+        # the list of (key, value) of the partition, or of all partitions of the topic
+        with self._lock:
+            if partition is not None:
+                return list(self._logs.get((topic, partition), list()))
+            return [record for (log_topic, _), log in sorted(self._logs.items()) if log_topic == topic
+                    for record in log]
+
+    def get_partitions(self, topic):
+        with self._lock:
+            return sorted(partition for log_topic, partition in self._logs.keys() if log_topic == topic)
+
+    def get_statistics(self):
+        with self._lock:
+            return dict(self._statistics)
+
+
+class _FakeFuture:
+    # the part of FutureRecordMetadata used by the senders
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._value = None
+        self._exception = None
+        self._callbacks = list()
+        self._errbacks = list()
+        self._lock = threading.Lock()
+
+    def add_callback(self, function, *args):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append((function, args))
+                return self
+        if self._exception is None:
+            function(*args, self._value)
+        return self
+
+    def add_errback(self, function, *args):
+        with self._lock:
+            if not self._event.is_set():
+                self._errbacks.append((function, args))
+                return self
+        if self._exception is not None:
+            function(*args, self._exception)
+        return self
+
+    def get(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise KafkaTimeoutError('Timeout after waiting for ' + str(timeout) + ' secs.')
+        if self._exception is not None:
+            raise self._exception
+        return self._value
+
+    def complete(self, value=None, exception=None):
+        with self._lock:
+            self._value = value
+            self._exception = exception
+            self._event.set()
+        if exception is not None:
+            for function, args in self._errbacks:
+                function(*args, exception)
+        else:
+            for function, args in self._callbacks:
+                function(*args, value)
+
+
+class FakeKafkaProducer:
+
+    def __init__(self, broker, bootstrap_servers=None, batch_size=16384, linger_ms=0, compression_type=None, acks=1,
+                 **configs):
+        self._broker = broker
+        self._batch_size = batch_size
+        self._linger = linger_ms / 1000
+        self._compression_type = compression_type
+        self._partitioner = DefaultPartitioner()
+        self._condition = threading.Condition()
+        # (topic, partition) -> [creation time, size in bytes, list of (key, value, future)]
+        self._batches = dict()
+        self._ready_batch_keys = list()
+        self._flush_required = False
+        self._sending_batches_number = 0
+        self._closed = False
+        self._sender_thread = threading.Thread(target=self._send_batches, name='FakeKafkaProducer', daemon=True)
+        self._sender_thread.start()
+
+    def send(self, topic, value=None, key=None):
+        partitions_list = list(range(self._broker.partitions_number))
+        partition = self._partitioner(key, partitions_list, partitions_list)
+        future = _FakeFuture()
+        with self._condition:
+            if self._closed:
+                raise KafkaTimeoutError('Producer is closed')
+            batch = self._batches.setdefault((topic, partition), [time.monotonic(), 0, list()])
+            batch[1] += len(value) + (len(key) if key else 0)
+            batch[2].append((key, value, future))
+            if batch[1] >= self._batch_size and (topic, partition) not in self._ready_batch_keys:
+                self._ready_batch_keys.append((topic, partition))
+            self._condition.notify_all()
+        return future
+
+    def flush(self, timeout=None):
+        with self._condition:
+            self._flush_required = True
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: not self._batches and not self._sending_batches_number, timeout)
+            self._flush_required = False
+
+    def close(self, timeout=None):
+        self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._sender_thread.join(timeout)
+
+    def _send_batches(self):
+        while True:
+            with self._condition:
+                batch_key = self._wait_batch()
+                if batch_key is None:
+                    return
+                _, _, records_list = self._batches.pop(batch_key)
+                self._sending_batches_number += 1
+
+            topic, partition = batch_key
+            try:
+                base_offset = self._broker.append_batch(topic, partition,
+                                                        [(key, value) for key, value, _ in records_list],
+                                                        self._compression_type)
+            except RequestTimedOutError as e:
+                for _, _, future in records_list:
+                    future.complete(exception=e)
+            else:
+                for number, (_, _, future) in enumerate(records_list):
+                    future.complete(FakeRecordMetadata(topic, partition, base_offset + number))
+
+            with self._condition:
+                self._sending_batches_number -= 1
+                self._condition.notify_all()
+
+    def _wait_batch(self):
+        # returns the key of the batch which is full, expired or flushed, None when the producer is closed
+        while True:
+            if self._ready_batch_keys:
+                batch_key = self._ready_batch_keys.pop(0)
+                if batch_key in self._batches:
+                    return batch_key
+                continue
+
+            current_time = time.monotonic()
+            timeout = None
+            for batch_key, (creation_time, _, _) in self._batches.items():
+                if self._flush_required or self._closed or current_time - creation_time >= self._linger:
+                    return batch_key
+                batch_timeout = creation_time + self._linger - current_time
+                timeout = batch_timeout if timeout is None else min(timeout, batch_timeout)
+
+            if self._closed:
+                return None
+            self._condition.wait(timeout)
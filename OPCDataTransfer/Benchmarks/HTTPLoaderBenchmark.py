@@ -0,0 +1,78 @@
+#!/usr/bin/env python3.6
+# -*- coding: UTF-8 -*-
+
+# Measures the throughput of the HTTP loader depending on the number of requests in flight when the receiving
+# service answers with a delay. The data is sent to the local stand-in server in the same process.
+#
+# python -m OPCDataTransfer.Benchmarks.HTTPLoaderBenchmark --latency 0.1 --in_flight 1,4,16
+
+from OPCDataTransfer.Benchmarks.HTTPStandInServer import StandInHTTPServer
+from OPCDataTransfer.Loader import Loader
+from OPCDataTransfer.Loader import LoaderType
+import argparse
+import datetime
+import time
+
+PARAMETERS_NAME_STRING = 'facility,component,parameter,value,time'
+
+
+def _get_conf_settings(url, max_in_flight, gzip_required):
+    return {'debug': False, 'verbose': False, 'host': url, 'user': '', 'password': '', 'database_name': '',
+            'table_name': '', 'clickhouse_table_create_query': '', 'http_max_in_flight': max_in_flight,
+            'http_gzip_required': gzip_required,
+            # the loading waits for a free request, so all batches are sent and the throughput is limited by the service
+            'http_submit_timeout': 60}
+
+
+def _make_rows(rows_number):
+    current_date = datetime.datetime.now()
+    return [{'facility': 1000 + index // 15, 'component': 10000 + index // 3, 'parameter': index % 3 + 1,
+             'value': float(index), 'time': current_date} for index in range(rows_number)]
+
+
+def run_benchmark(latency, in_flight_list, batches_number, rows_number, gzip_required):
+    rows = _make_rows(rows_number)
+    results = dict()
+    with StandInHTTPServer(latency=latency) as stand_in_server:
+        for max_in_flight in in_flight_list:
+            conf_settings = _get_conf_settings(stand_in_server.get_url(), max_in_flight, gzip_required)
+            start_statistics = stand_in_server.get_statistics()
+            start_time = time.monotonic()
+            with Loader(LoaderType.HTTP, conf_settings, PARAMETERS_NAME_STRING) as loader:
+                loader.create_session()
+                loader.connect()
+                for _ in range(batches_number):
+                    loader.load_data(rows)
+            # the loader waits for all requests in flight when it is closed
+            elapsed_time = time.monotonic() - start_time
+            metrics = loader.get_metrics()
+
+            statistics = stand_in_server.get_statistics()
+            received_rows = statistics['rows'] - start_statistics['rows']
+            compression_ratio = metrics['uncompressed_bytes'] / max(metrics['sent_bytes'], 1)
+            results[max_in_flight] = {'rows_per_second': received_rows / elapsed_time,
+                                      'batches_per_second': batches_number / elapsed_time,
+                                      'received_rows': received_rows,
+                                      'compression_ratio': compression_ratio}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.1, help='delay of the service answer in seconds')
+    parser.add_argument('--in_flight', default='1,2,4,8,16', help='numbers of requests in flight separated by commas')
+    parser.add_argument('--batches_number', '-b', type=int, default=50, help='number of sent batches')
+    parser.add_argument('--rows_number', '-n', type=int, default=1000, help='number of rows in one batch')
+    parser.add_argument('--no_gzip', action='store_true', help="don't compress the request bodies")
+    args_namespace = parser.parse_args()
+
+    in_flight_list = [int(value) for value in args_namespace.in_flight.split(',')]
+    results = run_benchmark(args_namespace.latency, in_flight_list, args_namespace.batches_number,
+                            args_namespace.rows_number, not args_namespace.no_gzip)
+    for max_in_flight, result in results.items():
+        print('in flight {:>3} {:>10.0f} rows/s {:>8.1f} batches/s  compression {:.1f}x'.format(
+            max_in_flight, result['rows_per_second'], result['batches_per_second'], result['compression_ratio']))
+
+
+if __name__ == '__main__':
+    main()
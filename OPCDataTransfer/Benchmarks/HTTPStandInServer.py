@@ -0,0 +1,134 @@
+#!/usr/bin/env python3.6
+# -*- coding: UTF-8 -*-
+
+# Local stand-in for the HTTP service receiving the data. It accepts json (optionally gzip compressed) bodies
+# of POST requests, counts the received rows and answers after the given latency. A part of the requests
+# can be answered with 503 to check the retries. Used by the benchmarks in the same process, or separately:
+#
+# python -m OPCDataTransfer.Benchmarks.HTTPStandInServer --port 8080 --latency 0.2
+
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+import threading
+import argparse
+import random
+import json
+import gzip
+import time
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # keep-alive connections, as in the real service
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        stand_in_server = self.server.stand_in_server
+        time.sleep(stand_in_server.latency)
+
+        if random.random() < stand_in_server.failure_rate:
+            stand_in_server.count_request(rows_number=0, bytes_number=len(body), failed=True)
+            self._answer(503)
+            return
+
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except ValueError:
+            stand_in_server.count_request(rows_number=0, bytes_number=len(body), failed=True)
+            self._answer(400)
+            return
+
+        # the rows are sent as a list of dictionaries or as a dictionary of columns
+        if isinstance(data, dict):
+            rows_number = len(next(iter(data.values()))) if data else 0
+        else:
+            rows_number = len(data)
+        stand_in_server.count_request(rows_number=rows_number, bytes_number=len(body), failed=False)
+        self._answer(200)
+
+    def _answer(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInHTTPServer:
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._server = None
+        self._server_thread = None
+        self._statistics_lock = threading.Lock()
+        self._statistics = {'requests': 0, 'failed_requests': 0, 'rows': 0, 'bytes': 0}
+
+        self._server = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self._server.stand_in_server = self
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        self._server_thread = threading.Thread(target=self._server.serve_forever, name='StandInHTTPServer',
+                                               daemon=True)
+        self._server_thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._server_thread.join()
+
+    def get_url(self):
+        host, port = self._server.server_address
+        return 'http://' + host + ':' + str(port) + '/'
+
+    def count_request(self, rows_number, bytes_number, failed):
+        with self._statistics_lock:
+            self._statistics['requests'] += 1
+            self._statistics['bytes'] += bytes_number
+            if failed:
+                self._statistics['failed_requests'] += 1
+            else:
+                self._statistics['rows'] += rows_number
+
+    def get_statistics(self):
+        with self._statistics_lock:
+            return dict(self._statistics)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen')
+    parser.add_argument('--latency', type=float, default=0.0, help='delay of each answer in seconds')
+    parser.add_argument('--failure_rate', type=float, default=0.0, help='part of the requests answered with 503')
+    args_namespace = parser.parse_args()
+
+    stand_in_server = StandInHTTPServer(args_namespace.host, args_namespace.port, args_namespace.latency,
+                                        args_namespace.failure_rate)
+    stand_in_server.start()
+    print('Listening on ' + stand_in_server.get_url())
+    try:
+        while True:
+            time.sleep(10)
+            print(stand_in_server.get_statistics())
+    except KeyboardInterrupt:
+        stand_in_server.close()
+
+
+if __name__ == '__main__':
+    main()
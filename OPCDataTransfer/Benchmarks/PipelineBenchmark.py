@@ -0,0 +1,248 @@
+#!/usr/bin/env python3.6
+# -*- coding: UTF-8 -*-
+
+# End-to-end benchmark of the transfer cycle: poll of the synthetic OPC source -> deadband filter -> transformation
+# to rows or columns -> loader (batching) -> in-process sink (FakeClickHouseClient or StandInHTTPServer).
+# The cycles are run by the polling loop of DataTransfer (transfer_data) with the scheduler of period 0,
+# so they go one after another without waiting. The poll period is nominal: it sets the part of the tags changed
+# between polls and the cycle time the loop must keep up with (keeps_up), the measurement itself doesn't wait.
+# Each point of the sweep (tags number x poll period x sink) is run in a separate process,
+# so the peak RSS belongs to that point. CPU time includes the in-process sink. The results are saved as json
+# and can be compared with the results of the previous run:
+#
+# python -m OPCDataTransfer.Benchmarks.PipelineBenchmark --output results.json --compare previous_results.json
+
+from OPCDataTransfer.Benchmarks.FakeClickHouseClient import FakeClickHouseClient
+from OPCDataTransfer.Benchmarks.HTTPStandInServer import StandInHTTPServer
+from OPCDataTransfer.DataTransfer import transfer_data
+from OPCDataTransfer.OPC import ConnectionOPC
+from OPCDataTransfer.OPC.Sources import OPCSourceType
+from OPCDataTransfer.OPC.Sources import get_synthetic_tags_codes
+from OPCDataTransfer.Loader import Loader
+from OPCDataTransfer.Loader import LoaderType
+from OPCDataTransfer.Loader import InsertMode
+from OPCDataTransfer.ServiceFunctions import MultiRateScheduler
+from OPCDataTransfer.ServiceFunctions import StageMetrics
+from OPCDataTransfer.ServiceFunctions import Stage
+import numpy as np
+import multiprocessing
+import subprocess
+import contextlib
+import argparse
+import platform
+import tempfile
+import json
+import time
+import sys
+import os
+
+SINKS = ('clickhouse', 'http')
+# part of the tags changed between polls with the period of 1 second, it grows with the period
+CHANGE_RATE_PER_SECOND = 0.05
+# the changes smaller than the tolerance are suppressed by the deadband filter
+DEADBAND_SETTINGS = {'default': {'absolute': 0.5, 'heartbeat': 60}}
+
+
+def _get_peak_rss():
+    # peak resident set size of the process in bytes
+    try:
+        import resource
+    except ImportError:
+        return _get_windows_peak_rss()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def _get_windows_peak_rss():
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters),
+                                             counters.cb)
+    return counters.PeakWorkingSetSize
+
+
+def _get_conf_settings(tags_settings_file_path, tags_number, period, insert_mode, batch_max_rows):
+    return {'debug': False, 'verbose': False, 'frequency': period, 'tags_branch_opc_server': '',
+            'tags_settings_file_path': tags_settings_file_path, 'logs_file_path': '', 'debug_level': '',
+            'opc_source': OPCSourceType.SYNTHETIC, 'opc_synthetic_tags_number': tags_number,
+            'opc_synthetic_change_rate': min(1.0, CHANGE_RATE_PER_SECOND * period),
+            'host': '', 'user': '', 'password': '', 'database_name': '', 'table_name': '',
+            'clickhouse_table_create_query': '', 'insert_mode': insert_mode, 'batch_max_rows': batch_max_rows,
+            'http_gzip_required': True, 'http_submit_timeout': 60, 'plotting_required': False}
+
+
+class _CycleTimer:
+    # the cycle counter of transfer_data: the time between the calls of count_cycle is the time of the whole cycle,
+    # including the scheduler
+
+    def __init__(self, cycles_number):
+        self._cycles_number = None
+        self._last_time = None
+        self.cycle_times = list()
+
+        self._cycles_number = cycles_number
+
+    def start(self):
+        self._last_time = time.perf_counter()
+
+    def count_cycle(self):
+        current_time = time.perf_counter()
+        self.cycle_times.append(current_time - self._last_time)
+        self._last_time = current_time
+        return len(self.cycle_times) < self._cycles_number
+
+
+def run_point(tags_number, period, sink, insert_mode, cycles_number, batch_max_rows):
+    # one point of the sweep, returns the dictionary of the measured values
+    with tempfile.TemporaryDirectory() as temporary_directory_path, contextlib.ExitStack() as exit_stack:
+        tags_settings_file_path = os.path.join(temporary_directory_path, 'tags_settings.json')
+        with open(tags_settings_file_path, 'w') as tags_settings_file:
+            json.dump({'codes_and_plotting_names': dict(),
+                       'opc_names_and_codes': get_synthetic_tags_codes(tags_number),
+                       'deadband_settings': DEADBAND_SETTINGS}, tags_settings_file)
+        conf_settings = _get_conf_settings(tags_settings_file_path, tags_number, period, insert_mode, batch_max_rows)
+
+        opc_client = exit_stack.enter_context(ConnectionOPC(conf_settings))
+        if sink == 'http':
+            stand_in_server = exit_stack.enter_context(StandInHTTPServer())
+            conf_settings['host'] = stand_in_server.get_url()
+            loader = Loader(LoaderType.HTTP, conf_settings, opc_client.get_parameters_name_string())
+        else:
+            loader = Loader(LoaderType.CLICKHOUSE_DRIVER, conf_settings, opc_client.get_parameters_name_string())
+            loader.set_clickhouse_client_factory(FakeClickHouseClient)
+        loader.create_session()
+        loader.connect()
+        metrics = StageMetrics()
+        loader.set_metrics(metrics)
+        # the groups of the tags are polled without waiting
+        scheduler = MultiRateScheduler({group_name: 0 for group_name in opc_client.get_groups_update_rates()})
+        cycle_timer = _CycleTimer(cycles_number)
+
+        start_time = time.perf_counter()
+        start_cpu_time = time.process_time()
+        # the rest of the batch and the requests in flight are sent on closing of the loader
+        with contextlib.ExitStack() as transfer_exit_stack:
+            transfer_exit_stack.enter_context(loader)
+            transfer_data(conf_settings, opc_client, [loader], scheduler, metrics, transfer_exit_stack, cycle_timer)
+        elapsed_time = time.perf_counter() - start_time
+        cpu_time = time.process_time() - start_cpu_time
+
+    stages_metrics = metrics.get_metrics()
+    polled_values_number = stages_metrics[Stage.OPC_READ]['rows']
+    rows_number = stages_metrics[Stage.LOAD]['rows']
+    cycle_times = np.array(cycle_timer.cycle_times)
+    return {'tags_number': tags_number,
+            'period': period,
+            'sink': sink,
+            'insert_mode': insert_mode,
+            'cycles': cycles_number,
+            'polled_values': polled_values_number,
+            'polled_values_per_second': polled_values_number / elapsed_time,
+            # the rows passed by the deadband filter and loaded to the sink
+            'rows': rows_number,
+            'rows_per_second': rows_number / elapsed_time,
+            'cpu_time_per_row_us': cpu_time / max(rows_number, 1) * 1e6,
+            'peak_rss_mb': _get_peak_rss() / 1048576,
+            'cycle_time_p50_ms': float(np.percentile(cycle_times, 50)) * 1000,
+            'cycle_time_p99_ms': float(np.percentile(cycle_times, 99)) * 1000,
+            # the cycle must fit into the poll period
+            'keeps_up': bool(np.percentile(cycle_times, 99) < period)}
+
+
+def _run_point_in_process(arguments):
+    return run_point(*arguments)
+
+
+def run_benchmark(tags_numbers_list, periods_list, sinks_list, insert_mode, cycles_number, batch_max_rows):
+    results_list = list()
+    context = multiprocessing.get_context('spawn')
+    for tags_number in tags_numbers_list:
+        for period in periods_list:
+            for sink in sinks_list:
+                arguments = (tags_number, period, sink, insert_mode, cycles_number, batch_max_rows)
+                with context.Pool(1) as pool:
+                    result = pool.apply(_run_point_in_process, (arguments,))
+                _print_result(result)
+                results_list.append(result)
+    return results_list
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.realpath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_result(result):
+    print('{tags_number:>7} tags {period:>5} s {sink:<10} {rows_per_second:>11.0f} rows/s '
+          '{cpu_time_per_row_us:>7.2f} us/row {peak_rss_mb:>7.1f} MB  cycle p50 {cycle_time_p50_ms:>8.2f} ms '
+          'p99 {cycle_time_p99_ms:>8.2f} ms'.format(**result))
+
+
+def _compare_results(results_list, previous_results_file_path):
+    with open(previous_results_file_path, 'r') as previous_results_file:
+        previous_results = json.load(previous_results_file)
+    print('Comparison with ' + str(previous_results.get('commit')) + ' (current / previous):')
+
+    def get_key(result):
+        return result['tags_number'], result['period'], result['sink'], result['insert_mode']
+
+    previous_results_dict = {get_key(result): result for result in previous_results['results']}
+    for result in results_list:
+        previous_result = previous_results_dict.get(get_key(result))
+        if previous_result is None:
+            continue
+        print('{:>7} tags {:>5} s {:<10} rows/s {:>6.2f}  cpu/row {:>6.2f}  rss {:>6.2f}  p99 {:>6.2f}'.format(
+            result['tags_number'], result['period'], result['sink'],
+            result['rows_per_second'] / previous_result['rows_per_second'],
+            result['cpu_time_per_row_us'] / previous_result['cpu_time_per_row_us'],
+            result['peak_rss_mb'] / previous_result['peak_rss_mb'],
+            result['cycle_time_p99_ms'] / previous_result['cycle_time_p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tags_numbers', default='100,1000,10000,100000', help='numbers of tags separated by commas')
+    parser.add_argument('--periods', default='0.1,1,10', help='poll periods in seconds separated by commas')
+    parser.add_argument('--sinks', default=','.join(SINKS), help='sinks separated by commas: clickhouse, http')
+    parser.add_argument('--insert_mode', default=InsertMode.ROWS.value, help='rows or columnar')
+    parser.add_argument('--cycles_number', '-c', type=int, default=50, help='number of measured cycles')
+    parser.add_argument('--batch_max_rows', type=int, default=50000, help='maximum number of rows in the batch')
+    parser.add_argument('--output', '-o', help='path to the json file with the results')
+    parser.add_argument('--compare', help='path to the json file with the previous results to compare')
+    args_namespace = parser.parse_args()
+
+    results_list = run_benchmark([int(value) for value in args_namespace.tags_numbers.split(',')],
+                                 [float(value) for value in args_namespace.periods.split(',')],
+                                 args_namespace.sinks.replace(' ', '').split(','),
+                                 args_namespace.insert_mode,
+                                 args_namespace.cycles_number,
+                                 args_namespace.batch_max_rows)
+
+    if args_namespace.output:
+        with open(args_namespace.output, 'w') as output_file:
+            json.dump({'commit': get_commit(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'settings': vars(args_namespace),
+                       'results': results_list}, output_file, indent=2)
+    if args_namespace.compare:
+        _compare_results(results_list, args_namespace.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3.6
+# -*- coding: UTF-8 -*-
+
+# Measures the redraw rate of DataFigure (frames per second) with the headless Agg backend for different numbers
+# of series, with and without blitting. Each frame appends one value to every series of the history and redraws
+# the figure. The frame time of the last frames is compared with the first ones, it must not grow with the number
+# of redraws. The results are saved as json and can be compared with the results of the previous run:
+#
+# python -m OPCDataTransfer.Benchmarks.PlottingBenchmark --series_numbers 10,100,1000 --output results.json
+
+import matplotlib
+matplotlib.use('Agg')
+
+from OPCDataTransfer.Benchmarks.PipelineBenchmark import get_commit
+from OPCDataTransfer.ServiceFunctions import SeriesHistory
+from OPCDataTransfer.Visualization import DataFigure
+import matplotlib.pyplot as plt
+import numpy as np
+import argparse
+import platform
+import json
+import time
+
+START_TIME = 1577880000.0
+# the first frames create the caches of the backend and are not measured
+WARM_UP_FRAMES_NUMBER = 5
+
+
+def run_point(series_number, axes_number, blit_required, frames_number, diagram_series_len):
+    axes_number = min(axes_number, series_number)
+    # the series are split into axes by facility
+    opc_names_codes_dict = {'tag_' + str(index): {'facility': index % axes_number, 'component': index}
+                            for index in range(series_number)}
+    codes_plotting_names_dict = {('component', index): 'series ' + str(index) for index in range(series_number)}
+    codes_dicts_list = list(opc_names_codes_dict.values())
+    series_history = SeriesHistory(codes_dicts_list, diagram_series_len)
+    series_indexes = np.arange(series_number)
+    random_generator = np.random.default_rng(0)
+
+    frame_times = list()
+    with DataFigure(codes_plotting_names_dict, opc_names_codes_dict, 'facility', diagram_series_len,
+                    blit_required) as data_figure:
+        plt.gcf().set_size_inches(12, 2 * axes_number)
+        for frame_number in range(WARM_UP_FRAMES_NUMBER + frames_number):
+            series_history.append(series_indexes, random_generator.normal(size=series_number),
+                                  np.datetime64(int(START_TIME) + frame_number, 's'))
+            frame_start_time = time.perf_counter()
+            data_figure.plot_history(series_history)
+            if frame_number >= WARM_UP_FRAMES_NUMBER:
+                frame_times.append(time.perf_counter() - frame_start_time)
+
+    frame_times = np.array(frame_times)
+    tenth_number = max(len(frame_times) // 10, 1)
+    return {'series_number': series_number,
+            'axes_number': axes_number,
+            'blit': blit_required,
+            'frames': frames_number,
+            'frames_per_second': len(frame_times) / frame_times.sum(),
+            'frame_time_p50_ms': float(np.percentile(frame_times, 50)) * 1000,
+            'frame_time_p99_ms': float(np.percentile(frame_times, 99)) * 1000,
+            # the median frame time of the last tenth of the frames to the first tenth
+            'frame_time_growth': float(np.median(frame_times[-tenth_number:]) / np.median(frame_times[:tenth_number]))}
+
+
+def run_benchmark(series_numbers_list, axes_number, blit_modes_list, frames_number, diagram_series_len):
+    results_list = list()
+    for series_number in series_numbers_list:
+        for blit_required in blit_modes_list:
+            result = run_point(series_number, axes_number, blit_required, frames_number, diagram_series_len)
+            _print_result(result)
+            results_list.append(result)
+    return results_list
+
+
+def _print_result(result):
+    print('{series_number:>6} series {axes_number:>3} axes blit {blit!s:<5} {frames_per_second:>8.1f} frames/s '
+          'p50 {frame_time_p50_ms:>8.2f} ms p99 {frame_time_p99_ms:>8.2f} ms '
+          'growth {frame_time_growth:>5.2f}'.format(**result))
+
+
+def _compare_results(results_list, previous_results_file_path):
+    with open(previous_results_file_path, 'r') as previous_results_file:
+        previous_results = json.load(previous_results_file)
+    print('Comparison with ' + str(previous_results.get('commit')) + ' (current / previous):')
+
+    def get_key(result):
+        return result['series_number'], result['axes_number'], result['blit']
+
+    previous_results_dict = {get_key(result): result for result in previous_results['results']}
+    for result in results_list:
+        previous_result = previous_results_dict.get(get_key(result))
+        if previous_result is None:
+            continue
+        print('{:>6} series blit {!s:<5} frames/s {:>6.2f}  p99 {:>6.2f}'.format(
+            result['series_number'], result['blit'],
+            result['frames_per_second'] / previous_result['frames_per_second'],
+            result['frame_time_p99_ms'] / previous_result['frame_time_p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--series_numbers', default='10,100,1000', help='numbers of series separated by commas')
+    parser.add_argument('--axes_number', type=int, default=5, help='number of axes the series are split into')
+    parser.add_argument('--blit_modes', default='false,true', help='blitting modes separated by commas')
+    parser.add_argument('--frames_number', '-n', type=int, default=100, help='number of measured frames')
+    parser.add_argument('--diagram_series_len', type=int, default=100, help='number of points of each series')
+    parser.add_argument('--output', '-o', help='path to the json file with the results')
+    parser.add_argument('--compare', help='path to the json file with the previous results to compare')
+    args_namespace = parser.parse_args()
+
+    results_list = run_benchmark([int(value) for value in args_namespace.series_numbers.split(',')],
+                                 args_namespace.axes_number,
+                                 [value.strip().lower() == 'true' for value in args_namespace.blit_modes.split(',')],
+                                 args_namespace.frames_number,
+                                 args_namespace.diagram_series_len)
+
+    if args_namespace.output:
+        with open(args_namespace.output, 'w') as output_file:
+            json.dump({'commit': get_commit(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'settings': vars(args_namespace),
+                       'results': results_list}, output_file, indent=2)
+    if args_namespace.compare:
+        _compare_results(results_list, args_namespace.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3.6
+# -*- coding: UTF-8 -*-
+
+# Measures the cost of one step of the simulation model for the bundled SimulationParameters and for the scaled
+# ones (the facilities are copied scale times), for both engines. The results are saved as json and can be compared
+# with the results of the previous run:
+#
+# python -m OPCDataTransfer.Benchmarks.SimulationBenchmark --scales 1,100 --output results.json
+
+from OPCDataTransfer.Benchmarks.PipelineBenchmark import get_commit
+from OPCDataTransfer.Simulation import SimulationParameters
+from OPCDataTransfer.Simulation import SimulationEngine
+from OPCDataTransfer.Simulation import create_simulation_model
+import numpy as np
+import contextlib
+import argparse
+import platform
+import json
+import time
+import os
+
+ENGINES = (SimulationEngine.DICT, SimulationEngine.VECTORIZED)
+START_TIME = 1577880000.0
+TIME_STEP = 20
+# the first steps initialize the states and are not measured
+WARM_UP_STEPS_NUMBER = 3
+
+
+def run_point(scale, engine, steps_number):
+    np.random.seed(0)
+    simulation_model = create_simulation_model(engine, SimulationParameters(scale))
+    tags_number = len(simulation_model.get_current_controller_parameters_values_list())
+
+    step_times = list()
+    current_time = START_TIME
+    # the dict engine prints the jumps of the values
+    with open(os.devnull, 'w') as null_file, contextlib.redirect_stdout(null_file):
+        for step_number in range(WARM_UP_STEPS_NUMBER + steps_number):
+            step_start_time = time.perf_counter()
+            simulation_model.make_model_iteration(current_time)
+            if step_number >= WARM_UP_STEPS_NUMBER:
+                step_times.append(time.perf_counter() - step_start_time)
+            current_time += TIME_STEP
+
+    step_times = np.array(step_times)
+    return {'scale': scale,
+            'engine': engine,
+            'tags_number': tags_number,
+            'steps': steps_number,
+            'step_time_mean_ms': float(step_times.mean()) * 1000,
+            'step_time_p50_ms': float(np.percentile(step_times, 50)) * 1000,
+            'step_time_p99_ms': float(np.percentile(step_times, 99)) * 1000,
+            'step_time_per_tag_us': float(step_times.mean()) / max(tags_number, 1) * 1e6}
+
+
+def run_benchmark(scales_list, engines_list, steps_number):
+    results_list = list()
+    for scale in scales_list:
+        for engine in engines_list:
+            result = run_point(scale, engine, steps_number)
+            _print_result(result)
+            results_list.append(result)
+    return results_list
+
+
+def _print_result(result):
+    print('scale {scale:>5} {tags_number:>7} tags {engine:<10} step mean {step_time_mean_ms:>9.3f} ms '
+          'p50 {step_time_p50_ms:>9.3f} ms p99 {step_time_p99_ms:>9.3f} ms '
+          '{step_time_per_tag_us:>7.3f} us/tag'.format(**result))
+
+
+def _compare_results(results_list, previous_results_file_path):
+    with open(previous_results_file_path, 'r') as previous_results_file:
+        previous_results = json.load(previous_results_file)
+    print('Comparison with ' + str(previous_results.get('commit')) + ' (current / previous):')
+
+    previous_results_dict = {(result['scale'], result['engine']): result for result in previous_results['results']}
+    for result in results_list:
+        previous_result = previous_results_dict.get((result['scale'], result['engine']))
+        if previous_result is None:
+            continue
+        print('scale {:>5} {:<10} step mean {:>6.2f}  p99 {:>6.2f}'.format(
+            result['scale'], result['engine'],
+            result['step_time_mean_ms'] / previous_result['step_time_mean_ms'],
+            result['step_time_p99_ms'] / previous_result['step_time_p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', default='1,100',
+                        help='numbers of copies of the bundled facilities separated by commas')
+    parser.add_argument('--engines', default=','.join(ENGINES), help='engines separated by commas: dict, vectorized')
+    parser.add_argument('--steps_number', '-n', type=int, default=200, help='number of measured steps')
+    parser.add_argument('--output', '-o', help='path to the json file with the results')
+    parser.add_argument('--compare', help='path to the json file with the previous results to compare')
+    args_namespace = parser.parse_args()
+
+    results_list = run_benchmark([int(value) for value in args_namespace.scales.split(',')],
+                                 args_namespace.engines.replace(' ', '').split(','),
+                                 args_namespace.steps_number)
+
+    if args_namespace.output:
+        with open(args_namespace.output, 'w') as output_file:
+            json.dump({'commit': get_commit(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'settings': vars(args_namespace),
+                       'results': results_list}, output_file, indent=2)
+    if args_namespace.compare:
+        _compare_results(results_list, args_namespace.compare)
+
+
+if __name__ == '__main__':
+    main()
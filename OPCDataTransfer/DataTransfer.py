@@ -2,53 +2,172 @@
 # -*- coding: UTF-8 -*-
 
 from OPCDataTransfer import ConnectionOPC
+from OPCDataTransfer.OPC import DeadbandFilter
+from OPCDataTransfer.OPC import EndOfRecordingError
 from OPCDataTransfer import Loader
 from OPCDataTransfer import LoaderType
+from OPCDataTransfer import InsertMode
 from OPCDataTransfer import Visualization
 from OPCDataTransfer.ServiceFunctions import ArgParser
+from OPCDataTransfer.ServiceFunctions import create_profiler
+from OPCDataTransfer.ServiceFunctions import MultiRateScheduler
+from OPCDataTransfer.ServiceFunctions import SeriesHistory
+from OPCDataTransfer.ServiceFunctions import StageMetrics
+from OPCDataTransfer.ServiceFunctions import MetricsExporter
+from OPCDataTransfer.ServiceFunctions import Stage
 from OPCDataTransfer import ConfParser
+from OPCDataTransfer import DataPipeline
+from OPCDataTransfer.Loader import LoaderSpool
+import contextlib
 import time
 
 
-def start_transfer_data_from_opc_server(conf_settings):
+def start_transfer_data_from_opc_server(conf_settings, profiler=None):
+    # establish client connections with OPC server and data receivers
+    with ConnectionOPC(conf_settings) as opc_client, contextlib.ExitStack() as exit_stack:
+        # the durations of the stages of the cycle and the numbers of rows, errors, etc. The metrics are exposed
+        # on the local http port metrics_port and (or) in the file metrics_file_path
+        metrics = StageMetrics()
+        opc_client.set_metrics(metrics)
+        if conf_settings.get('metrics_port') or conf_settings.get('metrics_file_path'):
+            exit_stack.enter_context(MetricsExporter(metrics, conf_settings))
+
+        loaders_list = _create_loaders(conf_settings, opc_client, exit_stack)
+        for loader in loaders_list:
+            loader.set_metrics(metrics)
+
+        # polling ticks are aligned to the clock, so the reading and loading time doesn't shift the period.
+        # Each OPC group is read with its own update rate
+        scheduler = MultiRateScheduler(opc_client.get_groups_update_rates(), conf_settings.get('missed_ticks_policy'))
+        transfer_data(conf_settings, opc_client, loaders_list, scheduler, metrics, exit_stack, profiler)
+
+
+def transfer_data(conf_settings, opc_client, loaders_list, scheduler, metrics, exit_stack, cycle_counter=None):
+    # The polling loop: OPC groups due by the scheduler -> deadband filter -> rows or columns -> loader (or pipeline)
+    # and diagram. The pipeline and the plotting process are closed by exit_stack. cycle_counter (Profiler or
+    # the cycle timer of the benchmark) is started before the first cycle, its count_cycle() is called after
+    # each cycle and stops the loop when it returns False
     plotting_required = conf_settings['plotting_required']
+    pipelined_mode = conf_settings.get('pipelined_mode')
+    columnar_mode = conf_settings.get('insert_mode') == InsertMode.COLUMNAR.value
+
+    # in the pipelined mode the data is loaded in separate threads, so a slow receiver does not delay polling
+    if pipelined_mode:
+        pipeline = exit_stack.enter_context(DataPipeline(conf_settings))
+        pipeline.start(loaders_list)
+
+    # initialize diagram. It is drawn in a separate process, which reads the last diagram_series_len values
+    # of each tag from the shared history
+    if plotting_required:
+        data_history = SeriesHistory(list(opc_client.get_opc_names_codes_dict().values()),
+                                     conf_settings['diagram_series_len'], shared=True)
+        exit_stack.enter_context(_create_plotting_process(conf_settings, opc_client, data_history))
+
+    # values of the tags which didn't change are not sent (if deadband settings are set for the tags)
+    deadband_filter = None
+    if opc_client.get_deadband_settings():
+        deadband_filter = DeadbandFilter(opc_client.get_tag_table(), opc_client.get_deadband_settings())
+
+    metrics.set_scheduler(scheduler)
+    if cycle_counter is not None:
+        cycle_counter.start()
+    while True:
+        due_group_names_list = scheduler.wait_next_tick()
+        cycle_start_time = time.perf_counter()
+
+        # get current data from OPC server
+        try:
+            current_values = opc_client.read_groups_values(due_group_names_list)
+        except EndOfRecordingError:
+            # the replay of the recorded data is finished
+            break
+        read_end_time = time.perf_counter()
+        metrics.observe(Stage.OPC_READ, read_end_time - cycle_start_time, len(current_values))
+
+        if deadband_filter is not None:
+            current_values = deadband_filter.apply(current_values)
+        if columnar_mode:
+            param_list = opc_client.convert_values_to_columns(current_values)
+        else:
+            param_list = opc_client.convert_values_to_list(current_values)
+        transform_end_time = time.perf_counter()
+        metrics.observe(Stage.TRANSFORM, transform_end_time - read_end_time, len(current_values))
 
-    # establish client connections with OPC server and data receiver
-    with ConnectionOPC(conf_settings) as opc_client, \
-            Loader(LoaderType.CLICKHOUSE_DRIVER, conf_settings, opc_client.get_parameters_name_string()) as loader:
+        # send the received data to the receiver (http service, database, etc.)
+        if pipelined_mode:
+            pipeline.put(param_list)
+        else:
+            loaders_list[0].load_data(param_list)
+        load_end_time = time.perf_counter()
+        metrics.observe(Stage.LOAD, load_end_time - transform_end_time, len(current_values))
 
-        # initialize diagram
+        # display data on diagram
         if plotting_required:
-            data_figure = Visualization.DataFigure(opc_client.get_codes_plotting_names_dict(),
-                                                   opc_client.get_opc_names_codes_dict(),
-                                                   conf_settings['diagram_split_keys'],
-                                                   conf_settings['diagram_series_len'])
-            data_history_list = list()
+            if columnar_mode:
+                data_history.append_columns(param_list)
+            else:
+                data_history.append_rows(param_list)
+            metrics.observe(Stage.PLOT, time.perf_counter() - load_end_time, len(current_values))
 
-        loader.create_session()
-        loader.connect()
-        while True:
-            # get current data from OPC server
-            param_list = opc_client.get_list_of_current_values()
+        metrics.observe(Stage.CYCLE, time.perf_counter() - cycle_start_time, len(current_values))
+
+        if cycle_counter is not None and not cycle_counter.count_cycle():
+            break
+
+
+def _create_plotting_process(conf_settings, opc_client, data_history):
+    return Visualization.PlottingProcess(data_history,
+                                         opc_client.get_codes_plotting_names_dict(),
+                                         opc_client.get_opc_names_codes_dict(),
+                                         conf_settings['diagram_split_keys'],
+                                         conf_settings['diagram_series_len'],
+                                         conf_settings.get('diagram_blit_required'),
+                                         conf_settings.get('diagram_refresh_period'),
+                                         conf_settings.get('diagram_snapshot_directory_path'),
+                                         conf_settings.get('diagram_snapshot_format'))
 
-            # send the received data to the receiver (http service, database, etc.)
-            loader.load_data(param_list)
 
-            # display data on diagram
-            if plotting_required:
-                data_history_list.extend(param_list)
-                data_figure.plot_top_values_from_history_list(data_history_list)
+def _create_loaders(conf_settings, opc_client, exit_stack):
+    # the spool is closed after the loaders, so the data they fail to send on closing is saved
+    spool = None
+    if conf_settings.get('spool_directory_path'):
+        spool = exit_stack.enter_context(LoaderSpool(conf_settings))
+
+    # each pipeline consumer needs its own loader, since the receiver sessions are not thread-safe
+    loaders_number = 1
+    if conf_settings.get('pipelined_mode') and conf_settings.get('consumers_number'):
+        loaders_number = conf_settings['consumers_number']
+
+    loader_type = LoaderType[(conf_settings.get('loader_type') or LoaderType.CLICKHOUSE_DRIVER.name).upper()]
+    loaders_list = list()
+    for _ in range(loaders_number):
+        loader = exit_stack.enter_context(Loader(loader_type, conf_settings,
+                                                 opc_client.get_parameters_name_string()))
+        loader.set_spool(spool)
+        loader.create_session()
+        loader.connect()
+        loaders_list.append(loader)
 
-            time.sleep(opc_client.get_frequency())
+    if spool is not None:
+        spool.start_replay(loaders_list[0].send_spooled_data)
+        # the replay is stopped before the loaders close its session, the spool itself is closed after them
+        exit_stack.callback(spool.stop_replay)
+    return loaders_list
 
 
 def main():
     # parse startup parameters from the command line
-    args_namespace = ArgParser().get_namespace()
+    args_namespace = ArgParser(profiling_required=True).get_namespace()
     # read the run settings file
     conf_settings = ConfParser(args_namespace.settings_file_path).get_settings()
 
-    start_transfer_data_from_opc_server(conf_settings)
+    # with --profile the cycles are profiled and the program stops after --profile_cycles or --profile_seconds
+    profiler = create_profiler(args_namespace, 'DataTransfer')
+    if profiler is None:
+        start_transfer_data_from_opc_server(conf_settings)
+        return
+    with profiler:
+        start_transfer_data_from_opc_server(conf_settings, profiler)
 
 
 if __name__ == '__main__':
@@ -18,3 +18,14 @@ def insert_values_into_table(client, db_name, table_name, list_data, parameters_
         'INSERT INTO ' + full_table_name + ' (' + parameters_name_string + ') VALUES',
         list_data
     )
+
+
+def insert_columns_into_table(client, db_name, table_name, columns_dict, parameters_name_string):
+    # the client must be created with the use_numpy setting, then the columns are sent without conversion to rows
+    full_table_name = db_name + '.' + table_name
+    columns_list = [columns_dict[name] for name in parameters_name_string.split(',')]
+    client.execute(
+        'INSERT INTO ' + full_table_name + ' (' + parameters_name_string + ') VALUES',
+        columns_list,
+        columnar=True
+    )
@@ -0,0 +1,181 @@
+# -*- coding: UTF-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+from OPCDataTransfer.Loader.JsonEncoding import json_default
+from OPCDataTransfer.Loader.SendResult import SendResult
+from OPCDataTransfer.Loader.SendResult import is_retryable
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+from requests.exceptions import Timeout
+import threading
+import random
+import json
+import gzip
+
+# statuses after which the same request may succeed later (the receiver is overloaded or restarting)
+_RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+# Sends the data to the HTTP service from a pool of worker threads. Up to max_in_flight requests are sent
+# at the same time over the keep-alive connections of one pool, so the throughput grows with the latency
+# of the receiver. A failed request is repeated by the worker with exponential backoff and jitter.
+# The caller waits for a free request at most submit_timeout seconds (by default it doesn't wait): when all
+# max_in_flight requests are in progress (the receiver is slow or down and the workers repeat the requests),
+# the new data is passed to failure_callback as unavailable, so the polling is not stalled by the retries.
+class HTTPSender:
+
+    def __init__(self, destination, print_function, max_in_flight=None, gzip_required=None, max_retries=None,
+                 retry_backoff=None, timeout=None, submit_timeout=None):
+        self._destination = None
+        self._print = None
+        self._max_in_flight = None
+        self._gzip_required = None
+        self._max_retries = None
+        self._retry_backoff = None
+        self._timeout = None
+        self._submit_timeout = None
+        self._session = None
+        self._executor = None
+        self._in_flight_semaphore = None
+        self._stop_event = threading.Event()
+        self._metrics_lock = threading.Lock()
+        self._metrics = dict()
+
+        self._destination = destination
+        self._print = print_function
+        self._max_in_flight = max_in_flight if max_in_flight else 4
+        self._gzip_required = bool(gzip_required)
+        self._max_retries = max_retries if max_retries is not None else 3
+        self._retry_backoff = retry_backoff if retry_backoff else 0.5
+        self._timeout = timeout if timeout else 5
+        self._submit_timeout = submit_timeout if submit_timeout else 0
+        self._metrics = {'requests': 0,
+                         'failed_requests': 0,
+                         'retries': 0,
+                         'sent_batches': 0,
+                         'failed_batches': 0,
+                         'rejected_batches': 0,
+                         'sent_bytes': 0,
+                         'uncompressed_bytes': 0}
+
+        # one connection for each request in flight, the retries are made here, not by urllib3
+        self._session = requests.Session()
+        self._session.mount(self._destination, HTTPAdapter(pool_connections=1, pool_maxsize=self._max_in_flight,
+                                                           max_retries=0))
+        self._executor = ThreadPoolExecutor(max_workers=self._max_in_flight)
+        self._in_flight_semaphore = threading.BoundedSemaphore(self._max_in_flight)
+
+    def close(self):
+        # the requests in progress are completed, but they are not repeated any more
+        self._stop_event.set()
+        self._executor.shutdown(wait=True)
+        self._session.close()
+
+    def submit(self, data, failure_callback):
+        # data is a json compatible object. failure_callback(data, send_result) is called from the worker thread
+        # if the data is rejected by the receiver or the receiver is still unavailable after all retries.
+        # It is called from the caller thread if all requests are still in progress after submit_timeout
+        if not self._in_flight_semaphore.acquire(timeout=self._submit_timeout):
+            self._print('All ' + str(self._max_in_flight) + ' HTTP requests are in progress, the data is not sent')
+            self._count_batch(SendResult.UNAVAILABLE)
+            failure_callback(data, SendResult.UNAVAILABLE)
+            return
+        try:
+            future = self._executor.submit(self._send_with_retries, data)
+        except RuntimeError:
+            # the sender is closed
+            self._in_flight_semaphore.release()
+            raise
+        future.add_done_callback(lambda done_future: self._complete(done_future, data, failure_callback))
+
+    def send(self, data):
+        # synchronous sending without retries, returns SendResult
+        result = self._post(self._encode(data))
+        self._count_batch(result)
+        return result
+
+    def _complete(self, future, data, failure_callback):
+        self._in_flight_semaphore.release()
+        try:
+            result = future.result()
+        except (TypeError, ValueError) as e:
+            # the data can't be encoded to json
+            self._print('Error while encoding data for HTTP: ' + repr(e))
+            result = SendResult.REJECTED
+        except Exception as e:
+            self._print('Error while sending data by HTTP: ' + repr(e))
+            result = SendResult.UNAVAILABLE
+        self._count_batch(result)
+        if result != SendResult.ACCEPTED:
+            failure_callback(data, result)
+
+    def _send_with_retries(self, data):
+        body = self._encode(data)
+        attempt_number = 0
+        while True:
+            result = self._post(body)
+            if not is_retryable(result):
+                return result
+            if attempt_number >= self._max_retries or self._stop_event.is_set():
+                return result
+
+            # full jitter, so the workers don't repeat the requests to the restarted receiver at the same moment
+            delay = random.uniform(0, self._retry_backoff * 2 ** attempt_number)
+            attempt_number += 1
+            with self._metrics_lock:
+                self._metrics['retries'] += 1
+            if self._stop_event.wait(delay):
+                return result
+
+    def _post(self, body):
+        # returns SendResult, the request may be repeated if the receiver is unavailable or didn't answer in time
+        headers = {'Content-Type': 'application/json'}
+        if self._gzip_required:
+            headers['Content-Encoding'] = 'gzip'
+        with self._metrics_lock:
+            self._metrics['requests'] += 1
+
+        try:
+            response = self._session.post(self._destination, data=body, headers=headers, timeout=self._timeout)
+        except Timeout:
+            self._print('The request timed out')
+            result = SendResult.TIMEOUT
+        except ConnectionError as ce:
+            self._print(ce)
+            result = SendResult.UNAVAILABLE
+        else:
+            if response.ok:
+                with self._metrics_lock:
+                    self._metrics['sent_bytes'] += len(body)
+                return SendResult.ACCEPTED
+            self._print('HTTP service returned status ' + str(response.status_code))
+            result = SendResult.UNAVAILABLE if response.status_code in _RETRY_STATUSES else SendResult.REJECTED
+
+        with self._metrics_lock:
+            self._metrics['failed_requests'] += 1
+        return result
+
+    def _encode(self, data):
+        body = json.dumps(data, default=json_default).encode('utf-8')
+        with self._metrics_lock:
+            self._metrics['uncompressed_bytes'] += len(body)
+        if self._gzip_required:
+            # a low level is enough for the repeated tag codes and takes much less time than the default 9
+            body = gzip.compress(body, compresslevel=1)
+        return body
+
+    def _count_batch(self, result):
+        with self._metrics_lock:
+            if result == SendResult.ACCEPTED:
+                self._metrics['sent_batches'] += 1
+            elif result == SendResult.REJECTED:
+                self._metrics['rejected_batches'] += 1
+            else:
+                self._metrics['failed_batches'] += 1
+
+    def get_metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics['max_in_flight'] = self._max_in_flight
+        return metrics
@@ -0,0 +1,25 @@
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+import datetime
+
+
+def json_default(value):
+    # the time of the rows is sent as a string in the ISO format
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def get_json_compatible_columns(columns_dict):
+    # numpy arrays can't be serialized to json, the dates are sent as strings
+    json_dict = dict()
+    for name, column in columns_dict.items():
+        if not isinstance(column, np.ndarray):
+            # the data from the spool may be already converted
+            json_dict[name] = column
+        elif column.dtype.kind == 'M':
+            json_dict[name] = np.datetime_as_string(column).tolist()
+        else:
+            json_dict[name] = column.tolist()
+    return json_dict
@@ -0,0 +1,221 @@
+# -*- coding: UTF-8 -*-
+
+from OPCDataTransfer.Loader import JsonEncoding
+from OPCDataTransfer.Loader.SendResult import SendResult
+from OPCDataTransfer.Loader.SendResult import is_retryable
+from kafka import KafkaProducer
+from kafka.errors import KafkaError
+from kafka.errors import MessageSizeTooLargeError
+from kafka.errors import KafkaTimeoutError
+from kafka.errors import RequestTimedOutError
+import numpy as np
+import threading
+import operator
+import json
+import time
+
+# acknowledgments accepted by the producer, -1 is the same as all
+_ACKS_VALUES = ('all', '-1', '0', '1')
+
+
+# Publishes the data to the Kafka topic. The rows are grouped by the key codes (facility, component by default),
+# each group is one message with the key made of the code values, so the data of one facility/component always
+# goes to the same partition and keeps its order. The messages are accumulated in batches by the producer
+# (batch_size, linger_ms) and compressed as a whole batch. The delivery results come to the callbacks
+# in the producer thread and are counted in the metrics, undelivered data is passed to failure_callback
+# with the SendResult of the failure.
+class KafkaSender:
+
+    def __init__(self, bootstrap_servers, topic, print_function, key_codes=None, batch_size=None, linger_ms=None,
+                 compression_type=None, acks=None, timeout=None, producer_factory=None):
+        self._topic = None
+        self._print = None
+        self._key_codes = None
+        self._timeout = None
+        self._producer = None
+        self._metrics_lock = threading.Lock()
+        self._metrics = dict()
+
+        self._topic = topic
+        self._print = print_function
+        self._key_codes = key_codes if key_codes else ['facility', 'component']
+        self._timeout = timeout if timeout else 30
+        self._metrics = {'sent_messages': 0,
+                         'delivered_messages': 0,
+                         'failed_messages': 0,
+                         'delivered_rows': 0,
+                         'sent_bytes': 0,
+                         'max_delivery_time': 0.0,
+                         'delivery_time': 0.0}
+
+        # the producer factory is replaced by the fake broker in tests and benchmarks
+        if producer_factory is None:
+            producer_factory = KafkaProducer
+        if not compression_type:
+            compression_type = 'gzip'
+        # the numbers of acknowledgments come from the settings file as strings, the producer accepts only 'all'
+        # or the number
+        if not acks:
+            acks = 'all'
+        if str(acks) not in _ACKS_VALUES:
+            raise ValueError('kafka_acks must be one of ' + ', '.join(_ACKS_VALUES) + ', not ' + str(acks))
+        if acks != 'all':
+            acks = int(acks)
+        self._producer = producer_factory(bootstrap_servers=bootstrap_servers.replace(' ', '').split(','),
+                                          batch_size=batch_size if batch_size else 1048576,
+                                          linger_ms=linger_ms if linger_ms is not None else 100,
+                                          compression_type=None if compression_type == 'none' else compression_type,
+                                          acks=acks)
+
+    def close(self):
+        # the accumulated messages are sent and their delivery callbacks are called before closing
+        self._producer.flush(timeout=self._timeout)
+        self._producer.close(timeout=self._timeout)
+
+    def submit(self, data, failure_callback):
+        # failure_callback(data, send_result) is called with the data of each message which was not delivered
+        for message_data, rows_number, key, value in self._get_messages(data):
+            try:
+                future = self._producer.send(self._topic, value=value, key=key)
+            except KafkaError as ke:
+                # the producer buffer is full or the topic metadata is unavailable
+                failure_callback(message_data, self._on_send_error(ke))
+                continue
+            self._count_sent_message(len(value))
+            future.add_callback(self._on_delivered, rows_number, time.monotonic())
+            future.add_errback(self._on_failed, message_data, failure_callback)
+
+    def send(self, data, failure_callback):
+        # synchronous sending, returns SendResult. If no message is delivered and all of them may be delivered
+        # later, the result of the failure is returned and the whole data may be sent again. Otherwise
+        # failure_callback(data, send_result) is called with the data of each undelivered message,
+        # so the delivered messages are not sent twice
+        futures_list = list()
+        failures_list = list()
+        for message_data, rows_number, key, value in self._get_messages(data):
+            try:
+                future = self._producer.send(self._topic, value=value, key=key)
+            except KafkaError as ke:
+                failures_list.append((message_data, self._on_send_error(ke)))
+                continue
+            self._count_sent_message(len(value))
+            futures_list.append((future, message_data, rows_number, time.monotonic()))
+
+        delivered_number = 0
+        for future, message_data, rows_number, send_time in futures_list:
+            try:
+                record_metadata = future.get(timeout=self._timeout)
+            except KafkaError as ke:
+                failures_list.append((message_data, self._on_send_error(ke)))
+                continue
+            self._on_delivered(rows_number, send_time, record_metadata)
+            delivered_number += 1
+
+        if not failures_list:
+            return SendResult.ACCEPTED
+        if not delivered_number and all(is_retryable(result) for _, result in failures_list):
+            return failures_list[0][1]
+        for message_data, result in failures_list:
+            failure_callback(message_data, result)
+        return SendResult.ACCEPTED if delivered_number else SendResult.REJECTED
+
+    def _on_send_error(self, kafka_error):
+        self._print('Kafka error ' + repr(kafka_error))
+        self._count_failed_message()
+        return _get_failure_result(kafka_error)
+
+    def _on_delivered(self, rows_number, send_time, record_metadata):
+        delivery_time = time.monotonic() - send_time
+        with self._metrics_lock:
+            self._metrics['delivered_messages'] += 1
+            self._metrics['delivered_rows'] += rows_number
+            self._metrics['delivery_time'] += delivery_time
+            if delivery_time > self._metrics['max_delivery_time']:
+                self._metrics['max_delivery_time'] = delivery_time
+
+    def _on_failed(self, message_data, failure_callback, exception):
+        self._print('Kafka message is not delivered ' + repr(exception))
+        self._count_failed_message()
+        failure_callback(message_data, _get_failure_result(exception))
+
+    def _count_sent_message(self, value_size):
+        with self._metrics_lock:
+            self._metrics['sent_messages'] += 1
+            self._metrics['sent_bytes'] += value_size
+
+    def _count_failed_message(self):
+        with self._metrics_lock:
+            self._metrics['failed_messages'] += 1
+
+    def _get_messages(self, data):
+        # returns the tuples (data of the message, number of rows, key, value) for each key
+        if isinstance(data, dict):
+            messages_data = self._split_columns(data)
+        else:
+            messages_data = self._split_rows(data)
+
+        for key_values, message_data in messages_data:
+            key = ','.join(str(value) for value in key_values).encode('utf-8') if key_values else None
+            if isinstance(message_data, dict):
+                rows_number = len(next(iter(message_data.values())))
+                json_data = JsonEncoding.get_json_compatible_columns(message_data)
+            else:
+                rows_number = len(message_data)
+                json_data = message_data
+            value = json.dumps(json_data, default=JsonEncoding.json_default).encode('utf-8')
+            yield message_data, rows_number, key, value
+
+    def _split_rows(self, rows_list):
+        if not rows_list:
+            return list()
+        key_codes = [code_name for code_name in self._key_codes if code_name in rows_list[0]]
+        if not key_codes:
+            return [((), rows_list)]
+
+        key_getter = operator.itemgetter(*key_codes)
+        rows_by_key = dict()
+        for row in rows_list:
+            rows_by_key.setdefault(key_getter(row), list()).append(row)
+        if len(key_codes) == 1:
+            return [((key,), rows) for key, rows in rows_by_key.items()]
+        return list(rows_by_key.items())
+
+    def _split_columns(self, columns_dict):
+        if not columns_dict or not len(next(iter(columns_dict.values()))):
+            return list()
+        key_columns = [columns_dict[code_name] for code_name in self._key_codes if code_name in columns_dict]
+        if not key_columns:
+            return [((), columns_dict)]
+
+        # the rows are sorted by the key columns, the groups are the ranges of equal keys
+        order = np.lexsort(key_columns[::-1])
+        sorted_key_columns = [key_column[order] for key_column in key_columns]
+        key_changes = np.zeros(len(order), dtype=bool)
+        key_changes[0] = True
+        for sorted_key_column in sorted_key_columns:
+            key_changes[1:] |= sorted_key_column[1:] != sorted_key_column[:-1]
+        starts = np.flatnonzero(key_changes)
+        ends = np.append(starts[1:], len(order))
+
+        messages_data = list()
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            positions = order[start:end]
+            key_values = tuple(sorted_key_column[start].item() for sorted_key_column in sorted_key_columns)
+            messages_data.append((key_values, {name: column[positions] for name, column in columns_dict.items()}))
+        return messages_data
+
+    def get_metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        delivery_time = metrics.pop('delivery_time')
+        metrics['average_delivery_time'] = delivery_time / max(metrics['delivered_messages'], 1)
+        return metrics
+
+
+def _get_failure_result(kafka_error):
+    if isinstance(kafka_error, MessageSizeTooLargeError):
+        # the message will never be accepted by the broker
+        return SendResult.REJECTED
+    if isinstance(kafka_error, (KafkaTimeoutError, RequestTimedOutError)):
+        return SendResult.TIMEOUT
+    return SendResult.UNAVAILABLE
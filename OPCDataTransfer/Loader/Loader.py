@@ -2,14 +2,21 @@
 
 from enum import Enum
 from OPCDataTransfer.Loader import ClickHouseQueries
-import requests
-from requests.adapters import HTTPAdapter
-from requests.exceptions import ConnectionError
-from requests.exceptions import Timeout
+from OPCDataTransfer.Loader import JsonEncoding
+from OPCDataTransfer.Loader.HTTPSender import HTTPSender
+from OPCDataTransfer.Loader.KafkaSender import KafkaSender
+from OPCDataTransfer.Loader.SendResult import SendResult
+from OPCDataTransfer.Loader.SendResult import is_retryable
+from OPCDataTransfer.ServiceFunctions.StageMetrics import Stage
 from clickhouse_driver import Client as ClickHouse_client
 from clickhouse_driver.errors import SocketTimeoutError
+from clickhouse_driver.errors import NetworkError
 from builtins import print
+import numpy as np
+import itertools
+import datetime
 import logging
+import time
 
 
 class LoaderType(Enum):
@@ -18,6 +25,13 @@ class LoaderType(Enum):
     CLICKHOUSE_DRIVER = 3
 
 
+class InsertMode(Enum):
+    # the data is a list of dictionaries, one for each row
+    ROWS = 'rows'
+    # the data is a dictionary of numpy arrays, one for each column
+    COLUMNAR = 'columnar'
+
+
 class Loader:
     def __init__(self, sender_type, conf_settings, parameters_name_string):
         self._debug = None
@@ -31,7 +45,32 @@ class Loader:
         self._table = None
         self._clickhouse_table_create_query = None
         self._session = None
+        self._replay_session = None
+        self._spool = None
         self._parameters_name_string = None
+        self._insert_mode = None
+        self._batch_max_rows = None
+        self._batch_max_bytes = None
+        self._batch_max_linger = None
+        self._batch_data = list()
+        self._batch_rows = 0
+        self._batch_bytes = 0
+        self._batch_start_time = None
+        self._http_max_in_flight = None
+        self._http_gzip_required = None
+        self._http_max_retries = None
+        self._http_retry_backoff = None
+        self._http_timeout = None
+        self._http_submit_timeout = None
+        self._kafka_topic = None
+        self._kafka_key_codes = None
+        self._kafka_batch_size = None
+        self._kafka_linger_ms = None
+        self._kafka_compression_type = None
+        self._kafka_acks = None
+        self._kafka_producer_factory = None
+        self._clickhouse_client_factory = ClickHouse_client
+        self._metrics = None
 
         self._debug = conf_settings['debug']
         self._set_logger(conf_settings)
@@ -44,6 +83,10 @@ class Loader:
         self._table = conf_settings['table_name'] if conf_settings['table_name'] else 'facility_sensor_logs'
         self._clickhouse_table_create_query = conf_settings['clickhouse_table_create_query']
         self._parameters_name_string = parameters_name_string
+        self._insert_mode = InsertMode(conf_settings.get('insert_mode') or InsertMode.ROWS.value)
+        self._set_batch_settings(conf_settings)
+        self._set_http_settings(conf_settings)
+        self._set_kafka_settings(conf_settings)
 
     def __enter__(self):
         return self
@@ -52,12 +95,44 @@ class Loader:
         self.close()
 
     def close(self):
-        if self._type == LoaderType.HTTP:
-            self._session.close()
-            self._print('HTTP session has been closed')
-        elif self._type == LoaderType.CLICKHOUSE_DRIVER:
-            self._session.disconnect()
-            self._print('ClickHouse session has been closed')
+        # the accumulated data must not be lost when the loader is closed
+        self.flush()
+
+        for session in (self._session, self._replay_session):
+            if session is None:
+                continue
+            if self._type == LoaderType.HTTP:
+                # waits for the requests in flight
+                session.close()
+                self._print('HTTP session has been closed. ' + str(session.get_metrics()))
+            elif self._type == LoaderType.KAFKA:
+                # waits for the delivery of the accumulated messages
+                session.close()
+                self._print('Kafka producer has been closed. ' + str(session.get_metrics()))
+            elif self._type == LoaderType.CLICKHOUSE_DRIVER:
+                session.disconnect()
+                self._print('ClickHouse session has been closed')
+
+    def set_clickhouse_client_factory(self, client_factory):
+        # client_factory(**settings) is used instead of the ClickHouse client, for example the fake client in tests
+        self._clickhouse_client_factory = client_factory
+
+    def set_kafka_producer_factory(self, producer_factory):
+        # producer_factory(**configs) is used instead of KafkaProducer, for example the fake broker in tests
+        self._kafka_producer_factory = producer_factory
+
+    def set_spool(self, spool):
+        # the data which could not be sent is written to the spool and replayed later
+        self._spool = spool
+
+    def set_metrics(self, metrics):
+        # StageMetrics which measure the sending of the data to the receiver
+        self._metrics = metrics
+
+    def get_metrics(self):
+        if self._type in (LoaderType.HTTP, LoaderType.KAFKA) and self._session is not None:
+            return self._session.get_metrics()
+        return dict()
 
     def _print(self, message):
         if self._verbose:
@@ -66,21 +141,45 @@ class Loader:
             self._logger.info(message)
 
     def create_session(self):
+        self._session = self._new_session()
+
+    def _new_session(self):
         if self._type == LoaderType.HTTP:
-            self._session = requests.Session()
+            session = HTTPSender(self._destination,
+                                 self._print,
+                                 max_in_flight=self._http_max_in_flight,
+                                 gzip_required=self._http_gzip_required,
+                                 max_retries=self._http_max_retries,
+                                 retry_backoff=self._http_retry_backoff,
+                                 timeout=self._http_timeout,
+                                 submit_timeout=self._http_submit_timeout)
             self._print('HTTP session created')
+            return session
+        elif self._type == LoaderType.KAFKA:
+            session = KafkaSender(self._destination,
+                                  self._kafka_topic,
+                                  self._print,
+                                  key_codes=self._kafka_key_codes,
+                                  batch_size=self._kafka_batch_size,
+                                  linger_ms=self._kafka_linger_ms,
+                                  compression_type=self._kafka_compression_type,
+                                  acks=self._kafka_acks,
+                                  producer_factory=self._kafka_producer_factory)
+            self._print('Kafka producer created')
+            return session
         elif self._type == LoaderType.CLICKHOUSE_DRIVER:
-            self._session = ClickHouse_client(host=self._destination,
-                                              user=self._user,
-                                              password=self._password,
-                                              database=self._database)
+            # numpy arrays can be inserted only by the client with the use_numpy setting
+            settings = {'use_numpy': True} if self._insert_mode == InsertMode.COLUMNAR else None
+            session = self._clickhouse_client_factory(host=self._destination,
+                                                      user=self._user,
+                                                      password=self._password,
+                                                      database=self._database,
+                                                      settings=settings)
             self._print('ClickHouse client session created')
+            return session
 
     def connect(self):
-        if self._type == LoaderType.HTTP:
-            http_adapter = HTTPAdapter(max_retries=3)
-            self._session.mount(self._destination, http_adapter)
-        elif self._type == LoaderType.CLICKHOUSE_DRIVER:
+        if self._type == LoaderType.CLICKHOUSE_DRIVER:
             try:
                 ClickHouseQueries.create_database_if_not_exists(self._session, self._database)
                 ClickHouseQueries.create_table_if_not_exists(self._session,
@@ -88,28 +187,214 @@ class Loader:
             except SocketTimeoutError as ste:
                 self._print('ClickHouse SocketTimeoutError ' + str(ste))
 
+    def send_spooled_data(self, data):
+        # called from the spool replay thread, returns SendResult. The replay has its own session, since
+        # the sessions are not thread-safe and the replay must not interfere with loading of the current data
+        if self._replay_session is None:
+            self._replay_session = self._new_session()
+        return self._send_data(data, self._replay_session)
+
     def load_data(self, data):
-        if not data:
+        if not self._batching_required():
+            self._send_or_spool_data(data)
+            return
+
+        if data:
+            if not self._batch_data:
+                self._batch_start_time = time.monotonic()
+            self._batch_data.append(data)
+            self._batch_rows += self.get_rows_number(data)
+            self._batch_bytes += self._estimate_data_size(data)
+
+        if self._is_batch_full() or self._is_batch_expired():
+            self.flush()
+
+    def flush(self):
+        if not self._batch_data:
+            return
+
+        batch_data = self._merge_data(self._batch_data)
+        self._batch_data = list()
+        self._batch_rows = 0
+        self._batch_bytes = 0
+        self._batch_start_time = None
+        self._send_or_spool_data(batch_data)
+
+    def flush_if_expired(self):
+        # called periodically when no new data comes, so the data doesn't wait longer than batch_max_linger
+        if self._is_batch_expired():
+            self.flush()
+
+    def _batching_required(self):
+        return bool(self._batch_max_rows or self._batch_max_bytes or self._batch_max_linger)
+
+    def _is_batch_full(self):
+        if self._batch_max_rows and self._batch_rows >= self._batch_max_rows:
+            return True
+        if self._batch_max_bytes and self._batch_bytes >= self._batch_max_bytes:
+            return True
+        return False
+
+    def _is_batch_expired(self):
+        if not self._batch_data:
+            return False
+        if not self._batch_max_linger:
+            # without the linger limit the batch is sent only when it is full
+            return False
+        return time.monotonic() - self._batch_start_time >= self._batch_max_linger
+
+    def get_rows_number(self, data):
+        if self._insert_mode == InsertMode.COLUMNAR:
+            return len(next(iter(data.values()))) if data else 0
+        return len(data)
+
+    def _merge_data(self, data_list):
+        if len(data_list) == 1:
+            return data_list[0]
+        if self._insert_mode == InsertMode.COLUMNAR:
+            return {name: np.concatenate([data[name] for data in data_list]) for name in data_list[0]}
+        return list(itertools.chain.from_iterable(data_list))
+
+    def _estimate_data_size(self, data):
+        if self._insert_mode == InsertMode.COLUMNAR:
+            return sum(column.nbytes for column in data.values())
+
+        # all rows have the same structure, so the size of the first row is used for the whole list.
+        # Numbers and dates are estimated by the size of the largest ClickHouse type for them
+        row_size = 0
+        for value in data[0].values():
+            if isinstance(value, str):
+                row_size += len(value)
+            elif isinstance(value, (int, float, datetime.datetime)):
+                row_size += 8
+            else:
+                row_size += 16
+        return row_size * len(data)
+
+    def _send_or_spool_data(self, data):
+        if self._type == LoaderType.HTTP and data:
+            # the request is sent in the background, the data is written to the spool if all retries fail
+            self._count_submitted_data(data)
+            if self._insert_mode == InsertMode.COLUMNAR:
+                data = JsonEncoding.get_json_compatible_columns(data)
+            self._session.submit(data, self._on_send_failure)
             return
+        if self._type == LoaderType.KAFKA and data:
+            # the messages are delivered in the background, the undelivered ones are written to the spool
+            self._count_submitted_data(data)
+            self._session.submit(data, self._on_send_failure)
+            return
+
+        result = self._send_data(data, self._session)
+        if is_retryable(result):
+            self._spool_data(data)
+        elif result == SendResult.REJECTED:
+            self._print('The data is rejected by the receiver and is not spooled')
 
+    def _count_submitted_data(self, data):
+        if self._metrics is not None:
+            self._metrics.count_data(Stage.SEND, self.get_rows_number(data), self._estimate_data_size(data))
+
+    def _on_send_failure(self, data, send_result):
+        # the data (or a part of it) sent in the background or not delivered by Kafka is counted
+        # and spooled, unless the receiver rejects it
+        if self._metrics is not None:
+            self._metrics.count_error(Stage.SEND, timeout=send_result == SendResult.TIMEOUT)
+        if is_retryable(send_result):
+            self._spool_data(data)
+        else:
+            self._print('The data is rejected by the receiver and is not spooled')
+
+    def _spool_data(self, data):
+        if self._spool is not None:
+            self._spool.append(data)
+            self._print('The data is written to the spool')
+
+    def _send_data(self, data, session):
+        # returns SendResult: the rejected data is dropped, the data which may be accepted later is spooled
+        if not data:
+            return SendResult.ACCEPTED
+
+        # the size is estimated before sending, since the ClickHouse client converts the rows to lists in place
+        rows_number = self.get_rows_number(data)
+        bytes_number = self._estimate_data_size(data) if self._metrics is not None else 0
+        send_start_time = time.perf_counter()
+        try:
+            result = self._send_data_to_receiver(data, session)
+        except Exception:
+            if self._metrics is not None:
+                self._metrics.count_error(Stage.SEND)
+            raise
+        if self._metrics is not None:
+            if result == SendResult.ACCEPTED:
+                self._metrics.observe(Stage.SEND, time.perf_counter() - send_start_time, rows_number, bytes_number)
+            else:
+                self._metrics.count_error(Stage.SEND, timeout=result == SendResult.TIMEOUT)
+        return result
+
+    def _send_data_to_receiver(self, data, session):
+        rows_number = self.get_rows_number(data)
         if self._type == LoaderType.HTTP:
-            try:
-                self._session.post(self._destination, json=data, timeout=5)
-                self._print('send ' + str(len(data)) + ' values by HTTP')
-            except Timeout:
-                self._print('The request timed out')
-            except ConnectionError as ce:
-                self._print(ce)
+            if self._insert_mode == InsertMode.COLUMNAR:
+                data = JsonEncoding.get_json_compatible_columns(data)
+            result = session.send(data)
+            if result != SendResult.ACCEPTED:
+                return result
+            self._print('send ' + str(rows_number) + ' values by HTTP')
+        elif self._type == LoaderType.KAFKA:
+            # only the undelivered messages are spooled, when the other messages of the data are delivered
+            result = session.send(data, self._on_send_failure)
+            if result != SendResult.ACCEPTED:
+                return result
+            self._print('send ' + str(rows_number) + ' values to Kafka')
         elif self._type == LoaderType.CLICKHOUSE_DRIVER:
             try:
-                ClickHouseQueries.insert_values_into_table(self._session,
-                                                           self._database,
-                                                           self._table,
-                                                           data,
-                                                           self._parameters_name_string)
-                self._print('insert ' + str(len(data)) + ' values into ClickHouse table')
+                if self._insert_mode == InsertMode.COLUMNAR:
+                    ClickHouseQueries.insert_columns_into_table(session,
+                                                                self._database,
+                                                                self._table,
+                                                                data,
+                                                                self._parameters_name_string)
+                else:
+                    ClickHouseQueries.insert_values_into_table(session,
+                                                               self._database,
+                                                               self._table,
+                                                               data,
+                                                               self._parameters_name_string)
+                self._print('insert ' + str(rows_number) + ' values into ClickHouse table')
             except SocketTimeoutError as ste:
                 self._print('ClickHouse SocketTimeoutError ' + str(ste))
+                return SendResult.TIMEOUT
+            except NetworkError as ne:
+                self._print('ClickHouse NetworkError ' + str(ne))
+                return SendResult.UNAVAILABLE
+        return SendResult.ACCEPTED
+
+    def _set_batch_settings(self, conf_settings):
+        # batching is disabled if none of the limits are set, then the data is sent on every poll
+        self._batch_max_rows = conf_settings.get('batch_max_rows')
+        self._batch_max_bytes = conf_settings.get('batch_max_bytes')
+        self._batch_max_linger = conf_settings.get('batch_max_linger')
+
+    def _set_http_settings(self, conf_settings):
+        # the requests to the HTTP service are sent in parallel and repeated with increasing pauses on failures
+        self._http_max_in_flight = conf_settings.get('http_max_in_flight')
+        self._http_gzip_required = conf_settings.get('http_gzip_required')
+        self._http_max_retries = conf_settings.get('http_max_retries')
+        self._http_retry_backoff = conf_settings.get('http_retry_backoff')
+        self._http_timeout = conf_settings.get('http_timeout')
+        self._http_submit_timeout = conf_settings.get('http_submit_timeout')
+
+    def _set_kafka_settings(self, conf_settings):
+        # the messages are published to the topic named as the table, unless the topic is set
+        self._kafka_topic = conf_settings.get('kafka_topic') or self._table
+        kafka_key_codes = conf_settings.get('kafka_key_codes')
+        if kafka_key_codes:
+            self._kafka_key_codes = kafka_key_codes.replace(' ', '').split(',')
+        self._kafka_batch_size = conf_settings.get('kafka_batch_size')
+        self._kafka_linger_ms = conf_settings.get('kafka_linger_ms')
+        self._kafka_compression_type = conf_settings.get('kafka_compression_type')
+        self._kafka_acks = conf_settings.get('kafka_acks')
 
     def _set_logger(self, conf_settings):
         if self._debug:
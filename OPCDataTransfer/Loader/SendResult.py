@@ -0,0 +1,16 @@
+# -*- coding: UTF-8 -*-
+
+
+class SendResult:
+    # the data is accepted by the receiver
+    ACCEPTED = 'accepted'
+    # the receiver rejects the data itself (for example, HTTP 400), it will never be accepted, so it is not spooled
+    REJECTED = 'rejected'
+    # the receiver is unavailable or overloaded (connection error, HTTP 503), the data may be sent again later
+    UNAVAILABLE = 'unavailable'
+    # the receiver didn't answer in time, the data may be sent again later
+    TIMEOUT = 'timeout'
+
+
+def is_retryable(send_result):
+    return send_result in (SendResult.UNAVAILABLE, SendResult.TIMEOUT)
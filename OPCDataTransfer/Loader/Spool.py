@@ -0,0 +1,311 @@
+# -*- coding: UTF-8 -*-
+
+from OPCDataTransfer.Loader.SendResult import SendResult
+from builtins import print
+import threading
+import logging
+import pickle
+import struct
+import zlib
+import mmap
+import time
+import os
+
+# record header: payload length, payload crc32, time of writing to the spool
+_RECORD_HEADER = struct.Struct('<IId')
+_SEGMENT_PREFIX = 'spool_'
+_SEGMENT_SUFFIX = '.seg'
+_ACK_SUFFIX = '.ack'
+
+
+# Store-and-forward spool for the data which could not be sent to the receiver. The batches are appended
+# to segment files in the spool directory. The segments are replayed in the background thread in the order
+# of creation, the offset of the last sent record is kept in the .ack file next to the segment, and the segment
+# is deleted when all its records are sent. The files stay on disk, so after a restart the replay continues
+# from the last acknowledged record (a batch may be sent twice if the process stops between sending and ack).
+class LoaderSpool:
+
+    def __init__(self, conf_settings):
+        self._debug = None
+        self._logger = None
+        self._verbose = None
+        self._directory_path = None
+        self._max_bytes = None
+        self._max_age = None
+        self._segment_bytes = None
+        self._replay_rate = None
+        self._retry_interval = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._replay_thread = None
+        self._active_segment_path = None
+        self._active_segment_file = None
+        self._next_segment_number = None
+        self._metrics = dict()
+
+        self._debug = conf_settings['debug']
+        self._set_logger(conf_settings)
+        self._verbose = conf_settings['verbose']
+        self._directory_path = conf_settings['spool_directory_path']
+        self._max_bytes = conf_settings.get('spool_max_bytes')
+        self._max_age = conf_settings.get('spool_max_age')
+        segment_bytes = conf_settings.get('spool_segment_bytes')
+        self._segment_bytes = segment_bytes if segment_bytes else 16 * 1024 * 1024
+        self._replay_rate = conf_settings.get('spool_replay_rate')
+        retry_interval = conf_settings.get('spool_retry_interval')
+        self._retry_interval = retry_interval if retry_interval else 30
+        self._metrics = {'spooled_batches': 0,
+                         'replayed_batches': 0,
+                         'dropped_batches': 0,
+                         'dropped_segments': 0,
+                         'replay_failures': 0}
+
+        os.makedirs(self._directory_path, exist_ok=True)
+        segments_list = self._get_segments_list()
+        self._next_segment_number = self._get_segment_number(segments_list[-1]) + 1 if segments_list else 1
+        if segments_list:
+            self._print('Spool contains ' + str(len(segments_list)) + ' segments to replay')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.stop_replay()
+        with self._lock:
+            self._close_active_segment()
+        self._print('Spool has been closed. ' + str(self.get_metrics()))
+
+    def stop_replay(self):
+        # waits for the sending in progress. The spool stays open, so the data which the loaders fail to send
+        # on their closing is still appended to it
+        self._stop_event.set()
+        if self._replay_thread is not None:
+            self._replay_thread.join()
+            self._replay_thread = None
+
+    def start_replay(self, send_function):
+        # send_function(data) returns SendResult. The rejected batches are dropped, the batches which were not sent
+        # because the receiver is unavailable are sent again after spool_retry_interval
+        self._replay_thread = threading.Thread(target=self._replay, args=(send_function,),
+                                               name='LoaderSpoolReplay', daemon=True)
+        self._replay_thread.start()
+
+    def append(self, data):
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        header = _RECORD_HEADER.pack(len(payload), zlib.crc32(payload), time.time())
+        with self._lock:
+            if self._active_segment_file is None:
+                self._open_active_segment()
+            self._active_segment_file.write(header)
+            self._active_segment_file.write(payload)
+            self._active_segment_file.flush()
+            os.fsync(self._active_segment_file.fileno())
+            self._metrics['spooled_batches'] += 1
+            if self._active_segment_file.tell() >= self._segment_bytes:
+                self._close_active_segment()
+            self._apply_size_limit()
+
+    def get_metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics['spool_bytes'] = sum(self._get_file_size(path) for path in self._get_segments_list())
+        return metrics
+
+    def _replay(self, send_function):
+        while not self._stop_event.is_set():
+            segment_path = self._get_segment_to_replay()
+            if segment_path is None:
+                self._stop_event.wait(self._retry_interval)
+                continue
+            if not self._replay_segment(segment_path, send_function):
+                # the receiver is still unavailable, try again later
+                self._stop_event.wait(self._retry_interval)
+
+    def _get_segment_to_replay(self):
+        with self._lock:
+            segments_list = self._get_segments_list()
+            if not segments_list:
+                return None
+            if segments_list[0] == self._active_segment_path:
+                # the active segment is closed, so the new data goes to the next one while this is replayed
+                self._close_active_segment()
+            return segments_list[0]
+
+    def _replay_segment(self, segment_path, send_function):
+        offset = self._read_ack_offset(segment_path)
+        segment_size = self._get_file_size(segment_path)
+        if offset < segment_size:
+            with open(segment_path, 'rb') as segment_file, \
+                    mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as segment_map:
+                while offset < segment_size:
+                    if self._stop_event.is_set():
+                        return True
+                    record = self._read_record(segment_map, offset)
+                    if record is None:
+                        # the tail of the segment was not written completely (the process was stopped)
+                        break
+                    record_size, write_time, payload = record
+
+                    if not self._is_record_expired(write_time):
+                        if not self._send_record(payload, send_function):
+                            return False
+                        self._throttle()
+                    else:
+                        with self._lock:
+                            self._metrics['dropped_batches'] += 1
+
+                    offset += record_size
+                    if not os.path.exists(segment_path):
+                        # the segment was deleted by the spool size limit
+                        break
+                    self._write_ack_offset(segment_path, offset)
+
+        with self._lock:
+            self._remove_segment(segment_path)
+        return True
+
+    def _send_record(self, payload, send_function):
+        # returns False if the batch must be sent again later
+        data = pickle.loads(payload)
+        try:
+            result = send_function(data)
+        except (TypeError, ValueError) as e:
+            # the data itself can't be encoded for the receiver, it will never be sent, so the batch is dropped
+            self._print('Spooled batch is dropped: ' + repr(e))
+            with self._lock:
+                self._metrics['dropped_batches'] += 1
+            return True
+        except Exception as e:
+            # the batch is kept and sent again after spool_retry_interval
+            self._print('Spooled batch is not sent: ' + repr(e))
+            result = SendResult.UNAVAILABLE
+
+        if result == SendResult.REJECTED:
+            # the following batches are not blocked by the batch which will never be accepted
+            self._print('Spooled batch is rejected by the receiver and is dropped')
+        with self._lock:
+            if result == SendResult.ACCEPTED:
+                self._metrics['replayed_batches'] += 1
+            elif result == SendResult.REJECTED:
+                self._metrics['dropped_batches'] += 1
+            else:
+                self._metrics['replay_failures'] += 1
+        return result in (SendResult.ACCEPTED, SendResult.REJECTED)
+
+    @staticmethod
+    def _read_record(segment_map, offset):
+        header_end = offset + _RECORD_HEADER.size
+        if header_end > len(segment_map):
+            return None
+        payload_length, payload_crc, write_time = _RECORD_HEADER.unpack(segment_map[offset:header_end])
+        payload = segment_map[header_end:header_end + payload_length]
+        if len(payload) < payload_length or zlib.crc32(payload) != payload_crc:
+            return None
+        return _RECORD_HEADER.size + payload_length, write_time, payload
+
+    def _is_record_expired(self, write_time):
+        return bool(self._max_age) and time.time() - write_time > self._max_age
+
+    def _throttle(self):
+        if self._replay_rate:
+            self._stop_event.wait(1 / self._replay_rate)
+
+    def _apply_size_limit(self):
+        # the oldest segments are deleted when the spool is larger than spool_max_bytes
+        if not self._max_bytes:
+            return
+        segments_list = self._get_segments_list()
+        spool_bytes = sum(self._get_file_size(path) for path in segments_list)
+        for segment_path in segments_list:
+            if spool_bytes <= self._max_bytes or segment_path == self._active_segment_path:
+                break
+            spool_bytes -= self._get_file_size(segment_path)
+            if self._remove_segment(segment_path):
+                self._metrics['dropped_segments'] += 1
+                self._print('Spool is full, segment ' + os.path.basename(segment_path) + ' is deleted')
+
+    def _open_active_segment(self):
+        segment_name = _SEGMENT_PREFIX + '{:012d}'.format(self._next_segment_number) + _SEGMENT_SUFFIX
+        self._next_segment_number += 1
+        self._active_segment_path = os.path.join(self._directory_path, segment_name)
+        self._active_segment_file = open(self._active_segment_path, 'ab')
+
+    def _close_active_segment(self):
+        if self._active_segment_file is not None:
+            self._active_segment_file.close()
+        self._active_segment_file = None
+        self._active_segment_path = None
+
+    @staticmethod
+    def _remove_segment(segment_path):
+        # the segment may be in use by the replay thread (Windows doesn't allow to delete it then)
+        try:
+            os.remove(segment_path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        ack_path = segment_path + _ACK_SUFFIX
+        if os.path.exists(ack_path):
+            os.remove(ack_path)
+        return True
+
+    def _get_segments_list(self):
+        segments_list = [os.path.join(self._directory_path, file_name)
+                         for file_name in os.listdir(self._directory_path)
+                         if file_name.startswith(_SEGMENT_PREFIX) and file_name.endswith(_SEGMENT_SUFFIX)]
+        return sorted(segments_list, key=self._get_segment_number)
+
+    @staticmethod
+    def _get_segment_number(segment_path):
+        return int(os.path.basename(segment_path)[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+
+    @staticmethod
+    def _get_file_size(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _read_ack_offset(segment_path):
+        try:
+            with open(segment_path + _ACK_SUFFIX, 'r') as ack_file:
+                return int(ack_file.read())
+        except (OSError, ValueError):
+            return 0
+
+    @staticmethod
+    def _write_ack_offset(segment_path, offset):
+        ack_path = segment_path + _ACK_SUFFIX
+        with open(ack_path + '.tmp', 'w') as ack_file:
+            ack_file.write(str(offset))
+        os.replace(ack_path + '.tmp', ack_path)
+
+    def _print(self, message):
+        if self._verbose:
+            print(message)
+        if self._debug:
+            self._logger.info(message)
+
+    def _set_logger(self, conf_settings):
+        if self._debug:
+            logs_file_path = conf_settings['logs_file_path']
+            if not logs_file_path:
+                logs_file_path = os.path.abspath(
+                    os.path.realpath(
+                        os.path.join(os.path.dirname(os.path.realpath(__file__)), '../Data/logs.log')))
+
+            debug_level_string = conf_settings['debug_level']
+            if debug_level_string:
+                debug_level = logging.getLevelName(debug_level_string)
+            else:
+                debug_level = logging.DEBUG
+
+            logging.basicConfig(level=debug_level,
+                                format='%(asctime)s %(name)s %(levelname)s:%(message)s',
+                                filename=logs_file_path)
+            self._logger = logging.getLogger(__name__)
@@ -1,2 +1,7 @@
 from .Loader import LoaderType
 from .Loader import Loader
+from .Loader import InsertMode
+from .Spool import LoaderSpool
+from .HTTPSender import HTTPSender
+from .KafkaSender import KafkaSender
+from .SendResult import SendResult
@@ -0,0 +1,99 @@
+# -*- coding: UTF-8 -*-
+
+from OPCDataTransfer.OPC.TagTable import OPCValues
+import numpy as np
+import time
+
+
+# Report-by-exception filter between reading from OPC and loading. The value of a tag is passed on
+# only if it differs from the last passed value by more than the tolerance, or if the heartbeat interval
+# of the tag has expired. The tolerance is max(absolute, percent * |last passed value| / 100).
+# The settings and the state of the tags are stored in arrays addressed by the tag index in the TagTable.
+class DeadbandFilter:
+
+    def __init__(self, tag_table, deadband_settings):
+        self._absolute_tolerances = None
+        self._percent_tolerances = None
+        self._heartbeat_intervals = None
+        self._last_values = None
+        self._last_times = None
+        self._passed_count = 0
+        self._suppressed_count = 0
+
+        tags_number = len(tag_table)
+        self._absolute_tolerances = np.zeros(tags_number)
+        self._percent_tolerances = np.zeros(tags_number)
+        self._heartbeat_intervals = np.zeros(tags_number)
+        self._last_values = np.full(tags_number, np.nan)
+        # -inf means that the value of the tag has not been passed yet
+        self._last_times = np.full(tags_number, -np.inf)
+        self._set_tolerances(tag_table, deadband_settings)
+
+    def _set_tolerances(self, tag_table, deadband_settings):
+        # the settings are applied from general to specific: default, by tag codes, by OPC names
+        self._set_tolerances_for_tags(np.ones(len(tag_table), dtype=bool), deadband_settings.get('default', dict()))
+
+        for code_name in tag_table.get_code_names_list():
+            code_column = tag_table.get_code_column(code_name)
+            for settings_dict in deadband_settings.get(code_name, list()):
+                self._set_tolerances_for_tags(code_column == settings_dict['key'], settings_dict)
+
+        opc_names_list = tag_table.get_opc_names_list()
+        for settings_dict in deadband_settings.get('opc_names', list()):
+            mask = np.zeros(len(tag_table), dtype=bool)
+            if settings_dict['key'] in opc_names_list:
+                mask[opc_names_list.index(settings_dict['key'])] = True
+            self._set_tolerances_for_tags(mask, settings_dict)
+
+    def _set_tolerances_for_tags(self, mask, settings_dict):
+        if 'absolute' in settings_dict:
+            self._absolute_tolerances[mask] = settings_dict['absolute']
+        if 'percent' in settings_dict:
+            self._percent_tolerances[mask] = settings_dict['percent']
+        if 'heartbeat' in settings_dict:
+            self._heartbeat_intervals[mask] = settings_dict['heartbeat']
+
+    def apply(self, current_values):
+        if not len(current_values):
+            return current_values
+        try:
+            values = np.array(current_values.values, dtype=np.float64)
+        except (TypeError, ValueError):
+            # tolerances can be applied only to numeric values
+            return current_values
+
+        current_time = time.monotonic()
+        indexes = current_values.indexes
+        last_values = self._last_values[indexes]
+
+        tolerances = np.maximum(self._absolute_tolerances[indexes],
+                                self._percent_tolerances[indexes] * np.abs(last_values) / 100)
+        with np.errstate(invalid='ignore'):
+            changed = np.abs(values - last_values) > tolerances
+        # a value that appeared or disappeared (bad quality comes as nan) is always a change
+        changed |= np.isnan(values) != np.isnan(last_values)
+        last_times = self._last_times[indexes]
+        heartbeat_intervals = self._heartbeat_intervals[indexes]
+        heartbeat_expired = (heartbeat_intervals > 0) & (current_time - last_times >= heartbeat_intervals)
+        passed = changed | heartbeat_expired | np.isinf(last_times)
+
+        passed_indexes = indexes[passed]
+        self._last_values[passed_indexes] = values[passed]
+        self._last_times[passed_indexes] = current_time
+
+        passed_count = int(np.count_nonzero(passed))
+        self._passed_count += passed_count
+        self._suppressed_count += len(indexes) - passed_count
+        if passed_count == len(indexes):
+            return current_values
+
+        # the passed values keep their original types (None for bad quality, int), as when all values pass
+        positions = np.flatnonzero(passed).tolist()
+        return OPCValues(passed_indexes,
+                         [current_values.values[position] for position in positions],
+                         [current_values.qualities[position] for position in positions],
+                         [current_values.source_times[position] for position in positions],
+                         current_values.read_time)
+
+    def get_statistics(self):
+        return {'passed': self._passed_count, 'suppressed': self._suppressed_count}
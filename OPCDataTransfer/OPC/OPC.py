@@ -1,15 +1,24 @@
 #!/usr/bin/env python3.6
 # -*- coding: UTF-8 -*-
 
-import OpenOPC
-import pywintypes
+import numpy as np
 import datetime
+from OPCDataTransfer.OPC.Sources import create_opc_source
+from OPCDataTransfer.OPC.Sources import OPCSourceTimeoutError
+from OPCDataTransfer.OPC.TagTable import TagTable
+from OPCDataTransfer.OPC.TagTable import OPCValues
+from OPCDataTransfer.OPC.Writer import OPCWriter
+from OPCDataTransfer.ServiceFunctions.StageMetrics import Stage
 from builtins import print
+import itertools
 import json
 import copy
 import logging
 import os
 
+# the group of the tags which don't fall under the rules of opc_groups in the tags settings
+DEFAULT_GROUP_NAME = 'Group0'
+
 
 class ConnectionOPC:
 
@@ -22,15 +31,22 @@ class ConnectionOPC:
         self._param_list = None
         self._dict_codes_plotting_names = None
         self._dict_opc_names_codes = None
-        self._dict_code_keys_opc_names = None
+        self._tag_table = None
+        self._deadband_settings = None
+        self._groups_items = None
+        self._groups_update_rates = None
         self._parameters_name_string = None
+        self._metrics = None
+        self._write_chunk_size = None
 
         self._debug = conf_settings['debug']
         self._set_logger(conf_settings)
         self._verbose = conf_settings['verbose']
         self._set_frequency(conf_settings)
+        self._write_chunk_size = conf_settings.get('opc_write_chunk_size')
 
-        self._set_opc_client(conf_settings['opc_server'])
+        # OPC server, or the recording of the data read from it
+        self._client = create_opc_source(conf_settings, self._print)
 
         # get a list of all parameter names from the OPC server
         self._param_list = self._client.list(conf_settings['tags_branch_opc_server'], recursive=True)
@@ -38,7 +54,10 @@ class ConnectionOPC:
         tags_settings_dicts = self._get_settings_dicts(conf_settings)
         self._set_dict_codes_plotting_names(tags_settings_dicts['codes_and_plotting_names'])
         self._dict_opc_names_codes = tags_settings_dicts['opc_names_and_codes']
-        self._set_dict_code_keys_opc_names()
+        # tag codes are prepared once, so that the data of each poll is transformed by tag indexes
+        self._tag_table = TagTable(self._dict_opc_names_codes)
+        self._deadband_settings = tags_settings_dicts.get('deadband_settings')
+        self._set_groups(tags_settings_dicts.get('opc_groups'))
         self._set_parameters_name_string()
 
     def __enter__(self):
@@ -53,11 +72,14 @@ class ConnectionOPC:
         self._client.close()
         self._print('OPC client close the connection')
 
-    def write(self, list_data_string):
-        try:
-            self._client.write(list_data_string)
-        except OpenOPC.TimeoutError:
-            self._print("Timeout error OPC occured")
+    def set_metrics(self, metrics):
+        # StageMetrics which count the timeouts of reading (and of writing by the writers created after this)
+        self._metrics = metrics
+
+    def create_writer(self, codes_columns):
+        # OPCWriter of the values of the simulation model with the code columns codes_columns
+        return OPCWriter(self._client, self._tag_table, codes_columns, self._write_chunk_size, self._print,
+                         self._metrics)
 
     def _print(self, message):
         if self._verbose:
@@ -65,46 +87,69 @@ class ConnectionOPC:
         if self._debug:
             self._logger.info(message)
 
-    def get_list_of_current_values(self):
-        current_date_string = datetime.datetime.now()
-        param_array = list()
+    def read_current_values(self):
+        return self.read_groups_values(list(self._groups_items.keys()))
+
+    def read_groups_values(self, group_names_list):
+        # the values of several groups are merged into one set of values
+        values_list = [self._read_group_values(group_name) for group_name in group_names_list]
+        if len(values_list) == 1:
+            return values_list[0]
+        return OPCValues(np.concatenate([values.indexes for values in values_list]),
+                         tuple(itertools.chain.from_iterable(values.values for values in values_list)),
+                         tuple(itertools.chain.from_iterable(values.qualities for values in values_list)),
+                         tuple(itertools.chain.from_iterable(values.source_times for values in values_list)),
+                         values_list[0].read_time)
+
+    def _read_group_values(self, group_name):
+        current_date = datetime.datetime.now()
+        opc_items = list()
         try:
-            if not self._client.groups():
+            if group_name not in self._client.groups():
                 # Read 1 times the values and determine the group of opc tags, which will continue to use
-                for name, value, quality, timeRecord in self._client.iread(self._param_list, group='Group0', update=1):
-                    param_array.append(self._get_dict_from_opc_data(name, value, current_date_string))
+                opc_items = list(self._client.iread(self._groups_items[group_name], group=group_name,
+                                                    update=self._get_group_update_rate_ms(group_name)))
             else:
-                for name, value, quality, timeRecord in self._client.iread(group='Group0', update=1):
-                    param_array.append(self._get_dict_from_opc_data(name, value, current_date_string))
+                opc_items = list(self._client.iread(group=group_name,
+                                                    update=self._get_group_update_rate_ms(group_name)))
 
             if self._debug or self._verbose:
-                self._print('Data has been read from the OPC')
-                for item in param_array:
+                self._print('Data has been read from the OPC group ' + group_name)
+                for item in opc_items:
                     self._print(item)
-        except OpenOPC.TimeoutError:
+        except OPCSourceTimeoutError:
             self._print("OPC TimeoutError occured")
+            if self._metrics is not None:
+                self._metrics.count_error(Stage.OPC_READ, timeout=True)
 
-        return param_array
+        if not opc_items:
+            return OPCValues(self._tag_table.get_indexes(list(), group_name), (), (), (), current_date)
 
-    def convert_simulation_data_to_opc_data(self, current_values_list):
-        list_opc_values = list()
-        for value_dict in current_values_list:
-            cur_time = value_dict.pop('time', None)
-            cur_value = value_dict.pop('value', None)
+        # one pass over the items splits them into parallel sequences (name, value, quality, time)
+        names, values, qualities, source_times = zip(*opc_items)
+        return OPCValues(self._tag_table.get_indexes(list(names), group_name), values, qualities, source_times,
+                         current_date)
 
-            opc_tag_name = self._get_opc_tag_name(value_dict)
+    def get_list_of_current_values(self):
+        return self.convert_values_to_list(self.read_current_values())
 
-            list_opc_values.append((opc_tag_name, cur_value))
+    def get_columns_of_current_values(self):
+        return self.convert_values_to_columns(self.read_current_values())
 
-            if self._debug or self._verbose:
-                self._print((opc_tag_name, cur_value, cur_time))
-        return list_opc_values
+    def convert_values_to_list(self, current_values):
+        return self._tag_table.get_rows(current_values.indexes, current_values.values, current_values.read_time)
 
-    def _set_opc_client(self, opc_server_name):
-        pywintypes.datetime = pywintypes.TimeType
-        self._client = OpenOPC.client()
-        self._client.connect(opc_server_name)
-        self._print('connected to OPC server ' + opc_server_name)
+    def convert_values_to_columns(self, current_values):
+        # the same data as in convert_values_to_list, but as a dictionary of numpy arrays (one for each column).
+        # Used for the columnar insert into the database
+        if not len(current_values):
+            return dict()
+
+        columns_dict = self._tag_table.get_code_columns(current_values.indexes)
+        # values of tags with bad quality come as None and are converted to nan
+        columns_dict['value'] = np.array(current_values.values, dtype=np.float64)
+        columns_dict['time'] = np.full(len(current_values), np.datetime64(current_values.read_time, 's'))
+        return columns_dict
 
     def _set_logger(self, conf_settings):
         if self._debug:
@@ -136,6 +181,55 @@ class ConnectionOPC:
     def get_frequency(self):
         return self._frequency
 
+    def _set_groups(self, groups_settings_list):
+        # the tags are divided into OPC groups by the rules from the tags settings. A rule is the list of
+        # OPC names and/or the lists of allowed values of tag codes. The rest of the tags are in the default group
+        if groups_settings_list is None:
+            groups_settings_list = list()
+
+        self._groups_items = {DEFAULT_GROUP_NAME: list()}
+        self._groups_update_rates = {DEFAULT_GROUP_NAME: self._frequency}
+        for group_settings in groups_settings_list:
+            self._groups_items[group_settings['name']] = list()
+            self._groups_update_rates[group_settings['name']] = group_settings['update_rate']
+
+        for opc_name in self._param_list:
+            self._groups_items[self._get_group_name(opc_name, groups_settings_list)].append(opc_name)
+
+        for group_name in list(self._groups_items.keys()):
+            if not self._groups_items[group_name]:
+                del self._groups_items[group_name]
+                del self._groups_update_rates[group_name]
+            else:
+                self._print('OPC group ' + group_name + ': ' + str(len(self._groups_items[group_name]))
+                            + ' tags, update rate ' + str(self._groups_update_rates[group_name]))
+
+    def _get_group_name(self, opc_name, groups_settings_list):
+        codes_dict = self._dict_opc_names_codes.get(opc_name, dict())
+        for group_settings in groups_settings_list:
+            if opc_name in group_settings.get('opc_names', list()):
+                return group_settings['name']
+            code_rules = {key: value for key, value in group_settings.items()
+                          if key not in ('name', 'update_rate', 'opc_names')}
+            if code_rules and all(codes_dict.get(code_name) in code_values
+                                  for code_name, code_values in code_rules.items()):
+                return group_settings['name']
+        return DEFAULT_GROUP_NAME
+
+    def _get_group_update_rate_ms(self, group_name):
+        # the server refreshes the default group as fast as possible, the other groups with their own rate
+        if group_name == DEFAULT_GROUP_NAME:
+            return 1
+        return int(self._groups_update_rates[group_name] * 1000)
+
+    def get_groups_update_rates(self):
+        # the recorded data may be replayed faster than it was read, with speed 0 - without waiting
+        polling_speed = self._client.get_polling_speed()
+        if polling_speed == 1:
+            return self._groups_update_rates
+        return {group_name: update_rate / polling_speed if polling_speed else 0
+                for group_name, update_rate in self._groups_update_rates.items()}
+
     @staticmethod
     def _get_settings_dicts(conf_settings):
         # TODO in production, preferably an HTTP request
@@ -157,34 +251,17 @@ class ConnectionOPC:
                 dict_with_tuple_keys[(tag_name, code_plotting_name_dict['key'])] = code_plotting_name_dict['value']
         self._dict_codes_plotting_names = dict_with_tuple_keys
 
-    def _set_dict_code_keys_opc_names(self):
-        dict_with_tuple_keys = dict()
-        for opc_name, codes_dict in self._dict_opc_names_codes.items():
-            dict_with_tuple_keys[self._get_sorted_tuple_values_from_dict(codes_dict)] = opc_name
-        self._dict_code_keys_opc_names = dict_with_tuple_keys
-
     def get_codes_plotting_names_dict(self):
         return self._dict_codes_plotting_names
 
     def get_opc_names_codes_dict(self):
         return self._dict_opc_names_codes
 
-    def _get_dict_from_opc_data(self, parameter_name, value, current_date_string):
-        dict_param_value = {**self._dict_opc_names_codes.get(parameter_name),
-                            'value': value,
-                            'time': current_date_string}
-        return dict_param_value
+    def get_tag_table(self):
+        return self._tag_table
 
-    @staticmethod
-    def _get_sorted_tuple_values_from_dict(_dict):
-        values_list = list()
-        for k in sorted(_dict.keys()):
-            values_list.append(_dict[k])
-        return tuple(values_list)
-
-    def _get_opc_tag_name(self, value_dict):
-        keys_tuple = self._get_sorted_tuple_values_from_dict(value_dict)
-        return self._dict_code_keys_opc_names.get(keys_tuple)
+    def get_deadband_settings(self):
+        return self._deadband_settings
 
     def _set_parameters_name_string(self):
         if self._dict_opc_names_codes:
@@ -0,0 +1,320 @@
+# -*- coding: UTF-8 -*-
+
+from collections import deque
+import numpy as np
+import datetime
+import pickle
+import struct
+import zlib
+import os
+
+try:
+    import OpenOPC
+    import pywintypes
+except ImportError:
+    # OpenOPC works only on Windows, on other systems the recorded data can be replayed
+    OpenOPC = None
+    pywintypes = None
+
+# The sources of OPC data used by ConnectionOPC. All of them have the methods of the OpenOPC client
+# which are used by ConnectionOPC (list, groups, iread, write, remove, close) and get_polling_speed.
+# iread returns the tuples (name, value, quality, time), like OpenOPC.
+
+
+class OPCSourceType:
+    # OPC server through OpenOPC
+    OPENOPC = 'openopc'
+    # OPC server through OpenOPC, all read values are also written to the recording file
+    RECORD = 'record'
+    # the values from the recording file, OPC server is not required
+    REPLAY = 'replay'
+    # generated values of the tags Synthetic.Tag_<number>, used in benchmarks
+    SYNTHETIC = 'synthetic'
+
+
+class OPCSourceTimeoutError(Exception):
+    pass
+
+
+class EndOfRecordingError(Exception):
+    pass
+
+
+_RECORDING_SIGNATURE = b'OPCREC1\n'
+# record header: length of the compressed payload
+_RECORD_HEADER = struct.Struct('<I')
+_LIST_RECORD = 'list'
+_POLL_RECORD = 'poll'
+
+
+def create_opc_source(conf_settings, print_function):
+    source_type = conf_settings.get('opc_source') or OPCSourceType.OPENOPC
+    if source_type == OPCSourceType.SYNTHETIC:
+        return SyntheticOPCSource(conf_settings['opc_synthetic_tags_number'],
+                                  conf_settings.get('opc_synthetic_change_rate'))
+    if source_type == OPCSourceType.REPLAY:
+        return ReplayOPCSource(conf_settings['opc_recording_file_path'],
+                               conf_settings.get('opc_replay_speed'),
+                               conf_settings.get('opc_replay_loop'))
+
+    source = OpenOPCSource(conf_settings['opc_server'])
+    print_function('connected to OPC server ' + conf_settings['opc_server'])
+    if source_type == OPCSourceType.RECORD:
+        source = RecordingOPCSource(source, conf_settings['opc_recording_file_path'])
+        print_function('OPC data is recorded to ' + conf_settings['opc_recording_file_path'])
+    return source
+
+
+class OpenOPCSource:
+
+    def __init__(self, opc_server_name):
+        self._client = None
+
+        if OpenOPC is None:
+            raise ImportError('OpenOPC is not available, only the replay of the recorded data can be used')
+        pywintypes.datetime = pywintypes.TimeType
+        self._client = OpenOPC.client()
+        self._client.connect(opc_server_name)
+
+    def list(self, paths, recursive=False):
+        return self._client.list(paths, recursive=recursive)
+
+    def groups(self):
+        return self._client.groups()
+
+    def iread(self, items=None, group=None, update=1):
+        try:
+            for item in self._client.iread(items, group=group, update=update):
+                yield item
+        except OpenOPC.TimeoutError as te:
+            raise OPCSourceTimeoutError(str(te))
+
+    def write(self, tag_value_pairs):
+        try:
+            return self._client.write(tag_value_pairs)
+        except OpenOPC.TimeoutError as te:
+            raise OPCSourceTimeoutError(str(te))
+
+    def remove(self, groups):
+        self._client.remove(groups)
+
+    def close(self):
+        self._client.close()
+
+    @staticmethod
+    def get_polling_speed():
+        return 1
+
+
+class RecordingOPCSource:
+    # The records are zlib compressed pickles of tuples. The list of tags is recorded once, each poll is
+    # recorded as (group, names, values, qualities, times), where names is None if the group returned
+    # the same items as on the previous poll
+
+    def __init__(self, source, recording_file_path):
+        self._source = None
+        self._recording_file = None
+        self._last_groups_names = dict()
+
+        self._source = source
+        self._recording_file = open(recording_file_path, 'wb')
+        self._recording_file.write(_RECORDING_SIGNATURE)
+
+    def list(self, paths, recursive=False):
+        names_list = self._source.list(paths, recursive=recursive)
+        self._write_record((_LIST_RECORD, list(names_list)))
+        return names_list
+
+    def groups(self):
+        return self._source.groups()
+
+    def iread(self, items=None, group=None, update=1):
+        items_list = list(self._source.iread(items, group=group, update=update))
+        if items_list:
+            names, values, qualities, times = zip(*items_list)
+            if self._last_groups_names.get(group) == names:
+                names_record = None
+            else:
+                names_record = names
+                self._last_groups_names[group] = names
+            self._write_record((_POLL_RECORD, group, names_record, values, qualities, times))
+        return iter(items_list)
+
+    def write(self, tag_value_pairs):
+        return self._source.write(tag_value_pairs)
+
+    def remove(self, groups):
+        self._source.remove(groups)
+
+    def close(self):
+        self._recording_file.close()
+        self._source.close()
+
+    def get_polling_speed(self):
+        return self._source.get_polling_speed()
+
+    def _write_record(self, record):
+        payload = zlib.compress(pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL))
+        self._recording_file.write(_RECORD_HEADER.pack(len(payload)))
+        self._recording_file.write(payload)
+        self._recording_file.flush()
+
+
+class ReplayOPCSource:
+    # Returns the polls of each group in the recorded order. The polling rate is set by the scheduler:
+    # the update rates of the groups are divided by speed, speed 0 means polling without waiting.
+    # At the end of the recording EndOfRecordingError is raised, or the replay starts again if loop is set
+
+    def __init__(self, recording_file_path, speed=None, loop=None):
+        self._recording_file_path = None
+        self._speed = None
+        self._loop = None
+        self._recording_file = None
+        self._names_list = None
+        self._groups = list()
+        self._pending_polls = dict()
+        self._last_groups_names = dict()
+
+        self._recording_file_path = recording_file_path
+        self._speed = speed if speed is not None else 1
+        self._loop = bool(loop)
+        self._open_recording()
+
+    def list(self, paths=None, recursive=False):
+        # the list of tags recorded at the start of the recording
+        while self._names_list is None:
+            record = self._read_record()
+            if record is None:
+                raise EndOfRecordingError('The recording does not contain the list of tags')
+            self._add_record(record)
+        return list(self._names_list)
+
+    def groups(self):
+        return list(self._groups)
+
+    def iread(self, items=None, group=None, update=1):
+        if group not in self._groups:
+            self._groups.append(group)
+        names, values, qualities, times = self._get_next_poll(group)
+        return iter(zip(names, values, qualities, times))
+
+    def write(self, tag_value_pairs):
+        # the recorded data can't be changed
+        return list()
+
+    def remove(self, groups):
+        self._groups = [group for group in self._groups if group not in groups]
+
+    def close(self):
+        self._recording_file.close()
+
+    def get_polling_speed(self):
+        return self._speed
+
+    def _get_next_poll(self, group):
+        rewound = False
+        while not self._pending_polls.get(group):
+            record = self._read_record()
+            if record is not None:
+                self._add_record(record)
+            elif self._loop and not rewound:
+                rewound = True
+                self._open_recording()
+            elif self._loop:
+                # the group is not in the recording
+                return (), (), (), ()
+            else:
+                raise EndOfRecordingError('All recorded polls of the group ' + str(group) + ' have been replayed')
+        return self._pending_polls[group].popleft()
+
+    def _add_record(self, record):
+        # the polls of the other groups are kept until they are read
+        if record[0] == _LIST_RECORD:
+            if self._names_list is None:
+                self._names_list = record[1]
+            return
+
+        _, group, names, values, qualities, times = record
+        if names is None:
+            names = self._last_groups_names[group]
+        else:
+            self._last_groups_names[group] = names
+        self._pending_polls.setdefault(group, deque()).append((names, values, qualities, times))
+
+    def _open_recording(self):
+        if self._recording_file is not None:
+            self._recording_file.close()
+        self._recording_file = open(self._recording_file_path, 'rb')
+        if self._recording_file.read(len(_RECORDING_SIGNATURE)) != _RECORDING_SIGNATURE:
+            raise ValueError(os.path.basename(self._recording_file_path) + ' is not an OPC recording')
+
+    def _read_record(self):
+        # returns None at the end of the recording, including the record which was not written completely
+        header = self._recording_file.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size:
+            return None
+        payload_length, = _RECORD_HEADER.unpack(header)
+        payload = self._recording_file.read(payload_length)
+        if len(payload) < payload_length:
+            return None
+        return pickle.loads(zlib.decompress(payload))
+
+
+class SyntheticOPCSource:
+    # On each poll a part of the tags (change_rate) changes by a random step, the rest keep their values
+
+    def __init__(self, tags_number, change_rate=None):
+        self._names_list = None
+        self._change_rate = None
+        self._values = None
+        self._random_generator = np.random.RandomState(0)
+        self._groups_indexes = dict()
+
+        self._names_list = get_synthetic_tag_names(tags_number)
+        self._change_rate = change_rate if change_rate is not None else 0.1
+        self._values = self._random_generator.random_sample(tags_number) * 100
+
+    def list(self, paths=None, recursive=False):
+        return list(self._names_list)
+
+    def groups(self):
+        return list(self._groups_indexes.keys())
+
+    def iread(self, items=None, group=None, update=1):
+        if group not in self._groups_indexes:
+            index_by_name = {name: index for index, name in enumerate(self._names_list)}
+            self._groups_indexes[group] = np.array([index_by_name[name] for name in items], dtype=np.intp)
+        indexes = self._groups_indexes[group]
+
+        changed = self._random_generator.random_sample(len(indexes)) < self._change_rate
+        changed_indexes = indexes[changed]
+        self._values[changed_indexes] += self._random_generator.standard_normal(len(changed_indexes))
+
+        names_list = self._names_list
+        read_time = datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S')
+        return ((names_list[index], value, 'Good', read_time)
+                for index, value in zip(indexes.tolist(), self._values[indexes].tolist()))
+
+    def write(self, tag_value_pairs):
+        return list()
+
+    def remove(self, groups):
+        for group in groups:
+            self._groups_indexes.pop(group, None)
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def get_polling_speed():
+        return 1
+
+
+def get_synthetic_tag_names(tags_number):
+    return ['Synthetic.Tag_' + str(index) for index in range(tags_number)]
+
+
+def get_synthetic_tags_codes(tags_number):
+    # the same structure as in tags_settings_sample.json: 3 parameters for each component, 5 components for facility
+    return {name: {'facility': 1000 + index // 15, 'component': 10000 + index // 3, 'parameter': index % 3 + 1}
+            for index, name in enumerate(get_synthetic_tag_names(tags_number))}
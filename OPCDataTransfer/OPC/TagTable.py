@@ -0,0 +1,94 @@
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+import operator
+
+
+class OPCValues:
+    # values of one poll of the OPC group. All fields are parallel sequences addressed by the item position
+    # in the group, the tag codes are found by the index of the tag in the TagTable
+    __slots__ = ('indexes', 'values', 'qualities', 'source_times', 'read_time')
+
+    def __init__(self, indexes, values, qualities, source_times, read_time):
+        self.indexes = indexes
+        self.values = values
+        self.qualities = qualities
+        self.source_times = source_times
+        self.read_time = read_time
+
+    def __len__(self):
+        return len(self.indexes)
+
+
+class TagTable:
+    # Tag codes from the tags settings file, built once at the start. The tags are addressed by index:
+    # the codes of all tags are stored in parallel arrays (one for each code name), so the data of a poll
+    # is transformed by gathering the arrays by the tag indexes instead of building dictionaries for each tag
+
+    def __init__(self, dict_opc_names_codes):
+        self._opc_names_list = list()
+        self._index_by_opc_name = dict()
+        self._code_names_list = list()
+        self._code_columns = dict()
+        self._row_templates = list()
+        self._index_by_code_values = dict()
+        self._code_values_getter = None
+        self._groups_opc_names = dict()
+        self._groups_indexes = dict()
+
+        self._opc_names_list = list(dict_opc_names_codes.keys())
+        self._index_by_opc_name = {opc_name: index for index, opc_name in enumerate(self._opc_names_list)}
+        if dict_opc_names_codes:
+            self._code_names_list = list(next(iter(dict_opc_names_codes.values())).keys())
+        for code_name in self._code_names_list:
+            self._code_columns[code_name] = np.array([codes_dict[code_name]
+                                                      for codes_dict in dict_opc_names_codes.values()])
+        self._row_templates = [dict(codes_dict) for codes_dict in dict_opc_names_codes.values()]
+
+        # the key is the tuple of code values in the order of code names, used to find the tag for writing
+        if self._code_names_list:
+            self._code_values_getter = operator.itemgetter(*self._code_names_list)
+        for index, codes_dict in enumerate(dict_opc_names_codes.values()):
+            self._index_by_code_values[self._get_code_values(codes_dict)] = index
+
+    def __len__(self):
+        return len(self._opc_names_list)
+
+    def get_code_names_list(self):
+        return self._code_names_list
+
+    def get_opc_names_list(self):
+        return self._opc_names_list
+
+    def get_opc_name(self, index):
+        return self._opc_names_list[index]
+
+    def get_indexes(self, opc_names_list, group_name=None):
+        # the OPC group returns the items in the same order on every poll, so the indexes are computed
+        # only when the list of names of the group changes
+        if opc_names_list != self._groups_opc_names.get(group_name):
+            self._groups_indexes[group_name] = np.fromiter(
+                (self._index_by_opc_name[opc_name] for opc_name in opc_names_list),
+                dtype=np.intp, count=len(opc_names_list))
+            self._groups_opc_names[group_name] = opc_names_list
+        return self._groups_indexes[group_name]
+
+    def get_index_by_codes(self, codes_dict):
+        # codes_dict may contain other keys besides the codes (value, time)
+        return self._index_by_code_values.get(self._get_code_values(codes_dict))
+
+    def get_code_column(self, code_name):
+        return self._code_columns[code_name]
+
+    def get_code_columns(self, indexes):
+        return {code_name: code_column[indexes] for code_name, code_column in self._code_columns.items()}
+
+    def get_rows(self, indexes, values, current_time):
+        row_templates = self._row_templates
+        return [dict(row_templates[index], value=value, time=current_time)
+                for index, value in zip(indexes.tolist(), values)]
+
+    def _get_code_values(self, codes_dict):
+        if len(self._code_names_list) == 1:
+            return (self._code_values_getter(codes_dict),)
+        return self._code_values_getter(codes_dict)
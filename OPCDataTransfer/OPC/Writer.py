@@ -0,0 +1,117 @@
+# -*- coding: UTF-8 -*-
+
+from OPCDataTransfer.OPC.Sources import OPCSourceTimeoutError
+from OPCDataTransfer.ServiceFunctions.StageMetrics import Stage
+import numpy as np
+import time
+
+# number of the tags written to the OPC server in one request if the chunk size is not set
+DEFAULT_WRITE_CHUNK_SIZE = 500
+# status of the successfully written item returned by OpenOPC
+_SUCCESS_STATUS = 'Success'
+
+
+# Writes the values of the simulation model to the OPC server. The positions of the model values are mapped
+# to the OPC items once, by the code columns of the model (facility, component, parameter). Only the values
+# changed since the last successful write are sent, in chunks of chunk_size items, each chunk is a separate
+# request to the server. The latency of each chunk and the failed items are counted in the metrics (OPC_WRITE);
+# the items which were not written (timeout or error status) are sent again on the next write.
+class OPCWriter:
+
+    def __init__(self, client, tag_table, codes_columns, chunk_size=None, print_function=print, metrics=None):
+        self._client = None
+        self._print = None
+        self._metrics = None
+        self._chunk_size = None
+        self._positions = None
+        self._opc_names = None
+        self._last_values = None
+        self._written_count = 0
+        self._failed_count = 0
+
+        self._client = client
+        self._print = print_function
+        self._metrics = metrics
+        self._chunk_size = chunk_size or DEFAULT_WRITE_CHUNK_SIZE
+
+        tag_indexes = _get_tag_indexes(tag_table, codes_columns)
+        unknown_number = int(np.count_nonzero(tag_indexes < 0))
+        if unknown_number:
+            self._print(str(unknown_number) + ' values of the model have no OPC tags and are not written')
+        # the model positions of the values which are written and their OPC names
+        self._positions = np.flatnonzero(tag_indexes >= 0)
+        opc_names_list = tag_table.get_opc_names_list()
+        self._opc_names = np.array([opc_names_list[index] for index in tag_indexes[self._positions].tolist()],
+                                   dtype=object)
+        # nan means that the value has not been written yet
+        self._last_values = np.full(len(self._positions), np.nan)
+
+    def set_metrics(self, metrics):
+        self._metrics = metrics
+
+    def get_counts(self):
+        # numbers of the written and failed items since the start
+        return self._written_count, self._failed_count
+
+    def write_values(self, values):
+        # values are in the order of the code columns of the model, returns the number of the written items
+        values = np.asarray(values, dtype=np.float64)[self._positions]
+        changed_positions = np.flatnonzero(values != self._last_values)
+        if not len(changed_positions):
+            return 0
+
+        written_number = 0
+        for chunk_start in range(0, len(changed_positions), self._chunk_size):
+            chunk_positions = changed_positions[chunk_start:chunk_start + self._chunk_size]
+            written_positions = self._write_chunk(chunk_positions, values[chunk_positions])
+            self._last_values[written_positions] = values[written_positions]
+            written_number += len(written_positions)
+        return written_number
+
+    def _write_chunk(self, chunk_positions, chunk_values):
+        # returns the positions of the written items
+        tag_value_pairs = list(zip(self._opc_names[chunk_positions].tolist(), chunk_values.tolist()))
+        write_start_time = time.perf_counter()
+        try:
+            statuses = self._client.write(tag_value_pairs)
+        except OPCSourceTimeoutError as te:
+            duration = time.perf_counter() - write_start_time
+            self._failed_count += len(chunk_positions)
+            self._print('OPC write timeout of the chunk of ' + str(len(chunk_positions)) + ' items after ' +
+                        '{:.1f}'.format(duration * 1000) + ' ms: ' + str(te))
+            if self._metrics is not None:
+                self._metrics.count_error(Stage.OPC_WRITE, timeout=True)
+            return chunk_positions[:0]
+        duration = time.perf_counter() - write_start_time
+
+        # OpenOPC returns (name, status) for each item, the sources without the server return nothing
+        failed_mask = np.array([_get_status(item_status) != _SUCCESS_STATUS for item_status in statuses or ()],
+                               dtype=bool)
+        if len(failed_mask) != len(chunk_positions):
+            failed_mask = np.zeros(len(chunk_positions), dtype=bool)
+        failed_number = int(np.count_nonzero(failed_mask))
+        self._written_count += len(chunk_positions) - failed_number
+        self._failed_count += failed_number
+        if self._metrics is not None:
+            self._metrics.observe(Stage.OPC_WRITE, duration, len(chunk_positions) - failed_number)
+        if failed_number:
+            self._print('OPC write failed for ' + str(failed_number) + ' of ' + str(len(chunk_positions)) +
+                        ' items of the chunk, the first: ' + str(tag_value_pairs[int(np.argmax(failed_mask))][0]))
+            if self._metrics is not None:
+                self._metrics.count_error(Stage.OPC_WRITE)
+        return chunk_positions[~failed_mask]
+
+
+def _get_status(item_status):
+    if isinstance(item_status, (tuple, list)):
+        return item_status[1]
+    return item_status
+
+
+def _get_tag_indexes(tag_table, codes_columns):
+    # index of the tag for each position of the code columns, -1 for the codes without the tag
+    code_columns_list = [np.asarray(codes_columns[code_name]).tolist()
+                         for code_name in tag_table.get_code_names_list()]
+    tag_indexes = [tag_table.get_index_by_codes(dict(zip(tag_table.get_code_names_list(), code_values)))
+                   for code_values in zip(*code_columns_list)]
+    return np.array([-1 if index is None else index for index in tag_indexes], dtype=np.int64)
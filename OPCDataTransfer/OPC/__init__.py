@@ -1 +1,5 @@
 from .OPC import ConnectionOPC
+from .Deadband import DeadbandFilter
+from .Sources import OPCSourceType
+from .Sources import EndOfRecordingError
+from .Writer import OPCWriter
@@ -0,0 +1,196 @@
+# -*- coding: UTF-8 -*-
+
+from builtins import print
+import threading
+import queue
+import logging
+import time
+import os
+
+
+class QueueOverflowPolicy:
+    DROP_OLDEST = 'drop_oldest'
+    BLOCK = 'block'
+
+
+# marker which tells the consumer thread to finish its work
+_STOP_CONSUMER = object()
+# how long the consumer waits for new data before checking the loader batch linger time, in seconds
+_CONSUMER_IDLE_TIMEOUT = 1.0
+
+
+# Decouples reading from the OPC server and loading to the receiver. The polling loop puts the data packets
+# into a bounded queue, and the consumer threads (one loader for each thread) take them and send to the receiver
+class DataPipeline:
+
+    def __init__(self, conf_settings):
+        self._debug = None
+        self._logger = None
+        self._verbose = None
+        self._queue = None
+        self._queue_depth = None
+        self._overflow_policy = None
+        self._metrics_interval = None
+        self._time_last_metrics_print = None
+        self._consumer_threads = list()
+        self._metrics_lock = threading.Lock()
+        self._metrics = dict()
+
+        self._debug = conf_settings['debug']
+        self._set_logger(conf_settings)
+        self._verbose = conf_settings['verbose']
+        self._set_queue(conf_settings)
+        self._set_overflow_policy(conf_settings)
+        self._metrics_interval = conf_settings.get('queue_metrics_interval')
+        self._time_last_metrics_print = time.monotonic()
+        self._metrics = {'packets_put': 0,
+                         'packets_loaded': 0,
+                         'packets_dropped': 0,
+                         'rows_loaded': 0,
+                         'load_errors': 0,
+                         'max_queue_size': 0,
+                         'put_wait_time': 0.0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # the data which is already in the queue is loaded before the threads are stopped
+        for _ in self._consumer_threads:
+            self._queue.put(_STOP_CONSUMER)
+        for consumer_thread in self._consumer_threads:
+            consumer_thread.join()
+        self._consumer_threads = list()
+        self._print('Data pipeline has been stopped. ' + self._get_metrics_string())
+
+    def start(self, loaders_list):
+        # each consumer thread works with its own loader, since the receiver sessions are not thread-safe
+        for number, loader in enumerate(loaders_list):
+            consumer_thread = threading.Thread(target=self._consume, args=(loader,),
+                                               name='DataPipelineConsumer' + str(number), daemon=True)
+            consumer_thread.start()
+            self._consumer_threads.append(consumer_thread)
+        self._print('Data pipeline started with ' + str(len(self._consumer_threads)) + ' consumers')
+
+    def put(self, data):
+        # data is a list of rows or a dictionary of columns, in both cases it is empty if nothing was read
+        if not data:
+            return
+
+        start_put_time = time.monotonic()
+        if self._overflow_policy == QueueOverflowPolicy.BLOCK:
+            self._queue.put(data)
+        else:
+            self._put_dropping_oldest(data)
+
+        queue_size = self._queue.qsize()
+        with self._metrics_lock:
+            self._metrics['packets_put'] += 1
+            self._metrics['put_wait_time'] += time.monotonic() - start_put_time
+            if queue_size > self._metrics['max_queue_size']:
+                self._metrics['max_queue_size'] = queue_size
+
+        self._print_metrics_periodically()
+
+    def _put_dropping_oldest(self, data):
+        # the polling loop should never wait for the receiver. If the queue is full,
+        # the oldest packet is discarded to make room for the new one
+        while True:
+            try:
+                self._queue.put_nowait(data)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    with self._metrics_lock:
+                        self._metrics['packets_dropped'] += 1
+                except queue.Empty:
+                    pass
+
+    def _consume(self, loader):
+        while True:
+            try:
+                data = self._queue.get(timeout=_CONSUMER_IDLE_TIMEOUT)
+            except queue.Empty:
+                self._flush_expired_batch(loader)
+                continue
+            if data is _STOP_CONSUMER:
+                return
+
+            try:
+                loader.load_data(data)
+                with self._metrics_lock:
+                    self._metrics['packets_loaded'] += 1
+                    self._metrics['rows_loaded'] += loader.get_rows_number(data)
+            except Exception as e:
+                # an unexpected error must not stop the consumer thread
+                with self._metrics_lock:
+                    self._metrics['load_errors'] += 1
+                self._print('Error while loading data in the pipeline: ' + repr(e))
+
+    def _flush_expired_batch(self, loader):
+        try:
+            loader.flush_if_expired()
+        except Exception as e:
+            with self._metrics_lock:
+                self._metrics['load_errors'] += 1
+            self._print('Error while loading data in the pipeline: ' + repr(e))
+
+    def get_metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics['queue_size'] = self._queue.qsize()
+        metrics['queue_depth'] = self._queue_depth
+        return metrics
+
+    def _get_metrics_string(self):
+        metrics = self.get_metrics()
+        return ', '.join(name + ': ' + str(value) for name, value in metrics.items())
+
+    def _print_metrics_periodically(self):
+        if not self._metrics_interval:
+            return
+        current_time = time.monotonic()
+        if current_time - self._time_last_metrics_print >= self._metrics_interval:
+            self._time_last_metrics_print = current_time
+            self._print('Data pipeline metrics. ' + self._get_metrics_string())
+
+    def _print(self, message):
+        if self._verbose:
+            print(message)
+        if self._debug:
+            self._logger.info(message)
+
+    def _set_queue(self, conf_settings):
+        queue_depth = conf_settings.get('queue_depth')
+        self._queue_depth = queue_depth if queue_depth else 100
+        self._queue = queue.Queue(maxsize=self._queue_depth)
+
+    def _set_overflow_policy(self, conf_settings):
+        overflow_policy = conf_settings.get('queue_overflow_policy')
+        if overflow_policy == QueueOverflowPolicy.BLOCK:
+            self._overflow_policy = QueueOverflowPolicy.BLOCK
+        else:
+            self._overflow_policy = QueueOverflowPolicy.DROP_OLDEST
+
+    def _set_logger(self, conf_settings):
+        if self._debug:
+            logs_file_path = conf_settings['logs_file_path']
+            if not logs_file_path:
+                logs_file_path = os.path.abspath(
+                    os.path.realpath(
+                        os.path.join(os.path.dirname(os.path.realpath(__file__)), '../Data/logs.log')))
+
+            debug_level_string = conf_settings['debug_level']
+            if debug_level_string:
+                debug_level = logging.getLevelName(debug_level_string)
+            else:
+                debug_level = logging.DEBUG
+
+            logging.basicConfig(level=debug_level,
+                                format='%(asctime)s %(name)s %(levelname)s:%(message)s',
+                                filename=logs_file_path)
+            self._logger = logging.getLogger(__name__)
@@ -0,0 +1,2 @@
+from .Pipeline import DataPipeline
+from .Pipeline import QueueOverflowPolicy
@@ -1,17 +1,37 @@
 # -*- coding: UTF-8 -*-
 
+from OPCDataTransfer.ServiceFunctions.Profiler import ProfilingMode
+from OPCDataTransfer.ServiceFunctions.Profiler import DEFAULT_SAMPLING_INTERVAL
 import argparse
 import configparser
 import datetime
 
 
 class ArgParser:
-    def __init__(self):
+    def __init__(self, profiling_required=False):
         self._parser = argparse.ArgumentParser()
         self._parser.add_argument('--settings_file_path', '-s', required=True,
                                   help='path to the file with program launch settings')
+        if profiling_required:
+            self._add_profiling_arguments()
         self.namespace = self._parser.parse_args()
 
+    def _add_profiling_arguments(self):
+        # see Profiler
+        self._parser.add_argument('--profile', choices=(ProfilingMode.CPROFILE, ProfilingMode.SAMPLING),
+                                  help='profile the polling cycles: deterministic (cprofile) or sampling profiling')
+        self._parser.add_argument('--profile_cycles', type=int,
+                                  help='stop the program after profiling of this number of cycles')
+        self._parser.add_argument('--profile_seconds', type=float,
+                                  help='stop the program after profiling for this number of seconds')
+        self._parser.add_argument('--profile_memory', action='store_true',
+                                  help='write the tracemalloc snapshot of the memory allocations')
+        self._parser.add_argument('--profile_directory',
+                                  help='directory of the profile files (the current directory by default)')
+        self._parser.add_argument('--profile_interval', type=float,
+                                  help='sampling interval in seconds (' + str(DEFAULT_SAMPLING_INTERVAL) +
+                                       ' by default)')
+
     def get_namespace(self):
         return self.namespace
 
@@ -39,15 +59,57 @@ class ConfParser:
             return self._config.getboolean(section, option)
         elif option == 'diagram_series_len':
             return self._config.getint(section, option)
+        elif option == 'diagram_blit_required':
+            return self._config.getboolean(section, option)
+        elif option == 'diagram_refresh_period':
+            return self._config.getfloat(section, option)
         elif option == 'verbose':
             return self._config.getboolean(section, option)
         elif option == 'debug':
             return self._config.getboolean(section, option)
-        elif option == 'simulation_start_time':
+        elif option in ('simulation_start_time', 'backfill_end_time'):
             time_value = _parse_iso_datetime(self._config.get(section, option))
             return _datetime_to_float(time_value)
         elif option == 'simulation_time_step':
             return self._config.getint(section, option)
+        elif option in ('simulation_seed', 'simulation_workers_number', 'simulation_shards_number'):
+            return self._config.getint(section, option)
+        elif option == 'pipelined_mode':
+            return self._config.getboolean(section, option)
+        elif option in ('queue_depth', 'consumers_number'):
+            return self._config.getint(section, option)
+        elif option == 'queue_metrics_interval':
+            return self._config.getfloat(section, option)
+        elif option == 'metrics_port':
+            return self._config.getint(section, option)
+        elif option == 'metrics_file_interval':
+            return self._config.getfloat(section, option)
+        elif option in ('batch_max_rows', 'batch_max_bytes'):
+            return self._config.getint(section, option)
+        elif option == 'batch_max_linger':
+            return self._config.getfloat(section, option)
+        elif option in ('spool_max_bytes', 'spool_segment_bytes'):
+            return self._config.getint(section, option)
+        elif option in ('spool_max_age', 'spool_replay_rate', 'spool_retry_interval'):
+            return self._config.getfloat(section, option)
+        elif option in ('http_max_in_flight', 'http_max_retries'):
+            return self._config.getint(section, option)
+        elif option in ('http_retry_backoff', 'http_timeout', 'http_submit_timeout'):
+            return self._config.getfloat(section, option)
+        elif option == 'http_gzip_required':
+            return self._config.getboolean(section, option)
+        elif option in ('kafka_batch_size', 'kafka_linger_ms'):
+            return self._config.getint(section, option)
+        elif option == 'opc_write_chunk_size':
+            return self._config.getint(section, option)
+        elif option == 'opc_synthetic_tags_number':
+            return self._config.getint(section, option)
+        elif option == 'opc_synthetic_change_rate':
+            return self._config.getfloat(section, option)
+        elif option == 'opc_replay_speed':
+            return self._config.getfloat(section, option)
+        elif option == 'opc_replay_loop':
+            return self._config.getboolean(section, option)
         else:
             return self._config.get(section, option).strip()
 
@@ -0,0 +1,221 @@
+# -*- coding: UTF-8 -*-
+
+import collections
+import threading
+import tracemalloc
+import cProfile
+import pstats
+import time
+import sys
+import os
+
+# how often the stacks of the threads are sampled if the interval is not set, in seconds
+DEFAULT_SAMPLING_INTERVAL = 0.005
+# number of the lines of the text summaries of the profile and the allocations
+SUMMARY_LINES_NUMBER = 30
+
+
+class ProfilingMode:
+    # deterministic profiling of the main thread by cProfile, the file .prof is opened by snakeviz or pstats
+    CPROFILE = 'cprofile'
+    # statistical profiling of all threads by the periodic sampling of their stacks. The overhead doesn't depend
+    # on the number of the calls. The file .collapsed (folded stacks) is opened by flamegraph.pl or speedscope
+    SAMPLING = 'sampling'
+
+
+class Profiler:
+    # Profiles the polling loop for cycles_number cycles or for seconds (whichever comes first, without limits
+    # until the end of the program). The loop calls start() before the first cycle and count_cycle() after each
+    # cycle, which returns False when the profiling is finished, so the loop stops and the program exits.
+    # The files are named by run_name, the start time and the process id, so the runs don't overwrite each other
+
+    def __init__(self, mode, cycles_number=None, seconds=None, memory_required=False, directory_path=None,
+                 run_name='profile', sampling_interval=None):
+        self._mode = None
+        self._cycles_number = None
+        self._seconds = None
+        self._memory_required = None
+        self._directory_path = None
+        self._run_name = None
+        self._sampling_interval = None
+        self._profile = None
+        self._sampler = None
+        self._start_time = None
+        self._cycles_counter = 0
+        self._started = False
+        self._stopped = False
+        self._file_paths_list = list()
+
+        if mode not in (ProfilingMode.CPROFILE, ProfilingMode.SAMPLING):
+            raise ValueError('unknown profiling mode ' + str(mode))
+        self._mode = mode
+        self._cycles_number = cycles_number
+        self._seconds = seconds
+        self._memory_required = memory_required
+        self._directory_path = directory_path or os.getcwd()
+        self._run_name = run_name
+        self._sampling_interval = sampling_interval or DEFAULT_SAMPLING_INTERVAL
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        # the profile is written also on Ctrl+C or on the error
+        self.stop()
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self._start_time = time.time()
+        if self._memory_required:
+            tracemalloc.start()
+        if self._mode == ProfilingMode.CPROFILE:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = _StackSampler(self._sampling_interval)
+            self._sampler.start()
+        print('profiling ' + self._mode + ' started' + self._get_limits_string())
+
+    def count_cycle(self):
+        # returns False when the number of the cycles or the time of the profiling is reached
+        self._cycles_counter += 1
+        if (self._cycles_number and self._cycles_counter >= self._cycles_number
+                or self._seconds and time.time() - self._start_time >= self._seconds):
+            self.stop()
+            return False
+        return True
+
+    def stop(self):
+        if not self._started or self._stopped:
+            return
+        self._stopped = True
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        memory_snapshot = None
+        if self._memory_required:
+            memory_snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+        os.makedirs(self._directory_path, exist_ok=True)
+        base_path = os.path.join(self._directory_path, self._run_name + '_' +
+                                 time.strftime('%Y%m%d_%H%M%S', time.localtime(self._start_time)) + '_' +
+                                 str(os.getpid()))
+        if self._profile is not None:
+            self._write_cprofile(base_path)
+        if self._sampler is not None:
+            self._write_samples(base_path)
+        if memory_snapshot is not None:
+            self._write_memory_snapshot(memory_snapshot, base_path)
+        print('profiling finished after ' + str(self._cycles_counter) + ' cycles and ' +
+              '{:.1f}'.format(time.time() - self._start_time) + ' s, files:')
+        for file_path in self._file_paths_list:
+            print('    ' + file_path)
+
+    def get_file_paths_list(self):
+        return self._file_paths_list
+
+    def _get_limits_string(self):
+        limits_list = list()
+        if self._cycles_number:
+            limits_list.append(str(self._cycles_number) + ' cycles')
+        if self._seconds:
+            limits_list.append(str(self._seconds) + ' s')
+        return ' for ' + ' or '.join(limits_list) if limits_list else ''
+
+    def _write_cprofile(self, base_path):
+        profile_file_path = base_path + '.prof'
+        self._profile.dump_stats(profile_file_path)
+        self._file_paths_list.append(profile_file_path)
+        # the summary for the sites without snakeviz
+        summary_file_path = base_path + '_prof.txt'
+        with open(summary_file_path, 'w') as summary_file:
+            statistics = pstats.Stats(self._profile, stream=summary_file)
+            statistics.sort_stats('cumulative').print_stats(SUMMARY_LINES_NUMBER)
+        self._file_paths_list.append(summary_file_path)
+
+    def _write_samples(self, base_path):
+        # one line per unique stack: frames from the root separated by ';' and the number of samples
+        samples_file_path = base_path + '.collapsed'
+        with open(samples_file_path, 'w') as samples_file:
+            for stack, samples_number in sorted(self._sampler.get_stacks_counter().items()):
+                samples_file.write(';'.join(stack) + ' ' + str(samples_number) + '\n')
+        self._file_paths_list.append(samples_file_path)
+
+    def _write_memory_snapshot(self, memory_snapshot, base_path):
+        # the snapshot is loaded by tracemalloc.Snapshot.load for the comparison with the other runs
+        snapshot_file_path = base_path + '.tracemalloc'
+        memory_snapshot.dump(snapshot_file_path)
+        self._file_paths_list.append(snapshot_file_path)
+        summary_file_path = base_path + '_tracemalloc.txt'
+        with open(summary_file_path, 'w') as summary_file:
+            for statistic in memory_snapshot.statistics('lineno')[:SUMMARY_LINES_NUMBER]:
+                summary_file.write(str(statistic) + '\n')
+        self._file_paths_list.append(summary_file_path)
+
+
+class _StackSampler:
+    # background thread which counts the stacks of the other threads of the process once in the interval
+
+    def __init__(self, interval):
+        self._interval = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._stacks_counter = collections.Counter()
+        self._frame_names_dict = dict()
+        self._thread_names_dict = dict()
+
+        self._interval = interval
+        self._thread = threading.Thread(target=self._sample_periodically, name='StackSampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def get_stacks_counter(self):
+        return self._stacks_counter
+
+    def _sample_periodically(self):
+        sampler_thread_id = threading.get_ident()
+        while not self._stop_event.wait(self._interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != sampler_thread_id:
+                    self._stacks_counter[self._get_stack(thread_id, frame)] += 1
+
+    def _get_stack(self, thread_id, frame):
+        stack_list = list()
+        while frame is not None:
+            stack_list.append(self._get_frame_name(frame.f_code))
+            frame = frame.f_back
+        stack_list.append(self._get_thread_name(thread_id))
+        stack_list.reverse()
+        return tuple(stack_list)
+
+    def _get_frame_name(self, code):
+        frame_name = self._frame_names_dict.get(code)
+        if frame_name is None:
+            frame_name = self._frame_names_dict[code] = (code.co_name + ' (' + os.path.basename(code.co_filename) +
+                                                         ':' + str(code.co_firstlineno) + ')')
+        return frame_name
+
+    def _get_thread_name(self, thread_id):
+        thread_name = self._thread_names_dict.get(thread_id)
+        if thread_name is None:
+            self._thread_names_dict.update((thread.ident, thread.name) for thread in threading.enumerate())
+            thread_name = self._thread_names_dict.setdefault(thread_id, 'thread ' + str(thread_id))
+        return thread_name
+
+
+def create_profiler(args_namespace, run_name):
+    # Profiler by the command line options of ArgParser(profiling_required=True), None without --profile
+    if not getattr(args_namespace, 'profile', None):
+        return None
+    return Profiler(args_namespace.profile, args_namespace.profile_cycles, args_namespace.profile_seconds,
+                    args_namespace.profile_memory, args_namespace.profile_directory, run_name,
+                    args_namespace.profile_interval)
@@ -0,0 +1,128 @@
+# -*- coding: UTF-8 -*-
+
+import time
+
+# name of the schedule of FixedRateScheduler in the statistics of the schedules
+DEFAULT_SCHEDULE_NAME = 'default'
+
+
+class MissedTicksPolicy:
+    # after an overrun, the missed ticks are dropped and the schedule continues from the nearest tick
+    SKIP = 'skip'
+    # after an overrun, the missed ticks are executed one after another without waiting
+    CATCH_UP = 'catch_up'
+
+
+class FixedRateScheduler:
+    # The ticks are aligned to a monotonic clock: tick n is planned at start_time + n * period,
+    # so the time spent on the work doesn't shift the following ticks. With period 0 the ticks go without waiting.
+
+    def __init__(self, frequency, missed_ticks_policy=None):
+        self._period = None
+        self._missed_ticks_policy = None
+        self._next_tick_time = None
+        self._ticks_count = 0
+        self._overruns_count = 0
+        self._skipped_ticks_count = 0
+        self._max_lateness = 0.0
+
+        self._period = frequency
+        if missed_ticks_policy == MissedTicksPolicy.CATCH_UP:
+            self._missed_ticks_policy = MissedTicksPolicy.CATCH_UP
+        else:
+            self._missed_ticks_policy = MissedTicksPolicy.SKIP
+
+    def wait_next_tick(self):
+        # waits for the next planned tick and returns the number of ticks skipped before it
+        current_time = time.monotonic()
+        if self._next_tick_time is None:
+            # the first tick is executed immediately and sets the grid of the following ticks
+            self.start(current_time)
+            return 0
+
+        lateness = current_time - self._next_tick_time
+        if lateness < 0:
+            time.sleep(-lateness)
+        return self.register_tick(lateness)
+
+    def start(self, current_time):
+        # the first tick at current_time, when the waiting is done outside (see MultiRateScheduler)
+        self._next_tick_time = current_time + self._period
+        self._ticks_count += 1
+
+    def register_tick(self, lateness):
+        # the planned tick is executed lateness seconds after its time, returns the number of skipped ticks
+        if not self._period:
+            self._ticks_count += 1
+            return 0
+
+        skipped_ticks = 0
+        if lateness >= 0:
+            # the previous work didn't fit into the period
+            self._overruns_count += 1
+            self._max_lateness = max(self._max_lateness, lateness)
+            if self._missed_ticks_policy == MissedTicksPolicy.SKIP:
+                skipped_ticks = int(lateness // self._period)
+                self._next_tick_time += skipped_ticks * self._period
+                self._skipped_ticks_count += skipped_ticks
+
+        self._next_tick_time += self._period
+        self._ticks_count += 1
+        return skipped_ticks
+
+    def get_next_tick_time(self):
+        return self._next_tick_time
+
+    def get_period(self):
+        return self._period
+
+    def get_statistics(self):
+        return {'ticks': self._ticks_count,
+                'overruns': self._overruns_count,
+                'skipped_ticks': self._skipped_ticks_count,
+                'max_lateness': self._max_lateness}
+
+    def get_schedules_statistics(self):
+        # the same as in MultiRateScheduler, the only schedule is named DEFAULT_SCHEDULE_NAME
+        return {DEFAULT_SCHEDULE_NAME: self.get_statistics()}
+
+
+class MultiRateScheduler:
+    # Several fixed-rate schedules (for example, one for each OPC group) in one loop. Every wait returns
+    # the names of the schedules whose ticks are due, ticks of different schedules planned
+    # at the same moment (within _TICKS_MERGE_INTERVAL) are returned together.
+    _TICKS_MERGE_INTERVAL = 0.001
+
+    def __init__(self, frequencies_dict, missed_ticks_policy=None):
+        self._schedulers = dict()
+        self._started = False
+
+        for name, frequency in frequencies_dict.items():
+            self._schedulers[name] = FixedRateScheduler(frequency, missed_ticks_policy)
+
+    def wait_next_tick(self):
+        current_time = time.monotonic()
+        if not self._started:
+            # all schedules start with the first tick at the same time
+            self._started = True
+            for scheduler in self._schedulers.values():
+                scheduler.start(current_time)
+            return list(self._schedulers.keys())
+
+        earliest_tick_time = min(scheduler.get_next_tick_time() for scheduler in self._schedulers.values())
+        if earliest_tick_time > current_time:
+            time.sleep(earliest_tick_time - current_time)
+        wake_up_time = max(current_time, earliest_tick_time) + self._TICKS_MERGE_INTERVAL
+
+        due_names_list = list()
+        for name, scheduler in self._schedulers.items():
+            if scheduler.get_next_tick_time() <= wake_up_time:
+                scheduler.register_tick(current_time - scheduler.get_next_tick_time())
+                due_names_list.append(name)
+        return due_names_list
+
+    def get_statistics(self):
+        return {name: scheduler.get_statistics() for name, scheduler in self._schedulers.items()}
+
+    def get_schedules_statistics(self):
+        return self.get_statistics()
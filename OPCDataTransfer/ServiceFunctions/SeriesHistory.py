@@ -0,0 +1,235 @@
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+import multiprocessing
+import datetime
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class SeriesHistory:
+    # The last capacity values of each series (combination of tag codes) with their times, in fixed-size arrays
+    # used as ring buffers, so the memory doesn't grow however long the process runs.
+    # The times are stored as seconds of the local time since 1970-01-01 (the time shown on diagrams).
+    # The shared history keeps the arrays in the shared memory and can be passed to another process (on its start),
+    # which reads the data while this process writes it: the sequence number is odd while the data is written,
+    # so the reader sees the torn reads and drops them instead of waiting for the writer
+
+    def __init__(self, codes_dicts_list, capacity, shared=False):
+        self._code_names_list = list()
+        self._series_codes_list = list()
+        self._series_index = dict()
+        self._capacity = None
+        self._shared_buffers = None
+        self._values = None
+        self._times = None
+        self._counters = None
+        self._write_counts = None
+
+        # the series are the unique combinations of the codes of the tags in the order of the tags
+        if codes_dicts_list:
+            self._code_names_list = list(codes_dicts_list[0].keys())
+        for codes_dict in codes_dicts_list:
+            series_codes = tuple(codes_dict[name] for name in self._code_names_list)
+            if series_codes not in self._series_index:
+                self._series_index[series_codes] = len(self._series_codes_list)
+                self._series_codes_list.append(series_codes)
+
+        self._capacity = max(int(capacity), 1)
+        series_number = len(self._series_codes_list)
+        if shared:
+            # the buffers are not empty, so numpy can make the arrays on them for any number of series
+            self._shared_buffers = (multiprocessing.RawArray('d', 2 * series_number * self._capacity + 1),
+                                    multiprocessing.RawArray('q', series_number + 1))
+            self._set_arrays_on_shared_buffers()
+            self._values[:] = np.nan
+            self._times[:] = np.nan
+        else:
+            self._values = np.full((series_number, self._capacity), np.nan)
+            self._times = np.full((series_number, self._capacity), np.nan)
+            self._counters = np.zeros(series_number + 1, dtype=np.int64)
+        # the sequence number of the writes and the number of values written to each series since the start
+        self._write_counts = self._counters[1:]
+
+    def _set_arrays_on_shared_buffers(self):
+        series_number = len(self._series_codes_list)
+        data_array = np.frombuffer(self._shared_buffers[0], dtype=np.float64)[:2 * series_number * self._capacity]
+        self._values, self._times = data_array.reshape(2, series_number, self._capacity)
+        self._counters = np.frombuffer(self._shared_buffers[1], dtype=np.int64)
+
+    def __getstate__(self):
+        # the arrays of the shared history are not copied, they are made on the shared buffers again
+        state = dict(self.__dict__)
+        if self._shared_buffers is not None:
+            for name in ('_values', '_times', '_counters', '_write_counts'):
+                state[name] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._shared_buffers is not None:
+            self._set_arrays_on_shared_buffers()
+            self._write_counts = self._counters[1:]
+
+    def get_capacity(self):
+        return self._capacity
+
+    def get_code_names_list(self):
+        return list(self._code_names_list)
+
+    def get_series_codes_list(self):
+        return list(self._series_codes_list)
+
+    def get_series_index(self, series_codes):
+        # series_codes - tuple of the codes in the order of get_code_names_list, None for unknown codes
+        return self._series_index.get(series_codes)
+
+    def get_write_counts(self):
+        return self._write_counts.copy()
+
+    def get_sequence_number(self):
+        # changes on each write, odd while the data is being written
+        return int(self._counters[0])
+
+    def append_rows(self, rows_list):
+        # rows_list - list of dictionaries with the codes, value and time (as in convert_values_to_list)
+        series_indexes = list()
+        values = list()
+        times = list()
+        for row in rows_list:
+            series_index = self._series_index.get(tuple(row[name] for name in self._code_names_list))
+            if series_index is None:
+                continue
+            series_indexes.append(series_index)
+            values.append(row['value'])
+            times.append(row['time'])
+        self.append(series_indexes, values, times)
+
+    def append_columns(self, columns_dict):
+        # columns_dict - dictionary of arrays with the codes, value and time (as in convert_values_to_columns)
+        if not columns_dict:
+            return
+        codes_list = zip(*[columns_dict[name].tolist() for name in self._code_names_list])
+        series_indexes = np.array([self._series_index.get(series_codes, -1) for series_codes in codes_list],
+                                  dtype=np.intp)
+        known = series_indexes >= 0
+        times = columns_dict['time']
+        if np.ndim(times):
+            times = np.asarray(times)[known]
+        self.append(series_indexes[known], np.asarray(columns_dict['value'])[known], times)
+
+    def append(self, series_indexes, values, times):
+        # times - one time for all values or a sequence of times, see get_wall_clock_seconds
+        series_indexes = np.asarray(series_indexes, dtype=np.intp)
+        if not len(series_indexes):
+            return
+        values = np.asarray(values, dtype=np.float64)
+        times = np.broadcast_to(get_wall_clock_seconds(times), series_indexes.shape)
+
+        # the values of the same series go one after another in the order of the rows
+        order = np.argsort(series_indexes, kind='stable')
+        sorted_indexes = series_indexes[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_indexes[1:] != sorted_indexes[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(sorted_indexes)])
+        ranks = np.arange(len(sorted_indexes)) - np.repeat(group_starts, group_sizes)
+
+        positions = (self._write_counts[sorted_indexes] + ranks) % self._capacity
+        self._counters[0] += 1
+        try:
+            self._values[sorted_indexes, positions] = values[order]
+            self._times[sorted_indexes, positions] = times[order]
+            np.add.at(self._write_counts, sorted_indexes[group_starts], group_sizes)
+        finally:
+            self._counters[0] += 1
+
+    def get_series(self, series_index, points_number=None):
+        # returns the arrays of times and values of the last points_number points of the series, from old to new
+        write_count = int(self._write_counts[series_index])
+        points_number = min(write_count, self._capacity, points_number or self._capacity)
+        positions = np.arange(write_count - points_number, write_count) % self._capacity
+        return self._times[series_index, positions], self._values[series_index, positions]
+
+    def get_series_block(self, series_indexes, points_number=None):
+        # the last points_number points of several series gathered at once: the arrays of times and values with one row
+        # for each series, from old to new. The points not written yet and the unknown series (index -1) are nan
+        series_indexes = np.asarray(series_indexes, dtype=np.intp)
+        points_number = min(points_number or self._capacity, self._capacity)
+        known = series_indexes >= 0
+        if not len(self._write_counts) or not known.any():
+            return np.full((len(series_indexes), points_number), np.nan), \
+                np.full((len(series_indexes), points_number), np.nan)
+
+        rows = np.where(known, series_indexes, 0)
+        # while the series isn't full, the positions before its first point are not written yet and contain nan
+        positions = (self._write_counts[rows][:, np.newaxis] + np.arange(-points_number, 0)) % self._capacity
+        times = self._times[rows[:, np.newaxis], positions]
+        values = self._values[rows[:, np.newaxis], positions]
+        times[~known] = np.nan
+        values[~known] = np.nan
+        return times, values
+
+    def read_series_block(self, series_indexes, points_number=None):
+        # the same as get_series_block, but returns None if the data was being written during the reading
+        sequence_number = self.get_sequence_number()
+        if sequence_number % 2:
+            return None
+        series_block = self.get_series_block(series_indexes, points_number)
+        if self.get_sequence_number() != sequence_number:
+            return None
+        return series_block
+
+    def get_rows(self):
+        # all stored points as the list of dictionaries with the local time as datetime, sorted by time
+        rows_list = list()
+        for series_index, series_codes in enumerate(self._series_codes_list):
+            times, values = self.get_series(series_index)
+            for current_time, value in zip(times.tolist(), values.tolist()):
+                row = dict(zip(self._code_names_list, series_codes))
+                row['value'] = value
+                row['time'] = _EPOCH + datetime.timedelta(seconds=current_time)
+                rows_list.append(row)
+        rows_list.sort(key=lambda row: row['time'])
+        return rows_list
+
+
+def get_wall_clock_seconds(times):
+    # converts datetime64, datetime objects, timestamps (seconds since the epoch) and OPC time strings
+    # to the seconds of the local time since 1970-01-01
+    times_array = np.asarray(times)
+    if np.issubdtype(times_array.dtype, np.datetime64):
+        return (times_array - np.datetime64(0, 's')) / np.timedelta64(1, 's')
+    if np.issubdtype(times_array.dtype, np.number):
+        return _get_timestamps_wall_clock_seconds(times_array.astype(np.float64))
+
+    converted_times = dict()
+    for time_value in set(times_array.reshape(-1).tolist()):
+        converted_times[time_value] = _get_wall_clock_seconds(time_value)
+    if not times_array.ndim:
+        return converted_times[times_array.item()]
+    return np.array([converted_times[time_value] for time_value in times_array.tolist()], dtype=np.float64)
+
+
+def _get_timestamps_wall_clock_seconds(timestamps):
+    # the offset of the local time is found once for each quarter of an hour (the offset changes at the boundaries
+    # of the quarters in all time zones) and added to all timestamps of the quarter
+    finite = np.isfinite(timestamps)
+    quarters, inverse_indexes = np.unique(np.floor_divide(timestamps[finite], 900), return_inverse=True)
+    offsets = np.array([_get_local_time_offset(quarter * 900) for quarter in quarters.tolist()], dtype=np.float64)
+    wall_clock_seconds = np.full(timestamps.shape, np.nan)
+    wall_clock_seconds[finite] = timestamps[finite] + offsets[inverse_indexes.reshape(-1)]
+    return wall_clock_seconds if wall_clock_seconds.ndim else float(wall_clock_seconds)
+
+
+def _get_local_time_offset(timestamp):
+    return (datetime.datetime.fromtimestamp(timestamp) - _EPOCH).total_seconds() - timestamp
+
+
+def _get_wall_clock_seconds(time_value):
+    if isinstance(time_value, datetime.datetime):
+        return (time_value.replace(tzinfo=None) - _EPOCH).total_seconds()
+    if isinstance(time_value, str):
+        return (datetime.datetime.strptime(time_value, '%m/%d/%y %H:%M:%S') - _EPOCH).total_seconds()
+    if isinstance(time_value, (int, float)):
+        # timestamp of the simulation model
+        return (datetime.datetime.fromtimestamp(time_value) - _EPOCH).total_seconds()
+    return np.nan
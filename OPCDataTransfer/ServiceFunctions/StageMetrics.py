@@ -0,0 +1,262 @@
+# -*- coding: UTF-8 -*-
+
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+import threading
+import bisect
+import time
+import os
+
+# prefix of the names of the metrics in the Prometheus text format
+METRICS_PREFIX = 'opc_data_transfer'
+# upper bounds of the buckets of the stage duration histograms, in seconds
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                    5.0, 10.0)
+# how often the metrics file is rewritten if the interval is not set, in seconds
+DEFAULT_METRICS_FILE_INTERVAL = 10.0
+
+
+# statistics of the schedules of the loop: name in the scheduler statistics, name of the metric, type, description
+_SCHEDULER_METRICS = (('ticks', 'ticks_total', 'counter', 'Number of the ticks of the schedule'),
+                      ('overruns', 'overruns_total', 'counter', 'Number of the ticks late because of the work overrun'),
+                      ('skipped_ticks', 'skipped_ticks_total', 'counter', 'Number of the ticks skipped after overruns'),
+                      ('max_lateness', 'max_lateness_seconds', 'gauge', 'Maximum lateness of the tick'))
+
+
+class Stage:
+    # the whole cycle of polling
+    CYCLE = 'cycle'
+    # reading of the values from the OPC server
+    OPC_READ = 'opc_read'
+    # writing of the values to the OPC server (the simulator)
+    OPC_WRITE = 'opc_write'
+    # deadband filter and conversion of the values to rows or columns
+    TRANSFORM = 'transform'
+    # passing of the data to the loader or to the pipeline queue in the polling loop
+    LOAD = 'load'
+    # sending of the data to the receiver by the loader (in the background for the HTTP service and Kafka)
+    SEND = 'send'
+    # writing of the data to the diagram history
+    PLOT = 'plot'
+
+
+class _StageStatistics:
+    __slots__ = ('bucket_counts', 'duration_sum', 'count', 'rows', 'bytes', 'errors', 'timeouts')
+
+    def __init__(self):
+        # the last bucket is +Inf
+        self.bucket_counts = [0] * (len(DURATION_BUCKETS) + 1)
+        self.duration_sum = 0.0
+        self.count = 0
+        self.rows = 0
+        self.bytes = 0
+        self.errors = 0
+        self.timeouts = 0
+
+
+class StageMetrics:
+    # Duration histograms and counters of rows, bytes, errors and timeouts for each stage of the transfer.
+    # The stages are measured by the callers (time.perf_counter before and after the stage) and are thread-safe,
+    # since the data is sent by the loaders in the pipeline threads
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = dict()
+        self._start_time = time.time()
+        self._scheduler = None
+
+    def set_scheduler(self, scheduler):
+        # FixedRateScheduler or MultiRateScheduler of the loop: its ticks, overruns, skipped ticks and
+        # the maximum lateness of each schedule are exported with the stages
+        self._scheduler = scheduler
+
+    def observe(self, stage, duration, rows_number=0, bytes_number=0):
+        bucket_index = bisect.bisect_left(DURATION_BUCKETS, duration)
+        with self._lock:
+            statistics = self._get_stage_statistics(stage)
+            statistics.bucket_counts[bucket_index] += 1
+            statistics.duration_sum += duration
+            statistics.count += 1
+            statistics.rows += rows_number
+            statistics.bytes += bytes_number
+
+    def count_data(self, stage, rows_number=0, bytes_number=0):
+        # the data passed without the measurement of the duration (sent in the background)
+        with self._lock:
+            statistics = self._get_stage_statistics(stage)
+            statistics.rows += rows_number
+            statistics.bytes += bytes_number
+
+    def count_error(self, stage, timeout=False):
+        with self._lock:
+            statistics = self._get_stage_statistics(stage)
+            statistics.errors += 1
+            if timeout:
+                statistics.timeouts += 1
+
+    def _get_stage_statistics(self, stage):
+        statistics = self._stages.get(stage)
+        if statistics is None:
+            statistics = self._stages[stage] = _StageStatistics()
+        return statistics
+
+    def get_metrics(self):
+        # dictionary of the stages with their counters and duration percentiles estimated by the histograms
+        metrics = dict()
+        with self._lock:
+            for stage, statistics in self._stages.items():
+                metrics[stage] = {'count': statistics.count,
+                                  'duration_sum': statistics.duration_sum,
+                                  'duration_p50': _get_bucket_percentile(statistics, 0.5),
+                                  'duration_p99': _get_bucket_percentile(statistics, 0.99),
+                                  'rows': statistics.rows,
+                                  'bytes': statistics.bytes,
+                                  'errors': statistics.errors,
+                                  'timeouts': statistics.timeouts}
+        if self._scheduler is not None:
+            metrics['schedules'] = self._scheduler.get_schedules_statistics()
+        return metrics
+
+    def get_prometheus_text(self):
+        lines_list = list()
+        histogram_name = METRICS_PREFIX + '_stage_duration_seconds'
+        lines_list.append('# HELP ' + histogram_name + ' Duration of the stage of the data transfer')
+        lines_list.append('# TYPE ' + histogram_name + ' histogram')
+        counters_lines_dict = {name: list() for name in ('rows', 'bytes', 'errors', 'timeouts')}
+        with self._lock:
+            for stage, statistics in sorted(self._stages.items()):
+                stage_label = 'stage="' + stage + '"'
+                cumulative_count = 0
+                for upper_bound, bucket_count in zip(DURATION_BUCKETS + ('+Inf',), statistics.bucket_counts):
+                    cumulative_count += bucket_count
+                    lines_list.append(histogram_name + '_bucket{' + stage_label + ',le="' + str(upper_bound) + '"} ' +
+                                      str(cumulative_count))
+                lines_list.append(histogram_name + '_sum{' + stage_label + '} ' + repr(statistics.duration_sum))
+                lines_list.append(histogram_name + '_count{' + stage_label + '} ' + str(statistics.count))
+                for name, counter_lines_list in counters_lines_dict.items():
+                    counter_lines_list.append(METRICS_PREFIX + '_stage_' + name + '_total{' + stage_label + '} ' +
+                                              str(getattr(statistics, name)))
+
+        for name, counter_lines_list in counters_lines_dict.items():
+            counter_name = METRICS_PREFIX + '_stage_' + name + '_total'
+            lines_list.append('# HELP ' + counter_name + ' Number of ' + name + ' of the stage of the data transfer')
+            lines_list.append('# TYPE ' + counter_name + ' counter')
+            lines_list.extend(counter_lines_list)
+        if self._scheduler is not None:
+            lines_list.extend(self._get_scheduler_lines())
+        start_time_name = METRICS_PREFIX + '_start_time_seconds'
+        lines_list.append('# TYPE ' + start_time_name + ' gauge')
+        lines_list.append(start_time_name + ' ' + repr(self._start_time))
+        return '\n'.join(lines_list) + '\n'
+
+    def _get_scheduler_lines(self):
+        lines_list = list()
+        schedules_statistics = sorted(self._scheduler.get_schedules_statistics().items())
+        for name, metric_suffix, metric_type, help_string in _SCHEDULER_METRICS:
+            metric_name = METRICS_PREFIX + '_scheduler_' + metric_suffix
+            lines_list.append('# HELP ' + metric_name + ' ' + help_string)
+            lines_list.append('# TYPE ' + metric_name + ' ' + metric_type)
+            for schedule_name, statistics in schedules_statistics:
+                lines_list.append(metric_name + '{schedule="' + str(schedule_name) + '"} ' + repr(statistics[name]))
+        return lines_list
+
+
+def _get_bucket_percentile(statistics, quantile):
+    # upper bound of the bucket containing the quantile, None for the +Inf bucket or without observations
+    if not statistics.count:
+        return None
+    cumulative_count = 0
+    for upper_bound, bucket_count in zip(DURATION_BUCKETS, statistics.bucket_counts):
+        cumulative_count += bucket_count
+        if cumulative_count >= quantile * statistics.count:
+            return upper_bound
+    return None
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.server.stage_metrics.get_prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsExporter:
+    # Exposes StageMetrics in the Prometheus text format: on http://metrics_host:metrics_port/metrics
+    # and (or) in the file metrics_file_path, which is rewritten every metrics_file_interval seconds
+
+    def __init__(self, stage_metrics, conf_settings):
+        self._stage_metrics = None
+        self._server = None
+        self._server_thread = None
+        self._file_path = None
+        self._file_interval = None
+        self._file_thread = None
+        self._stop_event = threading.Event()
+
+        self._stage_metrics = stage_metrics
+        if conf_settings.get('metrics_port'):
+            self._server = _ThreadingHTTPServer((conf_settings.get('metrics_host') or '127.0.0.1',
+                                                 conf_settings['metrics_port']), _MetricsRequestHandler)
+            self._server.stage_metrics = stage_metrics
+            self._server_thread = threading.Thread(target=self._server.serve_forever, name='MetricsServer',
+                                                   daemon=True)
+            self._server_thread.start()
+        if conf_settings.get('metrics_file_path'):
+            self._file_path = conf_settings['metrics_file_path']
+            self._file_interval = conf_settings.get('metrics_file_interval') or DEFAULT_METRICS_FILE_INTERVAL
+            self._file_thread = threading.Thread(target=self._write_file_periodically, name='MetricsFileWriter',
+                                                 daemon=True)
+            self._file_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server_thread.join()
+            self._server = None
+        if self._file_thread is not None:
+            self._stop_event.set()
+            self._file_thread.join()
+            self._file_thread = None
+            # the final values
+            self.write_file()
+
+    def get_url(self):
+        if self._server is None:
+            return None
+        host, port = self._server.server_address
+        return 'http://' + host + ':' + str(port) + '/metrics'
+
+    def _write_file_periodically(self):
+        while not self._stop_event.wait(self._file_interval):
+            self.write_file()
+
+    def write_file(self):
+        # the file is replaced at once, so the readers never see the partly written file
+        temporary_file_path = self._file_path + '.tmp'
+        with open(temporary_file_path, 'w') as metrics_file:
+            metrics_file.write(self._stage_metrics.get_prometheus_text())
+        os.replace(temporary_file_path, self._file_path)
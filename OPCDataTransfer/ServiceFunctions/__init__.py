@@ -1,4 +1,14 @@
 from .Parser import ArgParser
 from .Parser import ConfParser
+from .Profiler import Profiler
+from .Profiler import ProfilingMode
+from .Profiler import create_profiler
 from .Enumerators import ControllerParametersEnum as Parameters
 from .Enumerators import StatisticsParametersEnum as StatParams
+from .Scheduler import FixedRateScheduler
+from .Scheduler import MissedTicksPolicy
+from .Scheduler import MultiRateScheduler
+from .SeriesHistory import SeriesHistory
+from .StageMetrics import StageMetrics
+from .StageMetrics import MetricsExporter
+from .StageMetrics import Stage
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3.6
+# -*- coding: UTF-8 -*-
+
+# Generates the historical data of the simulation model for the time range from simulation_start_time
+# to backfill_end_time with the step simulation_time_step as fast as possible: without OPC server and without waiting
+# between the steps. The data goes straight to the loader (in batches) or to the local columnar file.
+
+from OPCDataTransfer import Simulation
+from OPCDataTransfer.Simulation.ParallelSimulation import ParallelSimulation
+from OPCDataTransfer.Visualization import ArrayFunctions
+from OPCDataTransfer import Loader
+from OPCDataTransfer import LoaderType
+from OPCDataTransfer import InsertMode
+from OPCDataTransfer.ServiceFunctions import ArgParser
+from OPCDataTransfer import ConfParser
+import numpy as np
+import collections
+import datetime
+import zipfile
+import time
+
+PARAMETERS_NAME_STRING = 'facility,component,parameter,value,time'
+# batch size of the backfill if the batch limits are not set in the settings
+DEFAULT_BATCH_MAX_ROWS = 100000
+# how often the progress is printed, in steps
+PROGRESS_STEPS_NUMBER = 10000
+
+
+class BackfillSink:
+    # the loader of the loader_type from the settings
+    LOADER = 'loader'
+    # the columnar file backfill_file_path, see ColumnarFileWriter
+    FILE = 'file'
+
+
+class ColumnarFileWriter:
+    # The columns are written to the zip archive by batches, each batch of the column is a separate .npy file
+    # <column name>/<batch number>.npy. The file can be read by read_columnar_file or by numpy.load
+
+    def __init__(self, file_path, batch_max_rows=None):
+        self._file = None
+        self._batch_max_rows = None
+        self._batch_data = list()
+        self._batch_rows = 0
+        self._batches_number = 0
+
+        self._file = zipfile.ZipFile(file_path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        self._batch_max_rows = batch_max_rows or DEFAULT_BATCH_MAX_ROWS
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def load_data(self, columns_dict):
+        if not columns_dict:
+            return
+        self._batch_data.append(columns_dict)
+        self._batch_rows += len(next(iter(columns_dict.values())))
+        if self._batch_rows >= self._batch_max_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._batch_data:
+            return
+
+        for name in self._batch_data[0]:
+            column = np.concatenate([columns_dict[name] for columns_dict in self._batch_data])
+            with self._file.open(name + '/' + str(self._batches_number).zfill(6) + '.npy', 'w',
+                                 force_zip64=True) as column_file:
+                np.lib.format.write_array(column_file, column, allow_pickle=False)
+        self._batches_number += 1
+        self._batch_data = list()
+        self._batch_rows = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def read_columnar_file(file_path):
+    # returns the dictionary of the columns written by ColumnarFileWriter
+    columns_batches = collections.OrderedDict()
+    with zipfile.ZipFile(file_path, 'r') as columnar_file:
+        for name in sorted(columnar_file.namelist()):
+            column_name = name.split('/')[0]
+            with columnar_file.open(name, 'r') as column_file:
+                columns_batches.setdefault(column_name, list()).append(np.lib.format.read_array(column_file))
+    return {name: np.concatenate(batches_list) for name, batches_list in columns_batches.items()}
+
+
+def start_backfill(conf_settings):
+    start_time = conf_settings['simulation_start_time']
+    end_time = conf_settings['backfill_end_time']
+    simulation_time_step = conf_settings['simulation_time_step']
+    sink = conf_settings.get('backfill_sink') or BackfillSink.LOADER
+    batch_max_rows = conf_settings.get('batch_max_rows') or DEFAULT_BATCH_MAX_ROWS
+
+    if sink == BackfillSink.FILE:
+        data_sink = ColumnarFileWriter(conf_settings['backfill_file_path'], batch_max_rows)
+        columnar_mode = True
+    else:
+        data_sink = _create_loader(conf_settings)
+        columnar_mode = conf_settings.get('insert_mode') == InsertMode.COLUMNAR.value
+
+    # the model is split by facilities between simulation_workers_number processes.
+    # With simulation_seed the same data is generated on each run
+    simulation = ParallelSimulation(Simulation.SimulationParameters(),
+                                    conf_settings.get('simulation_engine'),
+                                    conf_settings.get('simulation_seed'),
+                                    conf_settings.get('simulation_workers_number'),
+                                    conf_settings.get('simulation_shards_number'))
+    # the steps are computed by chunks of about one batch
+    chunk_steps_number = max(batch_max_rows // max(simulation.get_tags_number(), 1), 1)
+    total_steps_number = int(np.ceil((end_time - start_time) / simulation_time_step))
+
+    steps_number = 0
+    rows_number = 0
+    process_start_time = time.monotonic()
+    with simulation, data_sink:
+        while steps_number < total_steps_number:
+            chunk_start_time = start_time + steps_number * simulation_time_step
+            current_steps_number = min(chunk_steps_number, total_steps_number - steps_number)
+            columns_dict = simulation.run_steps(chunk_start_time, current_steps_number, simulation_time_step)
+            columns_dict['time'] = _to_datetime64(columns_dict['time'])
+            if columnar_mode:
+                data_sink.load_data(columns_dict)
+            else:
+                data_sink.load_data(ArrayFunctions.dict_of_arrays_to_list_of_structures(columns_dict))
+
+            if (steps_number + current_steps_number) // PROGRESS_STEPS_NUMBER > steps_number // PROGRESS_STEPS_NUMBER:
+                print('backfill ' + _format_time(chunk_start_time) + ': ' + str(steps_number) + ' steps, ' +
+                      str(rows_number) + ' rows')
+            steps_number += current_steps_number
+            rows_number += len(columns_dict['value'])
+
+    elapsed_time = time.monotonic() - process_start_time
+    print('backfill from ' + _format_time(start_time) + ' to ' + _format_time(end_time) + ' is finished: ' +
+          str(steps_number) + ' steps, ' + str(rows_number) + ' rows in ' + str(round(elapsed_time, 1)) + ' s')
+    return rows_number
+
+
+def _create_loader(conf_settings):
+    # without the batch limits each step would be sent separately
+    loader_conf_settings = dict(conf_settings)
+    if not (conf_settings.get('batch_max_rows') or conf_settings.get('batch_max_bytes')):
+        loader_conf_settings['batch_max_rows'] = DEFAULT_BATCH_MAX_ROWS
+    # the linger limit makes sense only for the real time data
+    loader_conf_settings['batch_max_linger'] = None
+
+    loader_type = LoaderType[(conf_settings.get('loader_type') or LoaderType.CLICKHOUSE_DRIVER.name).upper()]
+    loader = Loader(loader_type, loader_conf_settings, PARAMETERS_NAME_STRING)
+    loader.create_session()
+    loader.connect()
+    return loader
+
+
+def _to_datetime64(times):
+    # the time of the model is the timestamp, in the database it is the local time with seconds precision.
+    # The steps of the chunk are converted once, the rows of the step have the same time
+    unique_times, inverse_indexes = np.unique(times, return_inverse=True)
+    datetimes = np.array([np.datetime64(_to_datetime(current_time), 's') for current_time in unique_times.tolist()],
+                         dtype='datetime64[s]')
+    return datetimes[inverse_indexes]
+
+
+def _to_datetime(current_time):
+    return datetime.datetime.fromtimestamp(current_time)
+
+
+def _format_time(current_time):
+    return _to_datetime(current_time).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def main():
+    # parse startup parameters from the command line
+    args_namespace = ArgParser().get_namespace()
+    # read the run settings file
+    conf_settings = ConfParser(args_namespace.settings_file_path).get_settings()
+
+    start_backfill(conf_settings)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: UTF-8 -*-
+
+from OPCDataTransfer.Simulation.VectorizedSimulation import create_simulation_model
+import numpy as np
+import multiprocessing
+import copy
+
+
+def split_simulation_parameters(model_parameters, shards_number=None):
+    # The facilities are independent of each other, so the model can be split by facilities into shards.
+    # Each shard contains the consecutive facilities (in the order of facility_settings) with their nodes.
+    # By default each facility is a separate shard
+    facilities_list = list(model_parameters.facility_settings.keys())
+    shards_number = min(shards_number or len(facilities_list), len(facilities_list))
+
+    shards_parameters_list = list()
+    for shard_facilities in np.array_split(np.arange(len(facilities_list)), shards_number):
+        shard_facilities = {facilities_list[index] for index in shard_facilities}
+        shard_parameters = copy.copy(model_parameters)
+        shard_parameters.facility_settings = _filter_structure(model_parameters.facility_settings, shard_facilities)
+        shard_parameters.facility_location = _filter_structure(getattr(model_parameters, 'facility_location', dict()),
+                                                               shard_facilities)
+        shard_parameters.facility_simulation_settings = _filter_structure(
+            model_parameters.facility_simulation_settings, shard_facilities)
+        shard_parameters.facility_controllers_parameters_settings = _filter_structure(
+            model_parameters.facility_controllers_parameters_settings, shard_facilities)
+        for key, settings in shard_parameters.facility_controllers_parameters_settings.items():
+            dependence_parameter_key = settings['dependence'][0]
+            if dependence_parameter_key is not None and dependence_parameter_key[0] not in shard_facilities:
+                raise ValueError('The parameter ' + str(key) + ' depends on the parameter of other facility ' +
+                                 str(dependence_parameter_key) + ', the model can not be split by facilities')
+        shards_parameters_list.append(shard_parameters)
+    return shards_parameters_list
+
+
+def _filter_structure(structure, facilities):
+    # key - facility_id or (facility_id, component_id, parameter)
+    return {key: settings for key, settings in structure.items()
+            if (key[0] if isinstance(key, tuple) else key) in facilities}
+
+
+class _ShardsGroup:
+    # the models of the consecutive shards, each model has its own random generator
+
+    def __init__(self, shards_parameters_list, seed_sequences_list, simulation_engine):
+        self._models_list = [create_simulation_model(simulation_engine, shard_parameters, history_required=False,
+                                                     random_generator=np.random.default_rng(seed_sequence))
+                             for shard_parameters, seed_sequence in zip(shards_parameters_list, seed_sequences_list)]
+
+    def run_steps(self, start_time, steps_number, time_step):
+        # returns the values of the tags of all shards, one row for each step
+        values_list = list()
+        for step_number in range(steps_number):
+            current_time = start_time + step_number * time_step
+            for model in self._models_list:
+                model.make_model_iteration(current_time)
+                values_list.append(model.get_current_controller_parameters_values_columns()['value'])
+        if not values_list:
+            return np.empty((0, 0))
+        return np.concatenate(values_list).reshape(steps_number, -1)
+
+
+def _run_shards_group(connection, shards_parameters_list, seed_sequences_list, simulation_engine):
+    # worker process: runs the steps on request until None is received
+    shards_group = _ShardsGroup(shards_parameters_list, seed_sequences_list, simulation_engine)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        connection.send(shards_group.run_steps(*request))
+    connection.close()
+
+
+class ParallelSimulation:
+    # The model is split by facilities into shards (see split_simulation_parameters), each shard has the random
+    # generator made from its own child of SeedSequence(seed). The shards are divided between workers_number processes
+    # (0 or 1 - in the current process) and the results are merged in time order: the rows of one step go in the order
+    # of the facilities. So with a fixed seed and shards number the output is the same for any number of workers
+
+    def __init__(self, model_parameters, simulation_engine=None, seed=None, workers_number=None, shards_number=None):
+        self._shards_groups = list()
+        self._processes = list()
+        self._connections = list()
+        self._codes_columns = None
+
+        shards_parameters_list = split_simulation_parameters(model_parameters, shards_number)
+        seed_sequences_list = np.random.SeedSequence(seed).spawn(len(shards_parameters_list))
+        workers_number = min(max(workers_number or 1, 1), len(shards_parameters_list))
+
+        groups_indexes = np.array_split(np.arange(len(shards_parameters_list)), workers_number)
+        groups_arguments = [([shards_parameters_list[index] for index in group_indexes],
+                             [seed_sequences_list[index] for index in group_indexes],
+                             simulation_engine) for group_indexes in groups_indexes]
+
+        if workers_number == 1:
+            self._shards_groups.append(_ShardsGroup(*groups_arguments[0]))
+        else:
+            for group_arguments in groups_arguments:
+                parent_connection, child_connection = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=_run_shards_group, args=(child_connection,) + group_arguments,
+                                                  name='SimulationShards', daemon=True)
+                process.start()
+                child_connection.close()
+                self._processes.append(process)
+                self._connections.append(parent_connection)
+
+        # the codes of the tags in the order of the values of one step: the models return the values in the order
+        # of the settings of the controllers parameters
+        keys_list = [key for shard_parameters in shards_parameters_list
+                     for key in shard_parameters.facility_controllers_parameters_settings]
+        self._codes_columns = {'facility': np.array([key[0] for key in keys_list], dtype=np.int64),
+                               'component': np.array([key[1] for key in keys_list], dtype=np.int64),
+                               'parameter': np.array([key[2].value for key in keys_list], dtype=np.int64)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for connection in self._connections:
+            connection.send(None)
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = list()
+        self._processes = list()
+
+    def get_tags_number(self):
+        return len(self._codes_columns['facility'])
+
+    def run_steps(self, start_time, steps_number, time_step):
+        # returns the dictionary of the columns of the data of steps_number steps, rows are sorted by time
+        if self._shards_groups:
+            values = self._shards_groups[0].run_steps(start_time, steps_number, time_step)
+        else:
+            # the workers compute the steps in parallel
+            for connection in self._connections:
+                connection.send((start_time, steps_number, time_step))
+            values = np.hstack([connection.recv() for connection in self._connections])
+
+        times = start_time + np.arange(steps_number) * time_step
+        columns_dict = {name: np.tile(column, steps_number) for name, column in self._codes_columns.items()}
+        columns_dict['value'] = values.reshape(-1)
+        columns_dict['time'] = np.repeat(times, self.get_tags_number())
+        return columns_dict
@@ -2,14 +2,17 @@
 
 import numpy as np
 import time
-import copy
 from OPCDataTransfer.ServiceFunctions import Parameters
 from OPCDataTransfer.ServiceFunctions import StatParams
+from OPCDataTransfer.ServiceFunctions import SeriesHistory
+
+# number of the last values of each parameter kept in the history of the model
+DEFAULT_HISTORY_LENGTH = 100
 
 
 class SimulationModel:
     def __init__(self, facility_controller_parameter_settings, facility_controller_cumulated_statistics_settings,
-                 facility_settings):
+                 facility_settings, history_required=True, random_generator=None, history_length=None):
         self._time = None
         self._time_previous = None
         self._facility_controller_parameter_settings = dict()
@@ -17,14 +20,21 @@ class SimulationModel:
         self._facility_settings = dict()
         self._current_controller_parameters_values = dict()
         self._last_current_controller_parameters_values = dict()
+        self._previous_values_buffer = dict()
         self._accumulated_statistics_values = dict()
         self._current_facility_parameters_values = dict()
         self._current_facility_component_state = dict()
         self._current_facility_state = dict()
         self._facility_component_structure = dict()
         self._facility_component_statistics_structure = dict()
-        self._data_history_list = list()
-
+        self._data_history = None
+        self._history_required = None
+        self._random_generator = None
+
+        # the history is used by diagrams only, it is not kept when the data is generated for the backfill
+        self._history_required = history_required
+        # numpy.random module by default, or the generator of the simulation shard
+        self._random_generator = random_generator if random_generator is not None else np.random
         self._facility_settings = facility_settings
         self._facility_controller_parameter_settings = facility_controller_parameter_settings
         self._facility_controller_cumulated_statistics_settings = facility_controller_cumulated_statistics_settings
@@ -67,11 +77,20 @@ class SimulationModel:
             structure_list = self._facility_component_structure.setdefault(key_facility, [])
             structure_list.append(key[1])
 
-    def _add_simulation_data_to_history_list(self):
-        self._data_history_list.extend(self.get_current_controller_parameters_values_list())
+        # the last history_length values of each controller parameter, the series go in the order of the settings
+        self._data_history = SeriesHistory([{'facility': key[0], 'component': key[1], 'parameter': key[2].value}
+                                            for key in facility_controller_parameter_settings],
+                                           history_length or DEFAULT_HISTORY_LENGTH)
+
+    def _add_simulation_data_to_history(self):
+        values_list = [state_dict.get('value') for state_dict in self._current_controller_parameters_values.values()]
+        self._data_history.append(np.arange(len(values_list)), values_list, self._time)
+
+    def get_data_history(self):
+        return self._data_history
 
     def get_data_history_list(self):
-        return self._data_history_list
+        return self._data_history.get_rows()
 
     def make_model_iteration(self, current_time=None):
         self._set_time(current_time)
@@ -86,19 +105,23 @@ class SimulationModel:
         for key, value in self._current_facility_state.items():
             self._compute_new_facility_state(key, value)
 
-        # remember the current state so that the _compute_new_current_parameters_values method can access to the current
-        # and previous value
-        current_controller_parameters_values_deepcopy = copy.deepcopy(self._current_controller_parameters_values)
+        # remember the current values so that the _compute_new_current_parameters_values method can access
+        # to the current and previous value. Only the values are kept, in the buffer which is not used at the moment
+        previous_values = self._previous_values_buffer
+        for key, value in self._current_controller_parameters_values.items():
+            previous_values[key] = value['value']
 
         # update current values
         for key, value in self._current_controller_parameters_values.items():
             self._compute_new_current_parameters_values(key, value)
 
-        # the current values have been updated. keep the previous values
-        for key, value in current_controller_parameters_values_deepcopy.items():
-            self._compute_last_current_controller_parameters_values(key, value)
+        # the current values have been updated. keep the previous values, the values before them are overwritten
+        # on the next iteration
+        self._previous_values_buffer = self._last_current_controller_parameters_values
+        self._last_current_controller_parameters_values = previous_values
 
-        self._add_simulation_data_to_history_list()
+        if self._history_required:
+            self._add_simulation_data_to_history()
 
     def get_current_controller_parameters_values_list(self):
         current_values_list = list()
@@ -109,6 +132,16 @@ class SimulationModel:
             current_values_list.append(current_value_dict)
         return current_values_list
 
+    def get_current_controller_parameters_values_columns(self):
+        # the same data as in get_current_controller_parameters_values_list, as a dictionary of numpy arrays
+        keys_list = list(self._current_controller_parameters_values.keys())
+        return {'facility': np.array([key[0] for key in keys_list], dtype=np.int64),
+                'component': np.array([key[1] for key in keys_list], dtype=np.int64),
+                'parameter': np.array([key[2].value for key in keys_list], dtype=np.int64),
+                'value': np.array([state_dict.get('value') for state_dict in
+                                   self._current_controller_parameters_values.values()], dtype=np.float64),
+                'time': np.full(len(keys_list), self._time)}
+
     def _set_time(self, current_time):
         # set the time. We can generate data as in current time mode (default),
         # and for generating historical data
@@ -235,10 +268,6 @@ class SimulationModel:
                     key, dict_settings, dict_state, 0, (0, 0))
                 dict_state['value'] = new_value
 
-    def _compute_last_current_controller_parameters_values(self, key, value_dict):
-        current_value = value_dict.get('value')
-        self._last_current_controller_parameters_values[key] = current_value
-
     def _set_facility_state_change_values(self, key_facility, dict_state):
         time_running_distribution = self._facility_settings.get(key_facility).get('time_running_distribution')
         self._set_state_change_values(time_running_distribution, dict_state)
@@ -339,15 +368,13 @@ class SimulationModel:
             return probability
         # elif
 
-    @staticmethod
-    def _get_random_value_with_distribution(distribution, function_type='normal'):
+    def _get_random_value_with_distribution(self, distribution, function_type='normal'):
         if function_type == 'normal':
-            return max(0, np.random.normal(distribution[0], distribution[1]))
+            return max(0, self._random_generator.normal(distribution[0], distribution[1]))
 
-    @staticmethod
-    def _make_decision_on_probability(probability):
+    def _make_decision_on_probability(self, probability):
         decision = 1
-        random = np.random.random()
+        random = self._random_generator.random()
         if random > probability:
             decision = 0
         return decision
@@ -415,11 +442,34 @@ class SimulationModel:
 
 
 class SimulationParameters:
-    def __init__(self):
-        self.facility_controllers_parameters_settings = self.set_facility_controllers_parameters_settings()
-        self.facility_simulation_settings = self.set_facility_simulation_settings()
-        self.facility_settings = self.set_facility_settings()
-        self.facility_location = self.set_facility_location()
+    # scale - number of copies of the facilities. The copy number i has the facility ids increased by 1000 * i
+    # and the component ids increased by 10000 * i
+    def __init__(self, scale=1):
+        self.facility_controllers_parameters_settings = self.scale_structure(
+            self.set_facility_controllers_parameters_settings(), scale)
+        self.facility_simulation_settings = self.scale_structure(self.set_facility_simulation_settings(), scale)
+        self.facility_settings = self.scale_structure(self.set_facility_settings(), scale)
+        self.facility_location = self.scale_structure(self.set_facility_location(), scale)
+
+    @staticmethod
+    def scale_structure(structure, scale):
+        def get_copy_key(key, copy_number):
+            # key - facility_id or (facility_id, component_id, parameter)
+            if key is None:
+                return None
+            if not isinstance(key, tuple):
+                return key + 1000 * copy_number
+            return (key[0] + 1000 * copy_number, key[1] + 10000 * copy_number) + key[2:]
+
+        scaled_structure = dict()
+        for copy_number in range(scale):
+            for key, settings in structure.items():
+                if 'dependence' in settings:
+                    settings = dict(settings)
+                    settings['dependence'] = (get_copy_key(settings['dependence'][0], copy_number),
+                                              settings['dependence'][1])
+                scaled_structure[get_copy_key(key, copy_number)] = settings
+        return scaled_structure
 
     @staticmethod
     def set_facility_controllers_parameters_settings():
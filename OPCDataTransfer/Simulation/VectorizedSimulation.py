@@ -0,0 +1,410 @@
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+import time
+from OPCDataTransfer.ServiceFunctions import Parameters
+from OPCDataTransfer.ServiceFunctions import StatParams
+from OPCDataTransfer.ServiceFunctions import SeriesHistory
+from OPCDataTransfer.Simulation.Simulation import DEFAULT_HISTORY_LENGTH
+
+
+class SimulationEngine:
+    # SimulationModel: dictionaries of states, the keys are processed one by one
+    DICT = 'dict'
+    # VectorizedSimulationModel: arrays of states, the transitions are applied to all keys at once
+    VECTORIZED = 'vectorized'
+
+
+def create_simulation_model(simulation_engine, model_parameters, history_required=True, random_generator=None,
+                            history_length=None):
+    from OPCDataTransfer.Simulation.Simulation import SimulationModel
+
+    if simulation_engine == SimulationEngine.VECTORIZED:
+        model_class = VectorizedSimulationModel
+    else:
+        model_class = SimulationModel
+    return model_class(model_parameters.facility_controllers_parameters_settings,
+                       model_parameters.facility_simulation_settings,
+                       model_parameters.facility_settings,
+                       history_required=history_required,
+                       random_generator=random_generator,
+                       history_length=history_length)
+
+
+class VectorizedSimulationModel:
+    # The same model as SimulationModel, but the states of controllers parameters, accumulated statistics,
+    # facility nodes and facilities are stored in numpy arrays (one element for each key of the settings, in the order
+    # of the settings dictionaries). None values of SimulationModel are stored as nan.
+    # The random values are drawn by arrays, so the sequence of draws differs from SimulationModel.
+
+    def __init__(self, facility_controller_parameter_settings, facility_controller_cumulated_statistics_settings,
+                 facility_settings, history_required=True, random_generator=None, history_length=None):
+        self._time = None
+        self._time_previous = None
+        self._random_generator = None
+        self._history_required = None
+        self._controller_keys = None
+        self._facility_keys = None
+        self._component_keys = None
+        self._data_history = None
+        self._history_series_indexes = None
+
+        self._random_generator = random_generator if random_generator is not None else np.random
+        self._history_required = history_required
+        self._set_controller_arrays(facility_controller_parameter_settings)
+        self._set_facility_arrays(facility_settings)
+        self._set_statistics_arrays(facility_controller_cumulated_statistics_settings)
+        self._set_dependence_levels(facility_controller_parameter_settings)
+        # the last history_length values of each controller parameter, the series go in the order of the settings
+        self._data_history = SeriesHistory([{'facility': key[0], 'component': key[1], 'parameter': key[2].value}
+                                            for key in self._controller_keys],
+                                           history_length or DEFAULT_HISTORY_LENGTH)
+        self._history_series_indexes = np.arange(len(self._controller_keys))
+
+    def _set_controller_arrays(self, settings):
+        # key - ('facility_id, component_id, controller_parameter)
+        self._controller_keys = list(settings.keys())
+        self._controller_index = {key: index for index, key in enumerate(self._controller_keys)}
+        self._controller_facility = np.array([key[0] for key in self._controller_keys], dtype=np.int64)
+        self._controller_component = np.array([key[1] for key in self._controller_keys], dtype=np.int64)
+        self._controller_parameter = np.array([key[2].value for key in self._controller_keys], dtype=np.int64)
+
+        def get_column(name, position=None):
+            return np.array([settings[key][name] if position is None else settings[key][name][position]
+                             for key in self._controller_keys], dtype=np.float64)
+
+        self._value_mean = get_column('value_distribution', 0)
+        self._value_deviation = get_column('value_distribution', 1)
+        self._state_fixed_mean = get_column('state_fixed_distribution', 0)
+        self._state_fixed_deviation = get_column('state_fixed_distribution', 1)
+        self._normal_value_upper_bound = get_column('normal_value_upper_bound')
+        self._jump_value_upper_bound = get_column('jump_value_upper_bound')
+        self._jump_value = get_column('jump_value')
+        self._probability_jump = get_column('probability_jump')
+        self._probability_jump_faulty = get_column('probability_jump_faulty')
+        self._speed_change = get_column('speed_change')
+        self._dependence_value = get_column('dependence', 1)
+
+        controllers_number = len(self._controller_keys)
+        # structures to store the current and the past values of controllers sensors (to calculate the gain)
+        self._values = np.full(controllers_number, np.nan)
+        self._last_values = np.full(controllers_number, np.nan)
+        self._time_last_state_change = np.full(controllers_number, np.nan)
+        self._state_fixed_interval = np.full(controllers_number, np.nan)
+        self._now_jumping = np.zeros(controllers_number, dtype=bool)
+
+    def _set_facility_arrays(self, settings):
+        self._facility_keys = list(settings.keys())
+        self._facility_index = {key: index for index, key in enumerate(self._facility_keys)}
+        self._probability_running = np.array([settings[key]['probability_running'] for key in self._facility_keys],
+                                             dtype=np.float64)
+        self._time_running_mean = np.array([settings[key]['time_running_distribution'][0]
+                                            for key in self._facility_keys], dtype=np.float64)
+        self._time_running_deviation = np.array([settings[key]['time_running_distribution'][1]
+                                                 for key in self._facility_keys], dtype=np.float64)
+        self._time_repair = np.array([settings[key]['time_repair'] for key in self._facility_keys], dtype=np.float64)
+
+        facilities_number = len(self._facility_keys)
+        # structure to store the current state of facilities
+        self._facility_started = np.zeros(facilities_number, dtype=bool)
+        self._facility_running = np.zeros(facilities_number, dtype=bool)
+        self._facility_breakdown = np.zeros(facilities_number, dtype=bool)
+        self._facility_time_last_state_change = np.full(facilities_number, np.nan)
+        self._facility_state_fixed_interval = np.full(facilities_number, np.nan)
+        self._facility_time_last_breakdown = np.full(facilities_number, np.nan)
+        self._controller_facility_index = np.array([self._facility_index[key[0]] for key in self._controller_keys],
+                                                   dtype=np.intp)
+
+    def _set_statistics_arrays(self, settings):
+        # key - ('facility_id, component_id, cumulated_parameter)
+        statistics_keys = list(settings.keys())
+        # the facility nodes in the order of the first statistics parameter
+        self._component_keys = list()
+        component_index = dict()
+        for key in statistics_keys:
+            if (key[0], key[1]) not in component_index:
+                component_index[(key[0], key[1])] = len(self._component_keys)
+                self._component_keys.append((key[0], key[1]))
+
+        self._statistics_component_index = np.array([component_index[(key[0], key[1])] for key in statistics_keys],
+                                                    dtype=np.intp)
+        self._statistics_facility_index = np.array([self._facility_index[key[0]] for key in statistics_keys],
+                                                   dtype=np.intp)
+        self._component_facility_index = np.array([self._facility_index[key[0]] for key in self._component_keys],
+                                                  dtype=np.intp)
+        # the nodes without statistics are never faulty
+        self._controller_component_index = np.array([component_index.get((key[0], key[1]), -1)
+                                                     for key in self._controller_keys], dtype=np.intp)
+
+        statistics_parameter = [key[2] for key in statistics_keys]
+        self._time_worked_mask = np.array([parameter == StatParams.TIME_WORKED
+                                           for parameter in statistics_parameter], dtype=bool)
+        # the controller parameter compared with the bound for the overload and jumps statistics, -1 if there is
+        # no such parameter for the node
+        overload_parameters = {StatParams.TOTAL_OVERLOAD_POWER_TIME: Parameters.POWER_CONSUMPTION,
+                               StatParams.TOTAL_OVERLOAD_TEMPERATURE_TIME: Parameters.TEMPERATURE}
+        jumps_parameters = {StatParams.TOTAL_TEMPERATURE_JUMPS: Parameters.TEMPERATURE,
+                            StatParams.TOTAL_VIBRATION_JUMPS: Parameters.VIBRATION}
+        self._overload_controller_index = self._get_statistics_controller_index(statistics_keys, overload_parameters)
+        self._jumps_controller_index = self._get_statistics_controller_index(statistics_keys, jumps_parameters)
+
+        def get_column(name, position):
+            return np.array([settings[key][name][position] for key in statistics_keys], dtype=np.float64)
+
+        self._faulty_threshold = get_column('distribution_parameters_faulty', 0)
+        self._faulty_smoothness = get_column('distribution_parameters_faulty', 1)
+        self._breakdown_threshold = get_column('distribution_parameters_breakdown', 0)
+        self._breakdown_smoothness = get_column('distribution_parameters_breakdown', 1)
+
+        # structure to store the accumulated statistical data of controllers sensors
+        self._accumulated_statistics_values = np.full(len(statistics_keys), np.nan)
+        # structure to store the current state of a specific node
+        self._component_breakdown = np.zeros(len(self._component_keys), dtype=bool)
+        self._component_faulty = np.zeros(len(self._component_keys), dtype=bool)
+
+    def _get_statistics_controller_index(self, statistics_keys, parameters_dict):
+        controller_index = np.full(len(statistics_keys), -1, dtype=np.intp)
+        for index, key in enumerate(statistics_keys):
+            if key[2] in parameters_dict:
+                controller_index[index] = self._controller_index.get((key[0], key[1], parameters_dict[key[2]]), -1)
+        return controller_index
+
+    def _set_dependence_levels(self, settings):
+        # SimulationModel updates the keys one by one, so the parameter takes the new value of the main parameter
+        # if the main parameter goes earlier in the settings, and the previous value otherwise.
+        # The keys are updated by levels: a key which takes the new value is on the next level after its main parameter
+        self._dependence_index = np.full(len(self._controller_keys), -1, dtype=np.intp)
+        levels = np.zeros(len(self._controller_keys), dtype=np.intp)
+        for index, key in enumerate(self._controller_keys):
+            dependence_index = self._controller_index.get(settings[key]['dependence'][0])
+            if dependence_index is None:
+                continue
+            self._dependence_index[index] = dependence_index
+            if dependence_index < index:
+                levels[index] = levels[dependence_index] + 1
+        self._levels_masks = [levels == level for level in range(int(levels.max(initial=0)) + 1)]
+
+    def get_data_history(self):
+        return self._data_history
+
+    def get_data_history_list(self):
+        return self._data_history.get_rows()
+
+    def get_current_controller_parameters_values_list(self):
+        return self._get_values_list(self._time, self._values)
+
+    def get_current_controller_parameters_values_columns(self):
+        # the same data as in get_current_controller_parameters_values_list, as a dictionary of numpy arrays
+        return {'facility': self._controller_facility, 'component': self._controller_component,
+                'parameter': self._controller_parameter, 'value': self._values.copy(),
+                'time': np.full(len(self._values), self._time)}
+
+    def _get_values_list(self, current_time, values):
+        return [{'facility': facility, 'component': component, 'parameter': parameter, 'value': value,
+                 'time': current_time}
+                for facility, component, parameter, value in zip(self._controller_facility.tolist(),
+                                                                 self._controller_component.tolist(),
+                                                                 self._controller_parameter.tolist(),
+                                                                 values.tolist())]
+
+    def make_model_iteration(self, current_time=None):
+        self._set_time(current_time)
+
+        # Let's calculate the accumulated values of the parameters on which the failure in the nodes depends
+        self._compute_new_facility_component_statistics()
+        self._compute_new_facility_component_state()
+        self._compute_new_facility_state()
+
+        # the previous values are kept for the next iteration, the current values are computed into the new array
+        previous_values = self._values
+        self._values = previous_values.copy()
+        self._compute_new_current_parameters_values(previous_values)
+        self._last_values = previous_values
+
+        if self._history_required:
+            self._data_history.append(self._history_series_indexes, self._values, self._time)
+
+    def _set_time(self, current_time):
+        self._time_previous = self._time
+        self._time = time.time() if current_time is None else current_time
+
+    def _compute_new_facility_component_statistics(self):
+        accumulated_values = self._accumulated_statistics_values
+        started = ~np.isnan(accumulated_values)
+        # Setting the initial values of statistics parameters for facilities nodes
+        accumulated_values[~started] = 0
+        if not started.any():
+            return
+
+        period = self._time - self._time_previous
+        # if the equipment is working, then we write the amount of time that it worked in the statistics data
+        worked = started & self._time_worked_mask & self._facility_running[self._statistics_facility_index]
+        accumulated_values[worked] += period
+
+        controller_index = self._overload_controller_index
+        overloaded = started & (controller_index >= 0)
+        overloaded[overloaded] = (self._values[controller_index[overloaded]] >
+                                  self._normal_value_upper_bound[controller_index[overloaded]])
+        accumulated_values[overloaded] += period
+
+        # a jump will be considered the excess of the current value over the previous one
+        # by more than jump_value_upper_bound times
+        controller_index = self._jumps_controller_index
+        jumped = started & (controller_index >= 0)
+        jump_index = controller_index[jumped]
+        current_values = self._values[jump_index]
+        last_values = self._last_values[jump_index]
+        increase = np.zeros(len(jump_index))
+        increased = (last_values > 0) & (current_values > last_values)
+        increase[increased] = current_values[increased] / last_values[increased] - 1
+        jumped[jumped] = increase > self._jump_value_upper_bound[jump_index]
+        accumulated_values[jumped] += 1
+
+    def _compute_new_facility_component_state(self):
+        # Based on the accumulated statistics of facilities nodes, we compute the presence of damage
+        # or total damage of nodes
+        accumulated_values = self._accumulated_statistics_values
+        faulty = self._make_decisions_failure_or_not(accumulated_values, self._faulty_threshold,
+                                                     self._faulty_smoothness)
+        breakdown = self._make_decisions_failure_or_not(accumulated_values, self._breakdown_threshold,
+                                                        self._breakdown_smoothness)
+        components_number = len(self._component_keys)
+        self._component_faulty = np.bincount(self._statistics_component_index, weights=faulty,
+                                             minlength=components_number) > 0
+        self._component_breakdown = np.bincount(self._statistics_component_index, weights=breakdown,
+                                                minlength=components_number) > 0
+
+    def _compute_new_facility_state(self):
+        running = self._facility_running
+        breakdown = self._facility_breakdown
+        failed_components = np.bincount(self._component_facility_index, weights=self._component_breakdown,
+                                        minlength=len(self._facility_keys)) > 0
+
+        starting = ~self._facility_started
+        self._facility_started[:] = True
+
+        # the facility is already broken. Let's check if it has already been repaired
+        repaired = ~starting & breakdown & (self._time - self._facility_time_last_breakdown >= self._time_repair)
+        # if the facility is working, we analyze the state of the facility nodes.
+        # If at least one node is broken, then the entire facility fails.
+        broken = ~starting & ~breakdown & running & failed_components
+        # change the facility state with a given probability
+        planned = ~starting & ~breakdown & ~broken & \
+            (self._time - self._facility_time_last_state_change >= self._facility_state_fixed_interval)
+
+        running[starting] = self._make_decisions_on_probability(self._probability_running[starting])
+        running[repaired] = True
+        breakdown[starting | repaired] = False
+        self._set_facility_state_change_values(starting | repaired)
+
+        running[broken] = False
+        breakdown[broken] = True
+        self._facility_time_last_breakdown[broken] = self._time
+
+        decisions = self._make_decisions_on_probability(self._probability_running[planned])
+        changes = decisions != running[planned]
+        changed = planned.copy()
+        changed[planned] = changes
+        running[changed] = decisions[changes]
+        self._set_facility_state_change_values(changed)
+
+        # The facility was repaired. We update statistics on its nodes that were broken
+        refreshed_components = repaired[self._component_facility_index] & self._component_breakdown
+        self._component_breakdown[refreshed_components] = False
+        self._component_faulty[refreshed_components] = False
+        self._accumulated_statistics_values[refreshed_components[self._statistics_component_index]] = 0
+
+    def _compute_new_current_parameters_values(self, previous_values):
+        values = self._values
+        starting = np.isnan(previous_values)
+        values[starting] = self._get_random_values_with_distribution(self._value_mean[starting],
+                                                                     self._value_deviation[starting])
+        self._set_controller_parameter_state_change_values(starting)
+
+        # Get the state of the node
+        facility_running = self._facility_running[self._controller_facility_index]
+        have_component = self._controller_component_index >= 0
+        component_faulty = np.zeros(len(values), dtype=bool)
+        component_faulty[have_component] = self._component_faulty[self._controller_component_index[have_component]]
+
+        # works, but there is a problem.
+        faulty = ~starting & facility_running & component_faulty
+        # works fine. We change the value in the planned mode
+        planned = ~starting & facility_running & ~component_faulty & \
+            (self._time - self._time_last_state_change >= self._state_fixed_interval)
+        # does not work. Or turned off according to plan, or there is a fault
+        # the values of all parameters are rapidly decreasing
+        stopped = ~starting & ~facility_running
+
+        probability_jump = np.where(faulty, self._probability_jump_faulty, self._probability_jump)
+        probability_jump[stopped] = 0
+        value_mean = np.where(stopped, 0, self._value_mean)
+        value_deviation = np.where(stopped, 0, self._value_deviation)
+
+        changed = faulty | planned | stopped
+        for level_mask in self._levels_masks:
+            level_changed = changed & level_mask
+            values[level_changed] = self._compute_new_values_controller_parameters(
+                level_changed, previous_values, probability_jump[level_changed], value_mean[level_changed],
+                value_deviation[level_changed])
+
+        self._set_controller_parameter_state_change_values(faulty | planned)
+
+    def _compute_new_values_controller_parameters(self, mask, previous_values, probability_jump, value_mean,
+                                                  value_deviation):
+        # the jump is only one-time. After the jump, we must return to the previous regime
+        now_jumping = self._now_jumping[mask]
+        current_values = np.where(now_jumping, self._last_values[mask], previous_values[mask])
+
+        # calculate the increment of the parameter value on which the current parameter depends.
+        # It can be greater than 1 or less than 1.if = 1, then the value has not changed
+        increment_of_main_parameter = self._compute_increments_of_main_parameters(mask)
+
+        new_values = self._get_random_values_with_distribution(value_mean, value_deviation)
+        # adjust the new value so that the time series is even
+        diff = (new_values * increment_of_main_parameter - current_values) * self._speed_change[mask]
+        new_values = np.maximum(current_values + diff, 0)
+
+        # make a jump with probability
+        jumping = self._make_decisions_on_probability(probability_jump)
+        new_values[jumping] *= self._jump_value[mask][jumping]
+        self._now_jumping[mask] = jumping
+        return new_values
+
+    def _compute_increments_of_main_parameters(self, mask):
+        dependence_index = self._dependence_index[mask]
+        increment = np.ones(len(dependence_index))
+        dependent = dependence_index >= 0
+        last_values = self._last_values[dependence_index[dependent]]
+        current_values = self._values[dependence_index[dependent]]
+        dependence_value = self._dependence_value[mask][dependent]
+
+        # Can increase by no more than 2 times
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dependent_increment = np.minimum((current_values / last_values - 1) * dependence_value + 1, 2)
+        increment[dependent] = np.where((last_values == 0) | np.isnan(last_values), 1, dependent_increment)
+        return increment
+
+    def _set_facility_state_change_values(self, mask):
+        self._facility_time_last_state_change[mask] = self._time
+        self._facility_state_fixed_interval[mask] = self._get_random_values_with_distribution(
+            self._time_running_mean[mask], self._time_running_deviation[mask])
+
+    def _set_controller_parameter_state_change_values(self, mask):
+        self._time_last_state_change[mask] = self._time
+        self._state_fixed_interval[mask] = self._get_random_values_with_distribution(
+            self._state_fixed_mean[mask], self._state_fixed_deviation[mask])
+
+    def _get_random_values_with_distribution(self, mean, deviation):
+        if not len(mean):
+            return np.empty(0)
+        return np.maximum(0, self._random_generator.normal(mean, deviation))
+
+    def _make_decisions_on_probability(self, probability):
+        return self._random_generator.random(len(probability)) <= probability
+
+    def _make_decisions_failure_or_not(self, current_values, threshold, smoothness):
+        # overflow error for very large exponent values
+        value_for_exp = (threshold - current_values) * smoothness
+        probability = np.where(value_for_exp < 100, 1 / (1 + np.exp(np.minimum(value_for_exp, 100))), 0)
+        return self._make_decisions_on_probability(probability)
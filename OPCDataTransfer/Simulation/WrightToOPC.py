@@ -5,55 +5,91 @@ from OPCDataTransfer import ConnectionOPC
 from OPCDataTransfer import Simulation
 from OPCDataTransfer import Visualization
 from OPCDataTransfer.ServiceFunctions import ArgParser
+from OPCDataTransfer.ServiceFunctions import create_profiler
+from OPCDataTransfer.ServiceFunctions import FixedRateScheduler
+from OPCDataTransfer.ServiceFunctions import SeriesHistory
+from OPCDataTransfer.ServiceFunctions import StageMetrics
+from OPCDataTransfer.ServiceFunctions import MetricsExporter
+from OPCDataTransfer.ServiceFunctions import Stage
 from OPCDataTransfer import ConfParser
+import contextlib
 import time
 
 
-def start_writing_data_to_opc_server(conf_settings):
+def start_writing_data_to_opc_server(conf_settings, profiler=None):
     plotting_required = conf_settings['plotting_required']
 
     # establish a client connection with OPC server
-    with ConnectionOPC(conf_settings) as opc_client:
+    with ConnectionOPC(conf_settings) as opc_client, contextlib.ExitStack() as exit_stack:
+        metrics = StageMetrics()
+        opc_client.set_metrics(metrics)
+        if conf_settings.get('metrics_port') or conf_settings.get('metrics_file_path'):
+            exit_stack.enter_context(MetricsExporter(metrics, conf_settings))
 
         # initialize simulation model
         model_parameters = Simulation.SimulationParameters()
-        simulation_model = Simulation.SimulationModel(model_parameters.facility_controllers_parameters_settings,
-                                                      model_parameters.facility_simulation_settings,
-                                                      model_parameters.facility_settings)
+        simulation_model = Simulation.create_simulation_model(conf_settings.get('simulation_engine'), model_parameters,
+                                                              history_required=False)
+        # the values of the model are mapped to the OPC items once, only the changed values are written
+        opc_writer = opc_client.create_writer(simulation_model.get_current_controller_parameters_values_columns())
 
-        # initialize diagram
+        # initialize diagram. It is drawn in a separate process, which reads the last diagram_series_len values
+        # of each tag from the shared history
         if plotting_required:
-            data_figure = Visualization.DataFigure(opc_client.get_codes_plotting_names_dict(),
-                                                   opc_client.get_opc_names_codes_dict(),
-                                                   conf_settings['diagram_split_keys'],
-                                                   conf_settings['diagram_series_len'])
+            data_history = SeriesHistory(list(opc_client.get_opc_names_codes_dict().values()),
+                                         conf_settings['diagram_series_len'], shared=True)
+            exit_stack.enter_context(Visualization.PlottingProcess(data_history,
+                                                                   opc_client.get_codes_plotting_names_dict(),
+                                                                   opc_client.get_opc_names_codes_dict(),
+                                                                   conf_settings['diagram_split_keys'],
+                                                                   conf_settings['diagram_series_len'],
+                                                                   conf_settings.get('diagram_blit_required'),
+                                                                   conf_settings.get('diagram_refresh_period'),
+                                                                   conf_settings.get('diagram_snapshot_directory_path'),
+                                                                   conf_settings.get('diagram_snapshot_format')))
 
         current_time = conf_settings['simulation_start_time']
         simulation_time_step = conf_settings['simulation_time_step']
+        scheduler = FixedRateScheduler(opc_client.get_frequency(), conf_settings.get('missed_ticks_policy'))
+        metrics.set_scheduler(scheduler)
+        if profiler is not None:
+            profiler.start()
         while True:
+            scheduler.wait_next_tick()
+            cycle_start_time = time.perf_counter()
+
             # generate new data from simulation model
             simulation_model.make_model_iteration(current_time)
 
-            # send data to OPC server
-            list_opc_data = opc_client.convert_simulation_data_to_opc_data(
-                 simulation_model.get_current_controller_parameters_values_list())
-            opc_client.write(list_opc_data)
+            # send the changed data to OPC server in chunks, the latency of each chunk is measured by the writer
+            model_columns = simulation_model.get_current_controller_parameters_values_columns()
+            written_number = opc_writer.write_values(model_columns['value'])
 
             # display data on diagram
             if plotting_required:
-                data_figure.plot_top_values_from_history_list(simulation_model.get_data_history_list())
+                data_history.append_columns(model_columns)
+
+            metrics.observe(Stage.CYCLE, time.perf_counter() - cycle_start_time, written_number)
+
+            if profiler is not None and not profiler.count_cycle():
+                break
 
             current_time += simulation_time_step
-            time.sleep(opc_client.get_frequency())
 
 
 def main():
     # parse startup parameters from the command line
-    args_namespace = ArgParser().get_namespace()
+    args_namespace = ArgParser(profiling_required=True).get_namespace()
     # read the run settings file
     conf_settings = ConfParser(args_namespace.settings_file_path).get_settings()
 
-    start_writing_data_to_opc_server(conf_settings)
+    # with --profile the cycles are profiled and the program stops after --profile_cycles or --profile_seconds
+    profiler = create_profiler(args_namespace, 'DataWriterToOPC')
+    if profiler is None:
+        start_writing_data_to_opc_server(conf_settings)
+        return
+    with profiler:
+        start_writing_data_to_opc_server(conf_settings, profiler)
 
 
 if __name__ == '__main__':
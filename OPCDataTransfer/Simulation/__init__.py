@@ -1,2 +1,6 @@
 from .Simulation import SimulationParameters
 from .Simulation import SimulationModel
+from .VectorizedSimulation import VectorizedSimulationModel
+from .VectorizedSimulation import SimulationEngine
+from .VectorizedSimulation import create_simulation_model
+from .ParallelSimulation import ParallelSimulation
@@ -2,13 +2,21 @@
 
 import pandas as pd
 import numpy as np
-import datetime
+from OPCDataTransfer.ServiceFunctions.SeriesHistory import get_wall_clock_seconds
+
+# maximum number of the formatted time labels kept for the next redraws
+TIME_LABELS_CACHE_SIZE = 100000
+_time_labels_cache = dict()
 
 
 def list_of_structures_to_pandas_dataframe(data_list):
     return pd.DataFrame(data_list)
 
 
+def dict_of_arrays_to_list_of_structures(dict_of_arrays):
+    return pd.DataFrame(dict_of_arrays).to_dict('records')
+
+
 def list_of_structures_to_numpy_array(data_list):
     values = [tuple(each.values()) for each in data_list]
     array = np.array(values)
@@ -43,27 +51,34 @@ def reorder_columns_in_dataframe(dataframe, ordered_name_list):
     return dataframe[ordered_name_list]
 
 
-def split_pandas_dataframe_to_numpy_arrays_by_unique_keys(dataframe, split_keys_relations_list):
-    dict_of_data = {}
-    filtered_dataframe_by_key = pd.DataFrame()
-    for split_key, key_dicts_list in split_keys_relations_list.items():
-        for key_dict in key_dicts_list:
-            filtered_dataframe_by_key = select_rows_in_dataframe_by_dict(dataframe, key_dict)
-            dict_of_data[tuple(key_dict.values())] = filtered_dataframe_by_key['value'].to_numpy()
-
-    # The time grid is the same for all values
-    time_array = _convert_to_time(filtered_dataframe_by_key['time'].to_numpy())
-
-    return dict_of_data, time_array
+def convert_to_time(time_array, wall_clock=False):
+    # labels 'MM:SS' of the times: datetime64, datetime objects, OPC time strings or timestamps (seconds since
+    # the epoch, converted to the local time with the offset of their own time zone). With wall_clock=True
+    # the numbers are already the seconds of the local time since 1970 (the times of SeriesHistory) and are taken
+    # as they are. The labels of nan times are empty
+    time_array = np.asarray(time_array)
+    if wall_clock and np.issubdtype(time_array.dtype, np.number):
+        seconds = time_array.astype(np.float64)
+    else:
+        seconds = np.asarray(get_wall_clock_seconds(time_array), dtype=np.float64)
 
+    time_arr_formatted = np.full(seconds.shape, '', dtype=np.dtype('U10'))
+    finite = np.isfinite(seconds)
+    unique_seconds, inverse_indexes = np.unique(np.floor(seconds[finite]).astype(np.int64), return_inverse=True)
+    time_arr_formatted[finite] = _get_time_labels(unique_seconds)[inverse_indexes.reshape(-1)]
+    return time_arr_formatted
 
-def _convert_to_time(time_array):
-    time_arr_formatted = np.empty(len(time_array), dtype=np.dtype('U10'))
-    for i in range(len(time_array)):
-        value = time_array[i]
-        if type(value) == np.dtype('str'):
-            time_arr_formatted[i] = value.split(' ')[1].split(':', 1)[1]
-        elif type(value) == np.dtype('float'):
-            time_arr_formatted[i] = str(datetime.timedelta(seconds=value)).split(',')[1].split('.')[0].split(':', 1)[1]
 
-    return time_arr_formatted
+def _get_time_labels(unique_seconds):
+    # the labels are formatted only for the seconds which are not in the cache yet
+    missing_seconds = np.array([value for value in unique_seconds.tolist() if value not in _time_labels_cache],
+                               dtype=np.int64)
+    if len(_time_labels_cache) + len(missing_seconds) > TIME_LABELS_CACHE_SIZE:
+        _time_labels_cache.clear()
+        missing_seconds = unique_seconds
+    if len(missing_seconds):
+        minutes = np.char.zfill((missing_seconds // 60 % 60).astype(np.str_), 2)
+        seconds = np.char.zfill((missing_seconds % 60).astype(np.str_), 2)
+        _time_labels_cache.update(zip(missing_seconds.tolist(), np.char.add(np.char.add(minutes, ':'),
+                                                                            seconds).tolist()))
+    return np.array([_time_labels_cache[value] for value in unique_seconds.tolist()], dtype=np.dtype('U10'))
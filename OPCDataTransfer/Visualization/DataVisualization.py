@@ -1,12 +1,30 @@
 # -*- coding: UTF-8 -*-
 
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.ticker import FuncFormatter
 from OPCDataTransfer.Visualization import ArrayFunctions
+import numpy as np
+import os
+
+# part of the data range added to the limits of the axes when they are changed
+LIMITS_MARGIN = 0.25
+# size of the snapshot of one diagram in inches
+SNAPSHOT_FIGURE_SIZE = (10, 4)
+
+
+class SnapshotFormat:
+    PNG = 'png'
+    SVG = 'svg'
 
 
 class DataFigure:
+    # The diagrams are shown in the window, or in the headless mode (snapshot_directory_path is set) each diagram
+    # is a separate figure of the non-interactive backend, which is written to the file by write_snapshots
 
-    def __init__(self, codes_plotting_names_dict, opc_names_codes_dict, diagram_split_keys_string, diagram_series_len):
+    def __init__(self, codes_plotting_names_dict, opc_names_codes_dict, diagram_split_keys_string, diagram_series_len,
+                 blit_required=False, snapshot_directory_path=None, snapshot_format=None):
         self._diagram_split_keys_name_list = list()
         self._diagram_series_name_list = list()
         self._diagram_split_keys_relations = dict()
@@ -14,28 +32,61 @@ class DataFigure:
         self._split_keys_axes = None
         self._facility_keys_axes = None
         self._codes_plotting_names_dict = None
-        self._x_points_number_in_history_list = None
-
-        plt.ion()
+        self._diagram_series_len = None
+        self._series_codes_dicts_list = list()
+        self._axes_series_slices = dict()
+        self._indexed_history = None
+        self._history_series_indexes = None
+        self._series_lines = list()
+        self._blit_required = None
+        self._axes_backgrounds = dict()
+        self._snapshot_directory_path = None
+        self._snapshot_format = None
+        self._snapshot_file_names = dict()
+        self._snapshot_write_counts = None
 
         self._set_diagram_split_keys_name_list(diagram_split_keys_string)
         self._set_diagram_series_name_list(opc_names_codes_dict)
         self._set_diagram_split_keys_relations(opc_names_codes_dict)
         diagram_split_keys_list_of_tuples = list(self._diagram_split_keys_relations.keys())
 
-        fig, axes = plt.subplots(nrows=len(diagram_split_keys_list_of_tuples))
-        self._figure = fig
-        # bind axes to diagram_split_keys
-        self._split_keys_axes = dict(zip(diagram_split_keys_list_of_tuples, axes))
+        self._snapshot_directory_path = snapshot_directory_path
+        if self._snapshot_directory_path:
+            self._set_snapshot_figures(diagram_split_keys_list_of_tuples, snapshot_format)
+        else:
+            plt.ion()
+            fig, axes = plt.subplots(nrows=len(diagram_split_keys_list_of_tuples), squeeze=False)
+            self._figure = fig
+            # bind axes to diagram_split_keys
+            self._split_keys_axes = dict(zip(diagram_split_keys_list_of_tuples, axes[:, 0]))
 
         self._codes_plotting_names_dict = codes_plotting_names_dict
-        self._x_points_number_in_history_list = diagram_series_len * len(opc_names_codes_dict)
+        self._diagram_series_len = diagram_series_len
+        self._blit_required = bool(blit_required) and self._figure is not None and self._figure.canvas.supports_blit
+        self._create_lines()
+        # the number of values of each series at the last snapshot
+        self._snapshot_write_counts = np.zeros(len(self._series_lines), dtype=np.int64)
 
     def __enter__(self):
         return self
 
     def __exit__(self, *args):
-        plt.close()
+        if self._figure is not None:
+            plt.close(self._figure)
+
+    def _set_snapshot_figures(self, diagram_split_keys_list_of_tuples, snapshot_format):
+        self._snapshot_format = (snapshot_format or SnapshotFormat.PNG).lower()
+        os.makedirs(self._snapshot_directory_path, exist_ok=True)
+        self._split_keys_axes = dict()
+        for split_key_tuple in diagram_split_keys_list_of_tuples:
+            # the figures are not registered in pyplot, so no window is created
+            figure = Figure(figsize=SNAPSHOT_FIGURE_SIZE)
+            FigureCanvasAgg(figure)
+            ax = figure.add_subplot(1, 1, 1)
+            self._split_keys_axes[split_key_tuple] = ax
+            keys_string = '_'.join(str(name) + '_' + str(code)
+                                   for name, code in zip(self._diagram_split_keys_name_list, split_key_tuple))
+            self._snapshot_file_names[ax] = 'diagram_' + keys_string + '.' + self._snapshot_format
 
     def _set_diagram_split_keys_name_list(self, diagram_split_keys_string):
         self._diagram_split_keys_name_list = diagram_split_keys_string.replace(' ', '').split(',')
@@ -58,33 +109,144 @@ class DataFigure:
             filtered_dataframe = ArrayFunctions.select_rows_in_dataframe_by_dict(dataframe, keys_dict)
             relations_dict[tuple(keys_dict.values())] = filtered_dataframe.to_dict('records')
         self._diagram_split_keys_relations = relations_dict
+        # all series of the diagrams in the order of the axes, the data of the series is gathered in this order
+        self._series_codes_dicts_list = [series_key_dict for key_dicts_list in relations_dict.values()
+                                         for series_key_dict in key_dicts_list]
 
-    def plot_top_values_from_history_list(self, data_history_list):
-        if not data_history_list:
-            return
+    def _set_history_series_indexes(self, series_history):
+        # index of each series of the diagrams in the history (-1 if the history doesn't contain the series),
+        # computed once for the history
+        code_names_list = series_history.get_code_names_list()
+        series_indexes_list = list()
+        for series_key_dict in self._series_codes_dicts_list:
+            series_index = series_history.get_series_index(tuple(series_key_dict.get(name)
+                                                                 for name in code_names_list))
+            series_indexes_list.append(-1 if series_index is None else series_index)
+        self._history_series_indexes = np.array(series_indexes_list, dtype=np.intp)
+        self._indexed_history = series_history
 
-        dataframe = ArrayFunctions.list_of_structures_to_pandas_dataframe(
-                    ArrayFunctions.get_last_n_rows_in_list(data_history_list, self._x_points_number_in_history_list))
-        dataframe = ArrayFunctions.reorder_columns_in_dataframe(dataframe, self._diagram_split_keys_name_list
-                                                                + self._diagram_series_name_list
-                                                                + ['value', 'time'])
-        dict_of_data_arrays, time_array = ArrayFunctions.split_pandas_dataframe_to_numpy_arrays_by_unique_keys(
-            dataframe, self._diagram_split_keys_relations)
-        self._plot_dict_of_arrays(dict_of_data_arrays, time_array)
+    def plot_history(self, series_history):
+        # series_history - SeriesHistory with the data of the tags, the last diagram_series_len points are plotted.
+        # Returns False if the frame is dropped: the history was being written by another process during the reading
+        if self._indexed_history is not series_history:
+            self._set_history_series_indexes(series_history)
+
+        series_block = series_history.read_series_block(self._history_series_indexes, self._diagram_series_len)
+        if series_block is None:
+            return False
+        self._plot_series_arrays(*series_block)
+        return True
+
+    def write_snapshots(self, series_history):
+        # headless mode: writes the files of the diagrams, whose series have got new values since the last snapshot.
+        # Returns the number of the written files
+        if self._indexed_history is not series_history:
+            self._set_history_series_indexes(series_history)
+
+        # the unknown series (index -1) get the last element, which is always 0
+        write_counts = np.append(series_history.get_write_counts(), 0)[self._history_series_indexes]
+        changed_axes_list = [ax for ax, series_slice in self._axes_series_slices.items()
+                             if not np.array_equal(write_counts[series_slice],
+                                                   self._snapshot_write_counts[series_slice])]
+        if not changed_axes_list:
+            return 0
+        series_block = series_history.read_series_block(self._history_series_indexes, self._diagram_series_len)
+        if series_block is None:
+            return 0
+
+        times, values = series_block
+        for ax in changed_axes_list:
+            series_slice = self._axes_series_slices[ax]
+            for line, series_times, series_values in zip(self._series_lines[series_slice], times[series_slice],
+                                                         values[series_slice]):
+                line.set_data(series_times, series_values)
+            self._update_limits(ax, times[series_slice], values[series_slice])
+            self._save_snapshot(ax)
+            self._snapshot_write_counts[series_slice] = write_counts[series_slice]
+        return len(changed_axes_list)
+
+    def _save_snapshot(self, ax):
+        # the file is replaced at once, so the readers never see the partly written file
+        file_path = os.path.join(self._snapshot_directory_path, self._snapshot_file_names[ax])
+        temporary_file_path = file_path + '.tmp'
+        ax.figure.savefig(temporary_file_path, format=self._snapshot_format)
+        os.replace(temporary_file_path, file_path)
+
+    def is_headless(self):
+        return bool(self._snapshot_directory_path)
+
+    def is_open(self):
+        # False after the window of the figure is closed
+        return self.is_headless() or plt.fignum_exists(self._figure.number)
 
-    def _plot_dict_of_arrays(self, dict_of_data_arrays, time_array):
+    def process_events(self, timeout):
+        # runs the event loop of the window (moving, resizing) for timeout seconds without redrawing the figure
+        self._figure.canvas.start_event_loop(timeout)
+
+    def _create_lines(self):
+        # the lines, labels and legends are created once, on each redraw only the data of the lines is changed
         for split_key_tuple, ax in self._split_keys_axes.items():
-            ax.clear()
             ax.set_xlabel("time")
             ax.set_ylabel(self._get_string_name_of_tags('y_label', split_key_tuple))
+            ax.xaxis.set_major_formatter(FuncFormatter(_format_time_tick))
+            first_series_number = len(self._series_lines)
             for series_key_dict in self._diagram_split_keys_relations[split_key_tuple]:
-                array = dict_of_data_arrays[tuple(series_key_dict.values())]
-                ax.plot(time_array, array,
-                        label=self._get_string_name_of_tags('line_label', series_key_dict))
-            ax.legend(loc='lower left', fontsize=8, shadow=False, ncol=2)
-        # plt.pause(0.0001)
-        plt.draw()
-        plt.gcf().canvas.flush_events()
+                line, = ax.plot([], [], label=self._get_string_name_of_tags('line_label', series_key_dict),
+                                animated=self._blit_required)
+                self._series_lines.append(line)
+            self._axes_series_slices[ax] = slice(first_series_number, len(self._series_lines))
+            if any(not line.get_label().startswith('_') for line in ax.get_lines()):
+                ax.legend(loc='lower left', fontsize=8, shadow=False, ncol=2)
+
+        if self._blit_required:
+            self._figure.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _on_draw(self, event):
+        # the full redraw (rescaling, resizing of the window): the backgrounds of the axes without the lines are saved
+        # for blitting
+        for ax in self._split_keys_axes.values():
+            self._axes_backgrounds[ax] = self._figure.canvas.copy_from_bbox(ax.bbox)
+            self._draw_lines(ax)
+
+    def _draw_lines(self, ax):
+        for line in ax.get_lines():
+            ax.draw_artist(line)
+
+    def _plot_series_arrays(self, times, values):
+        # times, values - arrays with one row for each series in the order of the lines
+        for line, series_times, series_values in zip(self._series_lines, times, values):
+            line.set_data(series_times, series_values)
+
+        limits_changed = False
+        for ax, series_slice in self._axes_series_slices.items():
+            limits_changed = self._update_limits(ax, times[series_slice], values[series_slice]) or limits_changed
+
+        canvas = self._figure.canvas
+        if not self._blit_required or limits_changed or not self._axes_backgrounds:
+            # the ticks and labels are changed, the whole figure is redrawn
+            canvas.draw_idle()
+        else:
+            for ax in self._split_keys_axes.values():
+                canvas.restore_region(self._axes_backgrounds[ax])
+                self._draw_lines(ax)
+                canvas.blit(ax.bbox)
+        canvas.flush_events()
+
+    def _update_limits(self, ax, times, values):
+        # The limits are changed only when the data goes out of them or takes less than a half of them.
+        # The margins are added in the direction of the data growth, so the limits are changed once in several redraws
+        x_array = times[np.isfinite(times)]
+        y_array = values[np.isfinite(values)]
+        if not len(x_array) or not len(y_array):
+            return False
+
+        x_limits = _get_new_limits(ax.get_xlim(), x_array.min(), x_array.max(), LIMITS_MARGIN, 0)
+        y_limits = _get_new_limits(ax.get_ylim(), y_array.min(), y_array.max(), LIMITS_MARGIN, LIMITS_MARGIN)
+        if x_limits is not None:
+            ax.set_xlim(x_limits)
+        if y_limits is not None:
+            ax.set_ylim(y_limits)
+        return x_limits is not None or y_limits is not None
 
     def _get_string_name_of_tags(self, label_type, tag_codes):
         key_dict = dict()
@@ -106,3 +268,17 @@ class DataFigure:
         if opc_name is None:
             opc_name = ''
         return opc_name
+
+
+def _get_new_limits(limits, data_min, data_max, upper_margin, lower_margin):
+    # returns None if the data fits the current limits
+    lower_limit, upper_limit = limits
+    data_range = max(data_max - data_min, abs(data_max) * 1e-3, 1e-9)
+    if lower_limit <= data_min and data_max <= upper_limit and upper_limit - lower_limit <= 2 * data_range:
+        return None
+    return data_min - data_range * lower_margin, data_max + data_range * upper_margin
+
+
+def _format_time_tick(value, position=None):
+    # the time on the axis is the seconds of the local time since 1970-01-01
+    return ArrayFunctions.convert_to_time(np.array([value], dtype=np.float64), wall_clock=True)[0]
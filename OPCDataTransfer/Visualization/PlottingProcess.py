@@ -0,0 +1,71 @@
+# -*- coding: UTF-8 -*-
+
+from OPCDataTransfer.Visualization.DataVisualization import DataFigure
+import multiprocessing
+
+# how often the diagram is redrawn if the refresh period is not set, in seconds
+DEFAULT_REFRESH_PERIOD = 0.5
+# how long the plotting process is waited for on closing before it is terminated, in seconds
+_JOIN_TIMEOUT = 5.0
+
+
+def _run_figure(series_history, figure_arguments, refresh_period, stop_event):
+    # plotting process: redraws the figure when the history is changed, until the stop or the closing of the window
+    with DataFigure(*figure_arguments) as data_figure:
+        if data_figure.is_headless():
+            # the files of the unchanged diagrams are not rewritten
+            while not stop_event.wait(refresh_period):
+                data_figure.write_snapshots(series_history)
+            # the data written after the last refresh
+            data_figure.write_snapshots(series_history)
+            return
+
+        last_sequence_number = None
+        while not stop_event.is_set() and data_figure.is_open():
+            sequence_number = series_history.get_sequence_number()
+            if sequence_number != last_sequence_number and data_figure.plot_history(series_history):
+                last_sequence_number = sequence_number
+            data_figure.process_events(refresh_period)
+
+
+class PlottingProcess:
+    # DataFigure in a separate process, so the drawing and the events of the window don't delay the polling.
+    # The data goes through the shared SeriesHistory: the polling loop only writes to it, and the plotting process
+    # reads its last state once in refresh_period seconds. The writer never waits for the reader: if the reading
+    # overlaps a write, the frame is dropped and the data is read again on the next refresh.
+    # With snapshot_directory_path the diagrams are written to the files instead of the window (see DataFigure)
+
+    def __init__(self, series_history, codes_plotting_names_dict, opc_names_codes_dict, diagram_split_keys_string,
+                 diagram_series_len, blit_required=False, refresh_period=None, snapshot_directory_path=None,
+                 snapshot_format=None):
+        self._process = None
+        self._stop_event = None
+
+        # the new process doesn't inherit the state of the polling process (the connections, the GUI)
+        context = multiprocessing.get_context('spawn')
+        self._stop_event = context.Event()
+        figure_arguments = (codes_plotting_names_dict, opc_names_codes_dict, diagram_split_keys_string,
+                            diagram_series_len, blit_required, snapshot_directory_path, snapshot_format)
+        self._process = context.Process(target=_run_figure,
+                                        args=(series_history, figure_arguments,
+                                              refresh_period or DEFAULT_REFRESH_PERIOD, self._stop_event),
+                                        name='DataFigure', daemon=True)
+        self._process.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._process is None:
+            return
+        self._stop_event.set()
+        self._process.join(_JOIN_TIMEOUT)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+
+    def is_alive(self):
+        return self._process is not None and self._process.is_alive()
@@ -1 +1,2 @@
 from .DataVisualization import DataFigure
+from .PlottingProcess import PlottingProcess
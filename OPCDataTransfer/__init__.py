@@ -1,5 +1,8 @@
 from .OPC import ConnectionOPC
 from .Loader import Loader
 from .Loader import LoaderType
+from .Loader import InsertMode
 from .ServiceFunctions import ConfParser
+from .Pipeline import DataPipeline
 from .DataTransfer import start_transfer_data_from_opc_server
+from .DataTransfer import transfer_data
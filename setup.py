@@ -23,13 +23,15 @@ setup(
         "Operating System :: Microsoft :: Windows"
     ],
     install_requires=[
-        'OpenOPC-Python3x', 'pypiwin32', 'clickhouse_driver', 'requests', 'pandas', 'matplotlib'
+        'OpenOPC-Python3x', 'pypiwin32', 'clickhouse_driver', 'requests', 'kafka-python', 'numpy', 'pandas',
+        'matplotlib'
     ],
     python_requires='>=3.6-32',
     entry_points={
        'console_scripts': [
            'DataTransfer = OPCDataTransfer.DataTransfer:main',
-           'DataWriterToOPC = OPCDataTransfer.Simulation.WrightToOPC:main'
+           'DataWriterToOPC = OPCDataTransfer.Simulation.WrightToOPC:main',
+           'DataBackfill = OPCDataTransfer.Simulation.Backfill:main'
            ]
     }
 )